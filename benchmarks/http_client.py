@@ -0,0 +1,103 @@
+"""Compares the latency of outbound calls made with a new session per request, as before, against the shared client.
+
+Each simulated request makes --calls calls, like validating the JWT then calling a dependency, to a local stand-in
+server that keeps connections alive. Requests are made by --threads threads at once, like the web server's workers.
+
+Usage:
+    python -m benchmarks.http_client [--requests 2000] [--calls 2] [--threads 8] [--delay-ms 0]
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from llc1_document_api.app import (RequestClient, RequestsSessionTimeout,
+                                   pooled_session)
+
+BODY = json.dumps({"status": "OK"}).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so that connections are kept alive, as they are by the APIs behind their load balancer
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which with Nagle's algorithm would wait for the client's delayed ACK
+    disable_nagle_algorithm = True
+    delay = 0
+
+    def do_GET(self):  # noqa: N802
+        if self.delay:
+            time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def session_per_request(url, calls, trace_id):
+    requests = RequestsSessionTimeout()
+    requests.headers.update({'X-Trace-ID': trace_id})
+    try:
+        for _ in range(calls):
+            requests.get(url).raise_for_status()
+    finally:
+        requests.close()
+
+
+def shared_client(session):
+    def run(url, calls, trace_id):
+        requests = RequestClient(session, {'X-Trace-ID': trace_id})
+        for _ in range(calls):
+            requests.get(url).raise_for_status()
+    return run
+
+
+def timed(make_request, url, args):
+    def one(index):
+        started = time.perf_counter()
+        make_request(url, args.calls, str(index))
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = sorted(executor.map(one, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1], args.requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--calls', type=int, default=2, help="Outbound calls per request")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--delay-ms', type=float, default=0, help="Time the stand-in server takes to respond")
+    args = parser.parse_args()
+
+    StandInHandler.delay = args.delay_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root = "http://127.0.0.1:{}".format(server.server_address[1])
+    url = root + "/v1.0/llc1"
+
+    try:
+        session = pooled_session({root: args.threads})
+        results = [("session per request", timed(session_per_request, url, args)),
+                   ("shared client", timed(shared_client(session), url, args))]
+    finally:
+        server.shutdown()
+
+    print("\n{} requests of {} calls, {} threads".format(args.requests, args.calls, args.threads))
+    for name, (median_ms, p99_ms, throughput) in results:
+        print("  {:20} median {:7.2f}ms  p99 {:7.2f}ms  {:8.0f} requests/s".format(name, median_ms, p99_ms,
+                                                                                   throughput))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Compares validating generate_async request bodies as before, parsed twice with the schema compiled on every call,
+against parsing once with the precompiled validator, whose schema has its definitions inlined.
+
+Bodies are FeatureCollections of polygons with enough vertices to reach each size. Doesn't need a database.
+
+Usage:
+    python -m benchmarks.payload_validation [--sizes 1 5 10] [--repeats 5]
+"""
+import argparse
+import json
+import math
+import statistics
+import time
+
+import simplejson
+from jsonschema import validate
+from llc1_document_api.schema.extents import PAYLOAD_SCHEMA
+from llc1_document_api.validators.payload_validator import PayloadValidator
+
+# A vertex like [512345.123456, 212345.123456] is about 32 bytes serialised
+VERTEX_BYTES = 32
+VERTICES_PER_POLYGON = 5000
+
+
+def polygon(centre_x, centre_y, vertices):
+    ring = []
+    for index in range(vertices):
+        angle = 2 * math.pi * index / vertices
+        ring.append([round(centre_x + 1000 * math.cos(angle), 6), round(centre_y + 1000 * math.sin(angle), 6)])
+    ring.append(ring[0])
+    return {"type": "Feature", "properties": None, "geometry": {"type": "Polygon", "coordinates": [ring]}}
+
+
+def body(megabytes):
+    polygons = max(1, megabytes * 1024 * 1024 // (VERTEX_BYTES * VERTICES_PER_POLYGON))
+    features = [polygon(500000.123456 + index * 3000, 200000.123456, VERTICES_PER_POLYGON)
+                for index in range(polygons)]
+    return json.dumps({"source": "Benchmark", "description": "benchmark extent",
+                       "extents": {"type": "FeatureCollection", "features": features}}).encode('utf-8')
+
+
+def before(data):
+    """Validation as it was, followed by the view parsing the body again with request.get_json()."""
+    validate(simplejson.loads(data), PAYLOAD_SCHEMA)
+    return json.loads(data)
+
+
+def after(data):
+    return PayloadValidator.validate(data)
+
+
+def timed(function, data, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function(data)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10], help="Body sizes in MB")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    for megabytes in args.sizes:
+        data = body(megabytes)
+        if before(data) != after(data):
+            raise AssertionError("Validation returned a different request for {}MB".format(megabytes))
+        before_ms = timed(before, data, args.repeats)
+        after_ms = timed(after, data, args.repeats)
+        print("\n{:.1f}MB body".format(len(data) / 1024 / 1024))
+        print("  parsed twice, compiled per call: {:8.1f}ms".format(before_ms))
+        print("  parsed once, precompiled:        {:8.1f}ms ({:.1f}x)".format(after_ms, before_ms / after_ms))
+
+
+if __name__ == '__main__':
+    main()
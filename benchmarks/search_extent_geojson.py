@@ -0,0 +1,52 @@
+"""Compares SearchItem.to_dict throughput with search_extent built by Shapely and by PostGIS ST_AsGeoJSON.
+
+Usage:
+    BENCHMARK_DATABASE_URI=postgresql://... python -m benchmarks.search_extent_geojson [--rows 100000]
+"""
+import argparse
+import time
+
+from benchmarks import seed
+from llc1_document_api.models import SearchItem
+from sqlalchemy.orm import Session, undefer
+
+
+def rows_per_second(connection, geojson):
+    with Session(bind=connection) as session:
+        query = session.query(SearchItem).order_by(SearchItem.date_of_search).options(undefer(SearchItem.charges))
+        if geojson:
+            query = query.options(undefer(SearchItem.search_extent_geojson))
+        else:
+            query = query.options(undefer(SearchItem.search_geom))
+        started = time.perf_counter()
+        count = 0
+        for search_item in query.yield_per(500):
+            search_item.to_dict()
+            count += 1
+        return count / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--quad-segs', type=int, default=8, help="Vertices per quarter circle of each extent")
+    args = parser.parse_args()
+
+    with seed.engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            seed.create_schema(connection, args.rows, quad_segs=args.quad_segs)
+            # Run each once to warm the cache before measuring
+            rows_per_second(connection, False)
+            shapely_rate = rows_per_second(connection, False)
+            rows_per_second(connection, True)
+            geojson_rate = rows_per_second(connection, True)
+        finally:
+            seed.drop_schema(connection)
+
+    print("Shapely:      {:10.0f} rows/s".format(shapely_rate))
+    print("ST_AsGeoJSON: {:10.0f} rows/s ({:.1f}x)".format(geojson_rate, geojson_rate / shapely_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compares paid search query plans before and after adding the filter indexes from migration da7a597d0572.
+
+Usage:
+    BENCHMARK_DATABASE_URI=postgresql://... python -m benchmarks.search_query_indexes [--rows 1000000]
+"""
+import argparse
+from datetime import datetime
+
+from benchmarks import seed
+from llc1_document_api.exports.queries import paid_search_query
+from shapely.geometry import box, mapping
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+START = datetime(2021, 3, 1)
+END = datetime(2021, 3, 31, 23, 59, 59)
+CONTACT_ID = "user-42"
+EXTENT = {"type": "Feature", "properties": {}, "geometry": mapping(box(200000, 200000, 260000, 260000))}
+
+# The four shapes of query built by exports.queries.paid_search_query, as (extent, contact_id)
+QUERIES = {
+    "window": (None, None),
+    "window + contact": (None, CONTACT_ID),
+    "window + extent": (EXTENT, None),
+    "window + extent + contact": (EXTENT, CONTACT_ID),
+}
+
+CREATE_INDEXES = [
+    "CREATE INDEX ix_document_reference_completed_date_of_search ON document_reference (date_of_search) "
+    "WHERE generation_status IN ('success', 'not required')",
+    "CREATE INDEX ix_document_reference_contact_id_date_of_search ON document_reference (contact_id, date_of_search)",
+    "ANALYZE document_reference"
+]
+
+
+def run_queries(connection):
+    results = {}
+    with Session(bind=connection) as session:
+        for name, (extent, contact_id) in QUERIES.items():
+            query = paid_search_query(session, START, END, extent, contact_id)
+            results[name] = seed.explain(connection, query.statement)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with seed.engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            seed.create_schema(connection, args.rows)
+            before = run_queries(connection)
+            for statement in CREATE_INDEXES:
+                connection.execute(text(statement))
+            after = run_queries(connection)
+        finally:
+            seed.drop_schema(connection)
+
+    for name in QUERIES:
+        print("\n{}".format(name))
+        print("  before: {:10.1f}ms  {}".format(before[name][0], ", ".join(before[name][1])))
+        print("  after:  {:10.1f}ms  {}".format(after[name][0], ", ".join(after[name][1])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Compares paid search queries of large district extents with one ST_DWithin against the subdividing planner.
+
+Districts are synthetic star shaped polygons with thousands of vertices, spread across the seeded area.
+
+Usage:
+    BENCHMARK_DATABASE_URI=postgresql://... python -m benchmarks.spatial_planner [--rows 1000000] [--vertices 5000]
+"""
+import argparse
+import math
+import random
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks import seed
+from geoalchemy2 import shape
+from llc1_document_api.exports.queries import (extent_geometries,
+                                               paid_search_query)
+from llc1_document_api.models import SearchItem
+from shapely.geometry import Polygon, mapping
+from shapely.geometry.collection import GeometryCollection
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+START = datetime(2020, 1, 1)
+END = datetime(2023, 1, 1)
+CENTRES = [(200000, 200000), (350000, 350000), (500000, 250000), (250000, 500000)]
+
+
+def district(centre, radius, vertices, rng):
+    """A star shaped polygon, so it is valid however jagged its boundary."""
+    points = []
+    for index in range(vertices):
+        angle = 2 * math.pi * index / vertices
+        distance = radius * (0.7 + 0.3 * rng.random())
+        points.append((centre[0] + distance * math.cos(angle), centre[1] + distance * math.sin(angle)))
+    return Polygon(points)
+
+
+def extent(districts, vertices, radius):
+    rng = random.Random(42)
+    features = []
+    for centre in CENTRES[:districts]:
+        features.append({"type": "Feature", "properties": {},
+                         "geometry": mapping(district(centre, radius, vertices, rng))})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def extent_to_geometry(query_extent):
+    """The extent as one GeometryCollection, as it was queried before the planner."""
+    return shape.from_shape(GeometryCollection(extent_geometries(query_extent)), srid=27700)
+
+
+def dwithin_query(session, query_extent):
+    """The query as built before the planner, one ST_DWithin against a GeometryCollection of the whole extent."""
+    return session.query(SearchItem.id) \
+        .filter(func.ST_DWithin(SearchItem.search_geom, extent_to_geometry(query_extent), 0)) \
+        .filter(SearchItem.date_of_search >= START, SearchItem.date_of_search <= END) \
+        .filter(SearchItem.generation_status.in_(['success', 'not required'])) \
+        .order_by(SearchItem.date_of_search)
+
+
+def planned_query(session, query_extent):
+    return paid_search_query(session, START, END, query_extent, None).with_entities(SearchItem.id)
+
+
+def timed(connection, build_query, query_extent, repeats):
+    timings = []
+    with Session(bind=connection) as session:
+        for _ in range(repeats):
+            started = time.perf_counter()
+            ids = [row.id for row in build_query(session, query_extent)]
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--vertices', type=int, default=5000, help="Vertices per district polygon")
+    parser.add_argument('--radius', type=int, default=15000, help="Approximate district radius in metres")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    with seed.engine().connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            seed.create_schema(connection, args.rows)
+            results = []
+            for districts in (1, len(CENTRES)):
+                query_extent = extent(districts, args.vertices, args.radius)
+                dwithin_ms, dwithin_ids = timed(connection, dwithin_query, query_extent, args.repeats)
+                planned_ms, planned_ids = timed(connection, planned_query, query_extent, args.repeats)
+                if sorted(dwithin_ids) != sorted(planned_ids):
+                    raise AssertionError("Planner returned different searches for {} districts".format(districts))
+                results.append((districts, len(planned_ids), dwithin_ms, planned_ms))
+        finally:
+            seed.drop_schema(connection)
+
+    for districts, rows, dwithin_ms, planned_ms in results:
+        print("\n{} district(s) of {} vertices, {} searches".format(districts, args.vertices, rows))
+        print("  ST_DWithin:  {:10.1f}ms".format(dwithin_ms))
+        print("  planner:     {:10.1f}ms ({:.1f}x)".format(planned_ms, dwithin_ms / planned_ms))
+
+
+if __name__ == '__main__':
+    main()
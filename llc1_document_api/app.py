@@ -1,10 +1,19 @@
+import base64
+import hashlib
+import json
+import time
 import uuid
+from http.cookiejar import DefaultCookiePolicy
 
 import requests
 from flask import Flask, g, request
 from jwt_validation.exceptions import ValidationFailure
 from jwt_validation.validate import validate
 from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.metrics import outbound_requests
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
 app = Flask(__name__)
 
@@ -24,21 +33,139 @@ class RequestsSessionTimeout(requests.Session):
         return super(RequestsSessionTimeout, self).request(*args, **kwargs)
 
 
+def pooled_session(pool_sizes, default_pool_size=DEFAULT_POOLSIZE):
+    """A session to be shared by threads, keeping up to pool_sizes[root] connections open to each dependency."""
+    session = RequestsSessionTimeout()
+    # Shared by every caller, so cookies set by a response must not be sent with anyone else's requests
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    for prefix in ('http://', 'https://'):
+        session.mount(prefix, HTTPAdapter(pool_maxsize=default_pool_size))
+    for root, pool_size in pool_sizes.items():
+        session.mount(root, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    return session
+
+
+class RequestClient(object):
+    """HTTP client of a request or background job, whose calls go through a shared session with its headers added.
+
+    Has the request methods of a requests session so it can be used in place of one. Its headers belong to it alone,
+    so setting the trace id or Authorization of one request never affects calls made for another.
+    """
+
+    def __init__(self, session, headers=None):
+        self.session = session
+        self.headers = CaseInsensitiveDict(headers)
+
+    def request(self, method, url, headers=None, **kwargs):
+        call_headers = CaseInsensitiveDict(self.headers)
+        if headers:
+            call_headers.update(headers)
+        started = time.perf_counter()
+        status = 'error'
+        try:
+            response = self.session.request(method, url, headers=call_headers, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            outbound_requests.observe(time.perf_counter() - started, dependency_for(url), method, status)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', True)
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('PATCH', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self):
+        """The shared session's connections are left open for the other clients using it."""
+
+
+# Longest first, so that the most specific root is matched
+DEPENDENCY_ROOTS = sorted(((root, name) for name, root in app.config['DEPENDENCIES'].items()),
+                          key=lambda dependency: len(dependency[0]), reverse=True)
+
+
+def dependency_for(url):
+    """The name of the dependency a URL belongs to, for labelling metrics."""
+    for root, name in DEPENDENCY_ROOTS:
+        if url.startswith(root):
+            return name
+    return 'other'
+
+
+# Sessions pool connections and are safe to share between threads as long as nothing changes their settings, which
+# is why headers are added per call by RequestClient. Background jobs have their own, so that long running exports
+# can't use up the connections web requests need.
+web_session = pooled_session(app.config['HTTP_POOL_SIZES'])
+background_session = pooled_session({root: app.config['BACKGROUND_HTTP_POOL_SIZE']
+                                     for root in app.config['HTTP_POOL_SIZES']},
+                                    app.config['BACKGROUND_HTTP_POOL_SIZE'])
+
+
+def background_client(headers=None):
+    """A client for a background thread, which has no request of its own."""
+    return RequestClient(background_session, headers)
+
+
+# Keyed on a hash of the Authorization header, so the tokens themselves aren't kept
+jwt_cache = TTLCache(app.config['JWT_CACHE_SIZE'], app.config['JWT_CACHE_MAX_TTL'])
+
+
+def seconds_until_expiry(authorization):
+    """Reads how long the token has left from its exp claim, or returns None if it can't be read.
+
+    The signature isn't checked, this only decides how long the authentication API's answer is cached for.
+    """
+    try:
+        payload = authorization.split()[-1].split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return float(claims['exp']) - time.time()
+    except Exception:
+        return None
+
+
+def validate_jwt(authorization):
+    """Validates the token with the authentication API, unless it has been validated since it was last cached."""
+    key = hashlib.sha256(authorization.encode('utf-8')).hexdigest()
+    jwt = jwt_cache.get(key)
+    if jwt is not MISSING:
+        return jwt
+
+    jwt = validate(app.config['AUTHENTICATION_API_URL'] + '/authentication/validate', authorization, g.requests)
+
+    # Tokens without a readable expiry are validated every time
+    ttl = min(seconds_until_expiry(authorization) or 0, app.config['JWT_CACHE_MAX_TTL'])
+    if ttl > 0:
+        jwt_cache.set(key, jwt, ttl)
+    return jwt
+
+
 @app.before_request
 def before_request():
     g.trace_id = request.headers.get('X-Trace-ID', uuid.uuid4().hex)
-    g.requests = RequestsSessionTimeout()
-    g.requests.headers.update({'X-Trace-ID': g.trace_id})
+    g.requests = RequestClient(web_session, {'X-Trace-ID': g.trace_id})
 
-    if '/health' in request.path:
+    if '/health' in request.path or request.path == '/metrics':
         return
 
     if 'Authorization' not in request.headers:
         raise ApplicationError("Missing Authorization header", "AUTH1", 401)
 
     try:
-        g.jwt = validate(app.config['AUTHENTICATION_API_URL'] + '/authentication/validate',
-                         request.headers['Authorization'], g.requests)
+        g.jwt = validate_jwt(request.headers['Authorization'])
     except ValidationFailure as fail:
         raise ApplicationError(fail.message, "AUTH1", 401)
 
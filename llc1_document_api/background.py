@@ -0,0 +1,78 @@
+import threading
+
+from llc1_document_api.extensions import db
+from sqlalchemy.orm.session import sessionmaker
+
+
+class BackgroundThreads(object):
+    """Daemon threads run by each process alongside its requests, such as those working through a queue table.
+
+    Threads are started by the first request rather than at import, so that CLI commands such as 'flask db upgrade'
+    don't start them. Subclasses name their threads and the settings giving how many to start (0 disables them) and
+    how often to poll. By default each thread claims and executes jobs until there are none left, then waits until it
+    is notified of a new one or the poll interval has passed. Subclasses implement claim and execute, or replace run.
+    """
+
+    name = None
+    description = None
+    job_description = None
+    threads_setting = None
+    poll_setting = None
+    start_on_request = True
+
+    def __init__(self):
+        self.app = None
+        self.engine = None
+        self.session_factory = None
+        self.threads = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Semaphore(0)
+
+    def init_app(self, app):
+        self.app = app
+        if self.start_on_request:
+            app.before_request(self.start)
+
+    def thread_count(self):
+        return self.app.config[self.threads_setting]
+
+    def start(self):
+        if self.threads or not self.thread_count():
+            return
+        with self.lock:
+            if self.threads:
+                return
+            self.engine = db.engine
+            self.session_factory = sessionmaker(bind=self.engine)
+            for index in range(self.thread_count()):
+                thread = threading.Thread(target=self.run, name="{}-{}".format(self.name, index), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.app.logger.info("Started {} {}".format(len(self.threads), self.description))
+
+    def notify(self, count=1):
+        """Wakes waiting threads to claim newly queued jobs, one for each job."""
+        self.wakeup.release(count)
+
+    def wait(self):
+        self.wakeup.acquire(timeout=self.app.config[self.poll_setting])
+
+    def run(self):
+        while True:
+            try:
+                job = self.claim()
+            except Exception:
+                self.app.logger.exception("Failed to claim {}".format(self.job_description))
+                job = None
+
+            if job:
+                self.execute(job)
+            else:
+                self.wait()
+
+    def claim(self):
+        """Claims the next job, returning its details or None if there are none."""
+        raise NotImplementedError
+
+    def execute(self, job):
+        raise NotImplementedError
@@ -22,6 +22,24 @@ DEPENDENCIES = {
     "search-local-land-charges-api": SEARCH_LOCAL_LAND_CHARGE_API_URL
 }
 
+# Outbound HTTP calls share a client per process, which keeps up to HTTP_POOL_SIZE connections open to each dependency
+# (overridden per dependency by e.g. STORAGE_API_POOL_SIZE). Background jobs have a client of their own, with up to
+# BACKGROUND_HTTP_POOL_SIZE connections to each
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_POOL_SIZES = {root: int(os.environ.get('{}_POOL_SIZE'.format(name.upper().replace('-', '_')), HTTP_POOL_SIZE))
+                   for name, root in DEPENDENCIES.items()}
+BACKGROUND_HTTP_POOL_SIZE = int(os.environ.get('BACKGROUND_HTTP_POOL_SIZE', '10'))
+# Validated JWTs are cached until they expire, but for at most JWT_CACHE_MAX_TTL seconds (0 disables the cache), which
+# is how long a token revoked by the authentication API can still be accepted
+JWT_CACHE_MAX_TTL = int(os.environ.get('JWT_CACHE_MAX_TTL', '300'))
+JWT_CACHE_SIZE = int(os.environ.get('JWT_CACHE_SIZE', '10000'))
+# A health cascade has HEALTH_CASCADE_TIMEOUT seconds, or the budget it is called with if less, to check every
+# dependency. Each hop keeps HEALTH_CASCADE_HOP_MARGIN seconds of it to respond in, and results are cached for
+# HEALTH_CASCADE_CACHE_TTL seconds so that frequent probes don't each cascade through every service
+HEALTH_CASCADE_TIMEOUT = float(os.environ.get('HEALTH_CASCADE_TIMEOUT', DEFAULT_TIMEOUT))
+HEALTH_CASCADE_HOP_MARGIN = float(os.environ.get('HEALTH_CASCADE_HOP_MARGIN', '0.5'))
+HEALTH_CASCADE_CACHE_TTL = float(os.environ.get('HEALTH_CASCADE_CACHE_TTL', '5'))
+
 SQL_HOST = os.environ['SQL_HOST']
 SQL_DATABASE = os.environ['SQL_DATABASE']
 SQL_PASSWORD = os.environ['SQL_PASSWORD']
@@ -48,6 +66,74 @@ CALLBACK_PREFIX = os.environ['CALLBACK_PREFIX']
 
 SEARCH_QUERY_TIMEOUT = int(os.environ['SEARCH_QUERY_TIMEOUT'])
 SEARCH_QUERY_BUCKET = os.environ['SEARCH_QUERY_BUCKET']
+# Rows fetched from the server side cursor per round trip, and bytes of export held in memory before spilling to disk
+SEARCH_QUERY_BATCH_SIZE = int(os.environ.get('SEARCH_QUERY_BATCH_SIZE', '500'))
+SEARCH_QUERY_BUFFER_SIZE = int(os.environ.get('SEARCH_QUERY_BUFFER_SIZE', str(8 * 1024 * 1024)))
+# Export worker threads per process (0 disables them), and how jobs are polled for, heartbeated and reclaimed
+SEARCH_QUERY_WORKERS = int(os.environ.get('SEARCH_QUERY_WORKERS', '2'))
+SEARCH_QUERY_POLL_INTERVAL = int(os.environ.get('SEARCH_QUERY_POLL_INTERVAL', '10'))
+SEARCH_QUERY_HEARTBEAT_INTERVAL = int(os.environ.get('SEARCH_QUERY_HEARTBEAT_INTERVAL', '15'))
+SEARCH_QUERY_HEARTBEAT_TIMEOUT = int(os.environ.get('SEARCH_QUERY_HEARTBEAT_TIMEOUT', '60'))
+SEARCH_QUERY_MAX_ATTEMPTS = int(os.environ.get('SEARCH_QUERY_MAX_ATTEMPTS', '3'))
+# Exports run as consecutive time slices of at most SEARCH_QUERY_SLICE_DAYS, SEARCH_QUERY_PARALLELISM at a time. A
+# slice that hits the statement timeout is split in two, down to SEARCH_QUERY_MIN_SLICE_SECONDS, and any other failure
+# is retried up to SEARCH_QUERY_SLICE_ATTEMPTS times
+SEARCH_QUERY_PARALLELISM = int(os.environ.get('SEARCH_QUERY_PARALLELISM', '4'))
+SEARCH_QUERY_SLICE_DAYS = int(os.environ.get('SEARCH_QUERY_SLICE_DAYS', '31'))
+SEARCH_QUERY_MIN_SLICE_SECONDS = int(os.environ.get('SEARCH_QUERY_MIN_SLICE_SECONDS', '3600'))
+SEARCH_QUERY_SLICE_ATTEMPTS = int(os.environ.get('SEARCH_QUERY_SLICE_ATTEMPTS', '3'))
+# Rows per uploaded part of an export, progress is checkpointed after each part so a failed export can be resumed
+SEARCH_QUERY_PART_ROWS = int(os.environ.get('SEARCH_QUERY_PART_ROWS', '100000'))
+# Extent geometries with more vertices than this are split into pieces with ST_Subdivide before querying
+SEARCH_QUERY_SUBDIVIDE_VERTICES = int(os.environ.get('SEARCH_QUERY_SUBDIVIDE_VERTICES', '256'))
+# How long the document of a completed query can be reused by an identical query of a window in the past
+SEARCH_QUERY_REUSE_SECONDS = int(os.environ.get('SEARCH_QUERY_REUSE_SECONDS', str(24 * 60 * 60)))
+# Longest a request spends summarising the window to check whether a completed query can be reused, in seconds
+SEARCH_QUERY_REUSE_TIMEOUT = float(os.environ.get('SEARCH_QUERY_REUSE_TIMEOUT', '2'))
+# Concurrent user lookups per export, and the process wide cache of user information they share
+SEARCH_QUERY_EMAIL_CONCURRENCY = int(os.environ.get('SEARCH_QUERY_EMAIL_CONCURRENCY', '8'))
+USER_INFO_CACHE_SIZE = int(os.environ.get('USER_INFO_CACHE_SIZE', '20000'))
+USER_INFO_CACHE_TTL = int(os.environ.get('USER_INFO_CACHE_TTL', '3600'))
+USER_INFO_NOT_FOUND_CACHE_TTL = int(os.environ.get('USER_INFO_NOT_FOUND_CACHE_TTL', '300'))
+# PDF generation requests are queued in an outbox and delivered by PDF_DISPATCH_CONCURRENCY threads per process (0
+# disables them). A request being delivered is leased for PDF_DISPATCH_LEASE seconds, and a failed one is retried
+# after PDF_DISPATCH_RETRY_SECONDS, doubling each time, up to PDF_DISPATCH_MAX_ATTEMPTS attempts
+PDF_DISPATCH_CONCURRENCY = int(os.environ.get('PDF_DISPATCH_CONCURRENCY', '4'))
+PDF_DISPATCH_POLL_INTERVAL = int(os.environ.get('PDF_DISPATCH_POLL_INTERVAL', '5'))
+PDF_DISPATCH_LEASE = int(os.environ.get('PDF_DISPATCH_LEASE', '60'))
+PDF_DISPATCH_RETRY_SECONDS = int(os.environ.get('PDF_DISPATCH_RETRY_SECONDS', '2'))
+PDF_DISPATCH_MAX_ATTEMPTS = int(os.environ.get('PDF_DISPATCH_MAX_ATTEMPTS', '5'))
+# Searches generating for longer than ASYNC_PDF_TIMEOUT are marked failed, GENERATION_SWEEP_BATCH_SIZE at a time,
+# every GENERATION_SWEEP_INTERVAL seconds by each process (0 disables it, leaving it to the sweep-expired-generations
+# command)
+GENERATION_SWEEP_INTERVAL = int(os.environ.get('GENERATION_SWEEP_INTERVAL', '60'))
+GENERATION_SWEEP_BATCH_SIZE = int(os.environ.get('GENERATION_SWEEP_BATCH_SIZE', '1000'))
+# Background threads take their connections from the same pool as requests. An export worker needs one for its job and
+# one for its heartbeat, and two for each slice it runs at once (the slice's query, and the short transactions that
+# record its backend PID while the query holds the first). Each PDF dispatcher and the sweeper need one. The pool keeps
+# that many connections open on top of SQLALCHEMY_POOL_SIZE for requests, and opens up to SQLALCHEMY_MAX_OVERFLOW more.
+# The health cascade's database check has one more connection of its own, so each process opens at most
+# SQLALCHEMY_POOL_SIZE + BACKGROUND_SQL_CONNECTIONS + SQLALCHEMY_MAX_OVERFLOW + 1
+BACKGROUND_SQL_CONNECTIONS = SEARCH_QUERY_WORKERS * (2 + 2 * SEARCH_QUERY_PARALLELISM) + PDF_DISPATCH_CONCURRENCY + \
+    (1 if GENERATION_SWEEP_INTERVAL else 0)
+SQLALCHEMY_POOL_SIZE = int(os.environ.get('SQLALCHEMY_POOL_SIZE', '5'))
+SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('SQLALCHEMY_MAX_OVERFLOW', '10'))
+SQLALCHEMY_ENGINE_OPTIONS.update({'pool_size': SQLALCHEMY_POOL_SIZE + BACKGROUND_SQL_CONNECTIONS,
+                                  'max_overflow': SQLALCHEMY_MAX_OVERFLOW})
+# Most LLC1 requests accepted in one batch
+LLC1_BATCH_MAX_SIZE = int(os.environ.get('LLC1_BATCH_MAX_SIZE', '500'))
+# Longest a poll_llc1 long-poll waits for the PDF to be generated, in seconds. A waiting poll holds a gunicorn worker
+# thread, so the app must run threaded (gthread) workers, and this must stay well below the worker timeout
+LLC1_POLL_MAX_WAIT = int(os.environ.get('LLC1_POLL_MAX_WAIT', '20'))
+# External URLs of supporting documents are resolved EXTERNAL_URL_CONCURRENCY at a time per process, and cached for
+# EXTERNAL_URL_CACHE_TTL seconds, which must be less than the time the storage API's external URLs stay valid
+EXTERNAL_URL_CONCURRENCY = int(os.environ.get('EXTERNAL_URL_CONCURRENCY', '8'))
+EXTERNAL_URL_CACHE_SIZE = int(os.environ.get('EXTERNAL_URL_CACHE_SIZE', '10000'))
+EXTERNAL_URL_CACHE_TTL = int(os.environ.get('EXTERNAL_URL_CACHE_TTL', '300'))
+# The languages list is cached for LANGUAGES_CACHE_TTL seconds, after which it is served stale for up to
+# LANGUAGES_CACHE_STALE seconds more while it is revalidated with the PDF generation API in the background
+LANGUAGES_CACHE_TTL = int(os.environ.get('LANGUAGES_CACHE_TTL', '3600'))
+LANGUAGES_CACHE_STALE = int(os.environ.get('LANGUAGES_CACHE_STALE', '86400'))
 
 LOGCONFIG = {
     'version': 1,
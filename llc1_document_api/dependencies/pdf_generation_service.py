@@ -1,49 +1,208 @@
+import hashlib
 import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from itertools import repeat
 
 from flask import current_app, g, url_for
-from llc1_document_api.config import CALLBACK_PREFIX, PDF_GENERATION_API
+from llc1_document_api.app import background_client
+from llc1_document_api.config import (CALLBACK_PREFIX, EXTERNAL_URL_CACHE_SIZE,
+                                      EXTERNAL_URL_CACHE_TTL,
+                                      EXTERNAL_URL_CONCURRENCY,
+                                      LANGUAGES_CACHE_STALE,
+                                      LANGUAGES_CACHE_TTL, PDF_GENERATION_API)
 from llc1_document_api.dependencies.storage_api_service import \
     StorageAPIService
 from llc1_document_api.exceptions import ApplicationError
 from llc1_document_api.extensions import db
+from llc1_document_api.metrics import pdf_generations
+from llc1_document_api.models import PdfGenerationRequest, SearchItem
+from llc1_document_api.notifications import notify_generation_finished
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+from sqlalchemy import insert
+
+# Shared by every poll in the process
+external_url_cache = TTLCache(EXTERNAL_URL_CACHE_SIZE, EXTERNAL_URL_CACHE_TTL)
+external_url_executor = ThreadPoolExecutor(max_workers=EXTERNAL_URL_CONCURRENCY, thread_name_prefix="external-url")
+
+# etag identifies the body to our clients, upstream_etag and last_modified are the PDF generation API's validators
+Languages = namedtuple('Languages', ['text', 'etag', 'upstream_etag', 'last_modified', 'fetched'])
+
+
+class LanguagesCache(object):
+    """The languages list of the PDF generation API, cached for the process.
+
+    The list is fresh for ttl seconds. After that it is served stale for up to stale seconds more while a single
+    background thread revalidates it with If-None-Match/If-Modified-Since, so a 304 only resets its age. Once it has
+    expired it is fetched again by the request that needs it, one request at a time.
+    """
+
+    def __init__(self, ttl, stale):
+        self.ttl = ttl
+        self.cache = TTLCache(1, ttl + stale)
+        self.fetch_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def get(self, logger, requests):
+        languages = self.cache.get('languages')
+        if languages is MISSING:
+            with self.fetch_lock:
+                languages = self.cache.get('languages')
+                if languages is MISSING:
+                    languages = self.fetch(None, logger, requests)
+        elif time.monotonic() - languages.fetched > self.ttl:
+            self.refresh(languages, logger, requests.headers)
+        return languages
+
+    def refresh(self, languages, logger, headers):
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        # The thread outlives the request, so it gets its own client with the request's headers
+        requests = background_client(headers)
+        threading.Thread(target=self.revalidate, args=(languages, logger, requests), name="languages-refresh",
+                         daemon=True).start()
+
+    def revalidate(self, languages, logger, requests):
+        try:
+            self.fetch(languages, logger, requests)
+        except Exception:
+            logger.exception("Failed to refresh languages list, serving the cached list")
+        finally:
+            requests.close()
+            with self.lock:
+                self.refreshing = False
+
+    def fetch(self, previous, logger, requests):
+        headers = {}
+        if previous and previous.upstream_etag:
+            headers['If-None-Match'] = previous.upstream_etag
+        if previous and previous.last_modified:
+            headers['If-Modified-Since'] = previous.last_modified
+
+        response = requests.get("{}/languages".format(PDF_GENERATION_API), headers=headers)
+
+        if previous and response.status_code == 304:
+            languages = previous._replace(fetched=time.monotonic())
+        elif response.status_code == 200:
+            languages = Languages(response.text, hashlib.sha256(response.content).hexdigest(),
+                                  response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                                  time.monotonic())
+        else:
+            logger.error(
+                'Failed to retrieve languages list. TraceID : {} - Status code:{}, message:{}'
+                .format(requests.headers.get('X-Trace-ID'),
+                        response.status_code,
+                        response.text))
+            raise ApplicationError("Failed to retrieve languages list", "LANG-01", response.status_code)
+
+        self.cache.set('languages', languages)
+        return languages
+
+    def clear(self):
+        self.cache.clear()
+
+
+languages_cache = LanguagesCache(LANGUAGES_CACHE_TTL, LANGUAGES_CACHE_STALE)
 
 
 class PdfGenerationService(object):
     @staticmethod
     def generate_pdf(extents, search_item):
-        """Generates the llc1 PDF"""
+        """Records the search and queues the request to generate its llc1 PDF
+
+        The request is written to the outbox in the same transaction as the SearchItem and delivered by the PDF
+        dispatcher, so neither the web worker nor its database connection wait on the PDF generation API.
+        """
+        search_item.generation_status = 'generating'
         db.session.add(search_item)
         db.session.flush()
-        try:
-            extents['reference_number'] = search_item.id
 
-            current_app.logger.info("Calling pdf-generation-api")
+        extents['reference_number'] = search_item.id
+        db.session.add(PdfGenerationRequest(search_item.id, extents,
+                                            CALLBACK_PREFIX + url_for('generate.callback_llc1',
+                                                                      search_ref=search_item.id),
+                                            g.trace_id, g.requests.headers.get('Authorization')))
+
+        current_app.logger.info('Committing SearchItem with id: {}'.format(search_item.id))
+        db.session.commit()
+        pdf_generations.inc('generating')
+
+    @staticmethod
+    def generate_pdfs(batch):
+        """Records a batch of searches and queues the requests to generate their PDFs, in one transaction
 
-            response = g.requests.post(PDF_GENERATION_API,
-                                       data=json.dumps(extents),
-                                       headers={'X-Trace-ID': g.trace_id, 'Content-Type': 'application/json',
-                                                'ReplyTo': CALLBACK_PREFIX + url_for('generate.callback_llc1',
-                                                                                     search_ref=search_item.id)})
+        batch is a list of (extents, search_item). The searches are inserted with a single multi-row INSERT ...
+        RETURNING, which sets the id of each SearchItem, as are their outbox rows. Searches whose generation_status
+        is already set, i.e. that don't need a PDF, are only recorded. Returns the number of PDFs queued.
+        """
+        if not batch:
+            return 0
 
-            if response.status_code != 202:
-                current_app.logger.error(
-                    'Failed to generate PDF. TraceID : {} - Status code:{}, message:{}'
-                    .format(g.trace_id,
-                            response.status_code,
-                            response.text))
-                raise ApplicationError("Error generating PDF", "GEN-01", response.status_code)
+        for extents, search_item in batch:
+            if search_item.generation_status is None:
+                search_item.generation_status = 'generating'
 
-            search_item.generation_status = 'generating'
+        columns = ('date_of_search', 'source', 'parent_search_id', 'search_area_description', 'generation_status',
+                   'charges', 'number_of_charges', 'search_geom', 'contact_id', 'language')
+        # RETURNING gives the new ids in the order of the VALUES rows
+        search_ids = db.session.execute(
+            insert(SearchItem)
+            .values([{column: getattr(search_item, column) for column in columns} for _, search_item in batch])
+            .returning(SearchItem.id)).scalars().all()
 
-            current_app.logger.info('Committing SearchItem with id: {}'.format(search_item.id))
-        except Exception as ex:
-            current_app.logger.exception('Failed to generate PDF. TraceID : {} - Exception :{}'.format(
-                g.trace_id,
-                ex))
-            search_item.generation_status = 'failed'
+        now = datetime.utcnow()
+        pdf_requests = []
+        for (extents, search_item), search_id in zip(batch, search_ids):
+            search_item.id = search_id
+            if search_item.generation_status != 'generating':
+                continue
+            extents['reference_number'] = search_id
+            pdf_requests.append({"search_id": search_id,
+                                 "payload": extents,
+                                 "callback_url": CALLBACK_PREFIX + url_for('generate.callback_llc1',
+                                                                           search_ref=search_id),
+                                 "trace_id": g.trace_id,
+                                 "authorization_header": g.requests.headers.get('Authorization'),
+                                 "created_timestamp": now,
+                                 "next_attempt_timestamp": now,
+                                 "attempts": 0})
+        if pdf_requests:
+            db.session.execute(insert(PdfGenerationRequest).values(pdf_requests))
 
+        current_app.logger.info('Committing {} SearchItems, {} PDFs queued'.format(len(batch), len(pdf_requests)))
         db.session.commit()
+        for status in ('generating', 'not required'):
+            count = sum(1 for _, search_item in batch if search_item.generation_status == status)
+            if count:
+                pdf_generations.inc(status, amount=count)
+        return len(pdf_requests)
+
+    @staticmethod
+    def dispatch_pdf(pdf_request, requests, logger):
+        """Sends a queued request to the pdf-generation-api, raising ApplicationError if it isn't accepted"""
+        headers = {'Content-Type': 'application/json', 'ReplyTo': pdf_request['callback_url']}
+        if pdf_request['trace_id']:
+            headers['X-Trace-ID'] = pdf_request['trace_id']
+        if pdf_request['authorization_header']:
+            headers['Authorization'] = pdf_request['authorization_header']
+
+        logger.info("Calling pdf-generation-api for search reference {}".format(pdf_request['search_id']))
+
+        response = requests.post(PDF_GENERATION_API, data=json.dumps(pdf_request['payload']), headers=headers)
+
+        if response.status_code != 202:
+            logger.error('Failed to generate PDF. TraceID : {} - Status code:{}, message:{}'
+                         .format(pdf_request['trace_id'],
+                                 response.status_code,
+                                 response.text))
+            raise ApplicationError("Error generating PDF", "GEN-01", response.status_code)
 
     @staticmethod
     def check_for_result(search_item, timeout, return_supporting_docs=False):
@@ -66,20 +225,19 @@ class PdfGenerationService(object):
             "reference_number": search_item.formatted_id(),
             "document_url": search_item.document,
             "external_url": search_item.external_url,
-            "number_of_charges": len(search_item.charges)
+            "number_of_charges": search_item.number_of_charges
         }
 
         if return_supporting_docs:
-            supporting_documents = {}
+            documents_filed = {}
 
             for item in search_item.charges:
                 charge = item['item']
                 if 'Light obstruction notice' in charge['charge-type']:
-                    supporting_documents[item['display-id']] = PdfGenerationService.url_for_documents(
-                        charge['documents-filed'])
+                    documents_filed[item['display-id']] = charge['documents-filed']
 
-            if supporting_documents:
-                response_obj['supporting_documents'] = supporting_documents
+            if documents_filed:
+                response_obj['supporting_documents'] = PdfGenerationService.urls_for_documents(documents_filed)
 
         return response_obj
 
@@ -88,6 +246,12 @@ class PdfGenerationService(object):
         current_app.logger.info('Handling callback for search reference {}'.format(search_item.id))
         status = response.get("status", None)
         search_item.generation_status = status
+        notify_generation_finished(db.session, search_item.id)
+        # A request still in the outbox was delivered but not yet removed, e.g. its dispatcher died after sending it.
+        # It isn't needed now the PDF has been generated, and holds the caller's bearer token
+        db.session.query(PdfGenerationRequest) \
+            .filter(PdfGenerationRequest.search_id == search_item.id) \
+            .delete(synchronize_session=False)
 
         if status == 'success':
             pdf_result = response.get('result', None)
@@ -95,17 +259,46 @@ class PdfGenerationService(object):
             search_item.charges = pdf_result.get('included_charges', None)
             search_item.external_url = pdf_result.get('external_url', None)
             db.session.commit()
+            pdf_generations.inc('success')
         else:
             db.session.commit()
+            pdf_generations.inc('failed')
             raise ApplicationError("PDF generation failed for search reference {} response was {}"
                                    .format(search_item.id, response),
                                    "GEN-04", 500)
 
     @staticmethod
-    def url_for_documents(documents_filed):
-        form_a = documents_filed['form-a'][0]
+    def urls_for_documents(documents_filed):
+        """Resolves the external URLs of the form A of each of a dict of documents filed, keeping the same keys
 
-        return StorageAPIService.get_external_url(form_a["subdirectory"], form_a['bucket'])
+        URLs are cached per (bucket, subdirectory), and those that aren't cached are requested concurrently.
+        """
+        form_as = {key: documents['form-a'][0] for key, documents in documents_filed.items()}
+
+        urls = {}
+        missing = []
+        for location in {(form_a['bucket'], form_a['subdirectory']) for form_a in form_as.values()}:
+            url = external_url_cache.get(location)
+            if url is MISSING:
+                missing.append(location)
+            else:
+                urls[location] = url
+
+        if len(missing) == 1:
+            urls[missing[0]] = PdfGenerationService.external_url(missing[0], current_app.logger, g.requests)
+        elif missing:
+            # The pool's threads have no app context, so are given the logger and HTTP session
+            urls.update(zip(missing, external_url_executor.map(PdfGenerationService.external_url, missing,
+                                                               repeat(current_app.logger), repeat(g.requests))))
+
+        return {key: urls[(form_a['bucket'], form_a['subdirectory'])] for key, form_a in form_as.items()}
+
+    @staticmethod
+    def external_url(location, logger, requests):
+        bucket, subdirectory = location
+        url = StorageAPIService.get_external_url(subdirectory, bucket, logger=logger, requests=requests)
+        external_url_cache.set(location, url)
+        return url
 
     @staticmethod
     def expired_search(search_item, timeout):
@@ -113,16 +306,5 @@ class PdfGenerationService(object):
 
     @staticmethod
     def get_languages():
-        """Gets list of available languages"""
-        response = g.requests.get("{}/languages".format(PDF_GENERATION_API),
-                                  headers={'X-Trace-ID': g.trace_id})
-
-        if response.status_code != 200:
-            current_app.logger.error(
-                'Failed to retrieve languages list. TraceID : {} - Status code:{}, message:{}'
-                .format(g.trace_id,
-                        response.status_code,
-                        response.text))
-            raise ApplicationError("Failed to retrieve languages list", "LANG-01", response.status_code)
-
-        return response.text
+        """Gets list of available languages, from the process cache where possible"""
+        return languages_cache.get(current_app.logger, g.requests)
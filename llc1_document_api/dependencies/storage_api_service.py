@@ -1,23 +1,33 @@
+import uuid
+
 from flask import current_app, g
 from llc1_document_api.config import STORAGE_API
 from llc1_document_api.exceptions import ApplicationError
 
+# Size of each read from a file passed to save_file_stream
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
 
 class StorageAPIService(object):
 
     @staticmethod
-    def get_external_url(file, bucket, subdirectories=None):
-        current_app.logger.info("Generate external URL for {}".format(file))
+    def get_external_url(file, bucket, subdirectories=None, logger=None, requests=None):
+        if not logger:
+            logger = current_app.logger
+        if not requests:
+            requests = g.requests
+
+        logger.info("Generate external URL for {}".format(file))
         params = {}
         if subdirectories:
             params["subdirectories"] = subdirectories
 
-        request_path = "{}/{}/{}/external-url".format(current_app.config['STORAGE_API'], bucket, file)
+        request_path = "{}/{}/{}/external-url".format(STORAGE_API, bucket, file)
 
-        current_app.logger.info("Calling storage api via this URL: {}".format(request_path))
-        response = g.requests.get(request_path, params=params)
+        logger.info("Calling storage api via this URL: {}".format(request_path))
+        response = requests.get(request_path, params=params)
 
-        current_app.logger.info("Calling storage api responded with status: {}".format(response.status_code))
+        logger.info("Calling storage api responded with status: {}".format(response.status_code))
 
         if response.status_code == 200:
             json = response.json()
@@ -25,9 +35,9 @@ class StorageAPIService(object):
         if response.status_code == 404:
             return None
 
-        current_app.logger.warning(
+        logger.warning(
             'Failed to get external url - TraceID : {} - Status: {}, Message: {}'.format(
-                g.trace_id,
+                requests.headers.get('X-Trace-ID'),
                 response.status_code,
                 response.text))
         raise ApplicationError('Failed to get external url', 'STORAGE-01', 500)
@@ -46,3 +56,82 @@ class StorageAPIService(object):
         if response.status_code == 201:
             return response.json()
         raise ApplicationError("Failed to store document", "ST01")
+
+    @staticmethod
+    def save_file_stream(file_name, stream, content_type, bucket, logger=None, requests=None):
+        """Uploads a single file without holding it in memory.
+
+        The stream may be a file object or an iterable of bytes. The multipart body is generated as the stream is
+        read and sent using chunked transfer encoding, so only one chunk is held in memory at a time.
+        """
+        if not logger:
+            logger = current_app.logger
+        if not requests:
+            requests = g.requests
+
+        request_path = "{}/{}".format(STORAGE_API, bucket)
+        boundary = uuid.uuid4().hex
+
+        if hasattr(stream, 'read'):
+            chunks = iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b'')
+        else:
+            chunks = stream
+
+        logger.info("Streaming file to storage api via this URL: %s", request_path)
+        response = requests.post(request_path,
+                                 data=multipart_body(boundary, 'file', file_name, content_type, chunks),
+                                 headers={'Content-Type': 'multipart/form-data; boundary={}'.format(boundary)})
+        if response.status_code == 201:
+            return response.json()
+        raise ApplicationError("Failed to store document", "ST01")
+
+    @staticmethod
+    def get_file_stream(reference, logger=None, requests=None):
+        """Downloads a stored file, yielding it in chunks rather than holding it in memory.
+
+        The reference is the one returned when the file was saved, i.e. the bucket and file name.
+        """
+        if not logger:
+            logger = current_app.logger
+        if not requests:
+            requests = g.requests
+
+        request_path = "{}/{}".format(STORAGE_API, reference)
+
+        logger.info("Streaming file from storage api via this URL: %s", request_path)
+        response = requests.get(request_path, stream=True)
+        try:
+            if response.status_code != 200:
+                raise ApplicationError("Failed to retrieve document", "ST02")
+            yield from response.iter_content(UPLOAD_CHUNK_SIZE)
+        finally:
+            response.close()
+
+    @staticmethod
+    def delete_file(reference, logger=None, requests=None):
+        """Deletes a stored file, the reference being the one returned when it was saved.
+
+        A file that has already been deleted isn't an error.
+        """
+        if not logger:
+            logger = current_app.logger
+        if not requests:
+            requests = g.requests
+
+        request_path = "{}/{}".format(STORAGE_API, reference)
+
+        logger.info("Deleting file from storage api via this URL: %s", request_path)
+        response = requests.delete(request_path)
+        if response.status_code not in (200, 204, 404):
+            raise ApplicationError("Failed to delete document", "ST03")
+
+
+def multipart_body(boundary, field_name, file_name, content_type, chunks):
+    """Generates a multipart/form-data body containing a single file part."""
+    yield ('--{}\r\n'
+           'Content-Disposition: form-data; name="{}"; filename="{}"\r\n'
+           'Content-Type: {}\r\n\r\n').format(boundary, field_name, file_name, content_type).encode('utf-8')
+    for chunk in chunks:
+        if chunk:
+            yield chunk
+    yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
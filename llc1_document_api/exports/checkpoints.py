@@ -0,0 +1,56 @@
+import uuid
+
+from dateutil.parser import parse
+from llc1_document_api.dependencies.storage_api_service import \
+    StorageAPIService
+from llc1_document_api.models import SearchQuery
+
+
+class Checkpoint(object):
+    """Progress of an export, saved on its search_query row so that a failed export can carry on where it stopped.
+
+    Results are uploaded in parts as the export runs, and after each part the position of its last result in the
+    (date_of_search, id) ordering is recorded along with the part's reference. The parts are joined into the results
+    document once the export completes, and then deleted, as they are if it is cancelled.
+    """
+
+    def __init__(self, search_query_id, state=None):
+        state = state or {}
+        self.search_query_id = search_query_id
+        self.date_of_search = state.get('date_of_search')
+        self.id = state.get('id')
+        self.rows = state.get('rows', 0)
+        self.parts = list(state.get('parts', []))
+
+    @property
+    def after(self):
+        """The (date_of_search, id) the export continues after, or None if it starts from the beginning."""
+        if self.id is None:
+            return None
+        return parse(self.date_of_search), self.id
+
+    def save_part(self, writer, last_result, session, bucket, logger, requests, progress=None):
+        """Uploads a finished part and records that the export has got as far as last_result."""
+        part = writer.finish()
+        if progress:
+            part = progress.counted(part)
+        storage_result = StorageAPIService.save_file_stream(
+            "{}.part{}.{}".format(uuid.uuid4().hex, len(self.parts), writer.extension), part,
+            writer.content_type, bucket, logger, requests)
+
+        self.parts.append(storage_result['file'][0]['reference'])
+        self.rows += writer.count
+        self.date_of_search = last_result['date_of_search']
+        self.id = last_result['id']
+
+        session.query(SearchQuery).filter(SearchQuery.id == self.search_query_id) \
+            .update({SearchQuery.checkpoint: self.to_dict()}, synchronize_session=False)
+        session.commit()
+
+        logger.info("Checkpointed search query after {} searches in {} parts".format(self.rows, len(self.parts)))
+
+    def to_dict(self):
+        return {"date_of_search": self.date_of_search,
+                "id": self.id,
+                "rows": self.rows,
+                "parts": self.parts}
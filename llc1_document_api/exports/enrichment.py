@@ -0,0 +1,62 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from llc1_document_api.config import (SEARCH_QUERY_EMAIL_CONCURRENCY,
+                                      USER_INFO_CACHE_SIZE,
+                                      USER_INFO_CACHE_TTL,
+                                      USER_INFO_NOT_FOUND_CACHE_TTL)
+from llc1_document_api.dependencies.search_local_land_charge_service import \
+    SearchLocalLandChargeService
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+
+# Shared by every export in the process, users that were not found are cached as None for a shorter time
+user_info_cache = TTLCache(USER_INFO_CACHE_SIZE, USER_INFO_CACHE_TTL)
+
+
+class EmailEnricher(object):
+    """Adds the searcher's email address to exported searches.
+
+    Results are enriched a batch at a time. Users not already in the cache are looked up concurrently, at most
+    concurrency at once.
+    """
+
+    def __init__(self, logger, requests, concurrency=SEARCH_QUERY_EMAIL_CONCURRENCY, cache=user_info_cache):
+        self.logger = logger
+        self.requests = requests
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="export-email")
+
+    def enrich(self, results):
+        contact_ids = {result.get('contact_id') for result in results
+                       if result.get("source") == "SEARCH" and result.get('contact_id')}
+
+        users = {}
+        missing = []
+        for contact_id in contact_ids:
+            user_info = self.cache.get(contact_id)
+            if user_info is MISSING:
+                missing.append(contact_id)
+            else:
+                users[contact_id] = user_info
+
+        users.update(zip(missing, self.executor.map(self.get_user_information, missing)))
+
+        for result in results:
+            if result.get("source") == "SEARCH":
+                result['email'] = get_email(result.get('contact_id'), users)
+
+    def get_user_information(self, user_id):
+        user_info = SearchLocalLandChargeService.get_user_information(user_id, self.logger, self.requests)
+        self.cache.set(user_id, user_info, None if user_info else USER_INFO_NOT_FOUND_CACHE_TTL)
+        return user_info
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def get_email(user_id, users):
+    if not user_id:
+        return "N/A"
+    user_info = users.get(user_id)
+    if user_info:
+        return user_info.get("email")
+    return None
@@ -0,0 +1,134 @@
+import uuid
+from datetime import datetime
+
+from llc1_document_api.config import (SEARCH_QUERY_BUFFER_SIZE,
+                                      SEARCH_QUERY_PART_ROWS)
+from llc1_document_api.dependencies.storage_api_service import (
+    UPLOAD_CHUNK_SIZE, StorageAPIService)
+from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.exports.checkpoints import Checkpoint
+from llc1_document_api.exports.enrichment import EmailEnricher
+from llc1_document_api.exports.progress import (ExportCancelledError,
+                                                ExportProgress)
+from llc1_document_api.exports.slicing import SlicedQuery
+from llc1_document_api.exports.writers import writer_for
+from llc1_document_api.models import SearchQuery
+
+
+def search_query(id, start_datetime, end_datetime, extent, contact_id, session, timeout, bucket, logger, requests,
+                 export_format='json', compression=None, checkpoint=None, progress=None):
+
+    checkpoint = Checkpoint(id, checkpoint)
+    progress = progress or ExportProgress(checkpoint.rows)
+    if checkpoint.after:
+        logger.info("Resuming search query after {} searches".format(checkpoint.rows))
+    else:
+        logger.info("Starting search query")
+
+    def new_part():
+        return writer_for(export_format, compression, SEARCH_QUERY_BUFFER_SIZE, part=True,
+                          continuation=checkpoint.rows > 0)
+
+    writer = new_part()
+    enricher = EmailEnricher(logger, requests)
+
+    try:
+
+        # The query runs in time slices on their own sessions, each with the timeout to prevent it taking too long
+        paid_searches = SlicedQuery(session.session_factory, extent, contact_id, timeout, enricher, logger,
+                                    progress=progress, search_query_id=id)
+
+        logger.info("Querying and looking up emails")
+        progress.set_phase("querying")
+        for result in paid_searches.results(start_datetime, end_datetime, checkpoint.after):
+            with progress.timed('write'):
+                writer.write(result)
+            progress.written()
+            if writer.count >= SEARCH_QUERY_PART_ROWS:
+                with progress.timed('upload'):
+                    checkpoint.save_part(writer, result, session, bucket, logger, requests, progress)
+                writer.close()
+                writer = new_part()
+
+        logger.info("Query completed for {} searches".format(checkpoint.rows + writer.count))
+
+        logger.info("Storing results")
+        progress.set_phase("uploading")
+        with progress.timed('upload'):
+            storage_result = StorageAPIService.save_file_stream(
+                "{}.{}".format(uuid.uuid4().hex, writer.extension),
+                progress.counted(document_chunks(writer, checkpoint.parts, logger, requests)), writer.content_type,
+                bucket, logger, requests)
+
+        # Locked so that a cancellation can't be overwritten by completing the query
+        search_query_obj = session.query(SearchQuery).filter(SearchQuery.id == id).with_for_update().one_or_none()
+        if not search_query_obj:
+            raise ApplicationError("Search query object not found", None, 500)
+        if search_query_obj.status == "CANCELLED":
+            raise ExportCancelledError()
+
+        search_query_obj.document = "/" + storage_result['file'][0]['reference']
+        search_query_obj.external_url = storage_result['file'][0]['external_reference']
+        search_query_obj.completion_timestamp = datetime.utcnow()
+        search_query_obj.status = "COMPLETED"
+        search_query_obj.checkpoint = None
+        progress.set_phase("completed")
+        progress.apply(search_query_obj)
+
+        session.commit()
+
+        logger.info("Results stored, phase timings {}".format(progress.values()['phase_timings']))
+
+        # The parts have been joined into the results document, so are no longer needed
+        delete_parts(checkpoint.parts, logger, requests)
+
+    except Exception:
+        # Discard the failed transaction (e.g. a statement timeout) before recording the failure, the checkpoint
+        # committed after the last uploaded part is kept so the query can be resumed from there
+        session.rollback()
+        search_query_obj = session.query(SearchQuery).filter(SearchQuery.id == id).with_for_update().one_or_none()
+        if not search_query_obj:
+            raise ApplicationError("Search query object not found", None, 500)
+
+        cancelled = search_query_obj.status == "CANCELLED"
+        if cancelled:
+            logger.info("Search query cancelled")
+            progress.set_phase("cancelled")
+            # A cancelled query can't be resumed, so the parts it uploaded are never joined into a document
+            search_query_obj.checkpoint = None
+        else:
+            logger.exception("Failed to complete search query")
+            search_query_obj.completion_timestamp = datetime.utcnow()
+            search_query_obj.status = "FAILED"
+            progress.set_phase("failed")
+        progress.apply(search_query_obj)
+
+        session.commit()
+        if cancelled:
+            delete_parts(checkpoint.parts, logger, requests)
+
+    finally:
+        enricher.close()
+        writer.close()
+        session.rollback()
+        session.close()
+
+
+def delete_parts(parts, logger, requests):
+    """Deletes uploaded parts that are no longer needed. A part that can't be deleted is only logged, as the export it
+    belonged to has already ended."""
+    for reference in parts:
+        try:
+            StorageAPIService.delete_file(reference, logger, requests)
+        except Exception:
+            logger.warning("Failed to delete part {}".format(reference), exc_info=True)
+
+
+def document_chunks(writer, parts, logger, requests):
+    """Joins the uploaded parts and the final part being written into the results document."""
+    yield writer.header()
+    for reference in parts:
+        yield from StorageAPIService.get_file_stream(reference, logger, requests)
+    final_part = writer.finish()
+    yield from iter(lambda: final_part.read(UPLOAD_CHUNK_SIZE), b'')
+    yield writer.footer()
@@ -0,0 +1,97 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from llc1_document_api.dependencies.storage_api_service import \
+    UPLOAD_CHUNK_SIZE
+
+# Time spent in each phase is summed over the threads doing it, so phases that overlap can add up to more than the
+# time the export took
+PHASES = ('query', 'enrich', 'write', 'upload')
+
+
+class ExportCancelledError(Exception):
+    """Raised in the threads running an export once it has been cancelled."""
+
+
+class ExportProgress(object):
+    """Thread safe counters and phase timings of a running export, and whether it has been cancelled.
+
+    They are updated by the threads running the export and saved to its search_query row by the heartbeat, and when
+    the export finishes. The threads check for cancellation between batches and upload chunks.
+    """
+
+    def __init__(self, rows=0):
+        self.lock = threading.Lock()
+        self.phase = "queued"
+        self.rows_scanned = rows
+        self.rows_written = rows
+        self.bytes_uploaded = 0
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check_cancelled(self):
+        if self.cancelled.is_set():
+            raise ExportCancelledError()
+
+    def set_phase(self, phase):
+        with self.lock:
+            self.phase = phase
+
+    @contextmanager
+    def timed(self, phase, timings=None):
+        """Adds the time spent inside it to phase, and to timings as well if given."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                self.timings[phase] += elapsed
+            if timings is not None:
+                timings[phase] += elapsed
+
+    def scanned(self, rows):
+        with self.lock:
+            self.rows_scanned += rows
+
+    def discard(self, rows, timings):
+        """Takes back the rows scanned and time spent by an attempt at a slice that failed, as its rows are scanned
+        again by the attempts that replace it."""
+        with self.lock:
+            self.rows_scanned -= rows
+            for phase, seconds in timings.items():
+                self.timings[phase] -= seconds
+
+    def written(self, rows=1):
+        with self.lock:
+            self.rows_written += rows
+
+    def uploaded(self, size):
+        with self.lock:
+            self.bytes_uploaded += size
+
+    def counted(self, stream):
+        """Wraps a file or iterable of bytes being uploaded, counting the bytes as they are read."""
+        chunks = iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b'') if hasattr(stream, 'read') else stream
+        for chunk in chunks:
+            # Raising here aborts the upload the chunks are being sent in
+            self.check_cancelled()
+            self.uploaded(len(chunk))
+            yield chunk
+
+    def values(self):
+        """The progress as the values of the SearchQuery columns it is saved in."""
+        with self.lock:
+            return {"phase": self.phase,
+                    "rows_scanned": self.rows_scanned,
+                    "rows_written": self.rows_written,
+                    "bytes_uploaded": self.bytes_uploaded,
+                    "phase_timings": {phase: round(seconds, 3) for phase, seconds in self.timings.items()}}
+
+    def apply(self, search_query_obj):
+        for name, value in self.values().items():
+            setattr(search_query_obj, name, value)
@@ -0,0 +1,94 @@
+from geoalchemy2 import shape
+from llc1_document_api.config import SEARCH_QUERY_SUBDIVIDE_VERTICES
+from llc1_document_api.models import SearchItem
+from shapely import get_num_coordinates
+from shapely.geometry import shape as shapely_shape
+from sqlalchemy import and_, func, select, tuple_, union_all
+from sqlalchemy.orm import aliased, undefer
+
+
+def paid_search_query(session, start_datetime, end_datetime, extent, contact_id, include_end=True, after=None):
+    """Builds the query for completed searches in the given window, optionally filtered by extent and contact.
+
+    The end of the window is excluded if include_end is False, so that consecutive windows don't overlap. Results
+    are ordered by (date_of_search, id), and if after is such a pair only the results following it are returned.
+    """
+
+    def criteria(entity):
+        conditions = [entity.date_of_search >= start_datetime,
+                      entity.date_of_search <= end_datetime if include_end else entity.date_of_search < end_datetime,
+                      entity.generation_status.in_(['success', 'not required'])]
+        if contact_id:
+            conditions.append(entity.contact_id == contact_id)
+        if after:
+            conditions.append(tuple_(entity.date_of_search, entity.id) > tuple_(*after))
+        return conditions
+
+    query = session.query(SearchItem)
+
+    # allow no extent, in which case do not filter searches by an extent
+    if extent:
+        query = query.filter(extent_filter(extent, criteria))
+
+    return query \
+        .filter(*criteria(SearchItem)) \
+        .order_by(SearchItem.date_of_search, SearchItem.id) \
+        .options(undefer(SearchItem.search_extent_geojson), undefer(SearchItem.charges))
+
+
+def extent_filter(extent, criteria, max_vertices=SEARCH_QUERY_SUBDIVIDE_VERTICES):
+    """Plans the spatial filter for an extent so that it can make good use of the GiST index on search_geom.
+
+    A single small geometry is matched directly. Otherwise each geometry of the extent is cut into pieces of at most
+    max_vertices with ST_Subdivide, so that the index is probed with a tight bounding box per piece rather than one
+    covering the whole extent, and each candidate is only tested against the small piece it overlaps. A search
+    overlapping several pieces is only returned once, as pieces are matched in a subquery of ids. The subquery is
+    restricted by the rest of the query's criteria, a function giving them for an entity.
+    """
+    geometries = extent_geometries(extent)
+
+    if len(geometries) == 1 and get_num_coordinates(geometries[0]) <= max_vertices:
+        return intersects(SearchItem.search_geom, shape.from_shape(geometries[0], srid=27700))
+
+    pieces = union_all(*[select(func.ST_Subdivide(shape.from_shape(geometry, srid=27700), max_vertices).label('geom'))
+                         for geometry in geometries]).subquery('extent_pieces')
+    candidate = aliased(SearchItem, name='candidate')
+    matching_ids = select(candidate.id) \
+        .join(pieces, intersects(candidate.search_geom, pieces.c.geom)) \
+        .where(*criteria(candidate))
+    return SearchItem.id.in_(matching_ids)
+
+
+def intersects(search_geom, geometry):
+    # && is the bounding box test the GiST index answers, ST_Intersects the exact test of the candidates it finds
+    return and_(search_geom.op('&&')(geometry), func.ST_Intersects(search_geom, geometry))
+
+
+def extent_geometries(extent):
+    """Flattens a GeoJSON FeatureCollection, Feature or geometry into a list of Shapely geometries."""
+    if extent.get('type') == 'FeatureCollection':
+        geometries = [feature.get("geometry") for feature in extent.get("features")]
+    elif extent.get('type') == 'Feature':
+        geometries = [extent.get("geometry")]
+    else:
+        geometries = [extent]
+
+    flattened = []
+    for geometry in geometries:
+        if geometry.get("type") == "GeometryCollection":
+            flattened.extend(shapely_shape(geo) for geo in geometry.get("geometries"))
+        else:
+            flattened.append(shapely_shape(geometry))
+    return flattened
+
+
+def batches(iterable, size):
+    """Groups an iterable into lists of at most size items."""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
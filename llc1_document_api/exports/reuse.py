@@ -0,0 +1,119 @@
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+from llc1_document_api.config import (SEARCH_QUERY_REUSE_SECONDS,
+                                      SEARCH_QUERY_REUSE_TIMEOUT)
+from llc1_document_api.models import SearchItem, SearchQuery
+from psycopg2.errors import QueryCanceled
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+
+def query_fingerprint(parameters, export_format, compression):
+    """Hashes everything that determines the results document of a query, in a normalised form."""
+    normalised = {"start_timestamp": parameters['start_timestamp'],
+                  "end_timestamp": parameters['end_timestamp'],
+                  "extent": parameters.get('extent'),
+                  "contact_id": parameters.get('contact_id'),
+                  "format": export_format,
+                  "compression": compression}
+    return hashlib.sha256(json.dumps(normalised, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def reuse_existing_results(session, search_query_obj, start_datetime, end_datetime):
+    """Looks for an existing query with the same fingerprint as a new one.
+
+    Returns a matching query that is still running, which the new request should share rather than running the
+    query again. Otherwise, if the window is entirely in the past and a matching query completed recently against
+    the same window state, the new query is completed with its document. Returns None unless a query is shared.
+
+    The window state is only summarised here if there is a completed query it could match, and then only for up to
+    SEARCH_QUERY_REUSE_TIMEOUT seconds, after which the query is run rather than reused. Otherwise it is left for the
+    worker to record with record_window_state, so a large window isn't scanned in the request.
+
+    A transaction level advisory lock on the fingerprint is taken first, so that concurrent identical requests are
+    handled one at a time and only the first queues a job. It is held until the new query is committed.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(int(search_query_obj.fingerprint[:15], 16))))
+
+    in_flight = session.query(SearchQuery) \
+        .filter(SearchQuery.fingerprint == search_query_obj.fingerprint, SearchQuery.status == "STARTED") \
+        .order_by(SearchQuery.request_timestamp) \
+        .first()
+    if in_flight:
+        return in_flight
+
+    if not window_in_past(end_datetime):
+        return None
+
+    reusable_after = datetime.utcnow() - timedelta(seconds=SEARCH_QUERY_REUSE_SECONDS)
+    candidates = session.query(SearchQuery) \
+        .filter(SearchQuery.fingerprint == search_query_obj.fingerprint,
+                SearchQuery.status == "COMPLETED",
+                SearchQuery.window_state.isnot(None),
+                SearchQuery.completion_timestamp >= reusable_after) \
+        .order_by(SearchQuery.completion_timestamp.desc()) \
+        .all()
+    if not candidates:
+        return None
+
+    try:
+        # A savepoint, so that a summary that times out doesn't abort the request's transaction
+        with session.begin_nested():
+            session.execute(text("SET LOCAL statement_timeout = {}".format(int(SEARCH_QUERY_REUSE_TIMEOUT * 1000))))
+            search_query_obj.window_state = window_state(session, start_datetime, end_datetime)
+            session.execute(text("SET LOCAL statement_timeout TO DEFAULT"))
+    except OperationalError as e:
+        if not isinstance(e.orig, QueryCanceled):
+            raise
+        return None
+
+    # Only searches in the window that are or become completed are exported, so if the number of them and the
+    # latest id are unchanged so are the results
+    previous = next((candidate for candidate in candidates
+                     if candidate.window_state == search_query_obj.window_state), None)
+    if previous:
+        search_query_obj.document = previous.document
+        search_query_obj.external_url = previous.external_url
+        search_query_obj.completion_timestamp = datetime.utcnow()
+        search_query_obj.status = "COMPLETED"
+
+    return None
+
+
+def record_window_state(session_factory, search_query_id, start_datetime, end_datetime, timeout):
+    """Records the state of a query's window as it is run, if the window is in the past and it hasn't been already, so
+    that identical queries can reuse its document."""
+    if not window_in_past(end_datetime):
+        return
+    session = session_factory()
+    try:
+        # SET LOCAL only lasts until the end of the transaction, so isn't left on the pooled connection
+        session.execute(text("SET LOCAL statement_timeout = {}".format(int(timeout * 1000))))
+        session.query(SearchQuery) \
+            .filter(SearchQuery.id == search_query_id, SearchQuery.window_state.is_(None)) \
+            .update({SearchQuery.window_state: window_state(session, start_datetime, end_datetime)},
+                    synchronize_session=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def window_state(session, start_datetime, end_datetime):
+    """Summarises the completed searches in a window, cheaply from the index on completed searches."""
+    count, max_id = session.query(func.count(SearchItem.id), func.max(SearchItem.id)) \
+        .filter(SearchItem.date_of_search >= start_datetime,
+                SearchItem.date_of_search <= end_datetime,
+                SearchItem.generation_status.in_(['success', 'not required'])) \
+        .one()
+    return {"count": count, "max_id": max_id}
+
+
+def window_in_past(end_datetime):
+    if end_datetime.tzinfo:
+        return end_datetime <= datetime.now(timezone.utc)
+    return end_datetime <= datetime.utcnow()
@@ -0,0 +1,206 @@
+import json
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+
+from llc1_document_api.config import (SEARCH_QUERY_BATCH_SIZE,
+                                      SEARCH_QUERY_BUFFER_SIZE,
+                                      SEARCH_QUERY_MIN_SLICE_SECONDS,
+                                      SEARCH_QUERY_PARALLELISM,
+                                      SEARCH_QUERY_SLICE_ATTEMPTS,
+                                      SEARCH_QUERY_SLICE_DAYS)
+from llc1_document_api.exports.progress import (PHASES, ExportCancelledError,
+                                                ExportProgress)
+from llc1_document_api.exports.queries import batches, paid_search_query
+from llc1_document_api.models import SearchQuery
+from psycopg2.errors import QueryCanceled
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import OperationalError
+
+# A window of date_of_search, the end is only included in the last slice of a query so that slices don't overlap. When
+# resuming an export the first slice starts after the last exported (date_of_search, id)
+TimeSlice = namedtuple('TimeSlice', ['start', 'end', 'include_end', 'after'], defaults=(None,))
+
+
+def backend_tag(search_query_id):
+    """The application_name of a backend while it runs a slice of the query, so that it can be told apart from a later
+    session given the same PID."""
+    return "llc1-export-{}".format(search_query_id)
+
+
+class SlicedQuery(object):
+    """Runs a paid search query as consecutive time slices, several at once on separate pooled connections.
+
+    Each slice has its own statement timeout and is exported to its own spooled file. Slices are read back in order,
+    so results come out ordered by (date_of_search, id) as if they had been queried in one go. Only a slice that fails
+    is rerun: one that times out is split in half, anything else is retried as it was.
+
+    While a slice runs, the PID of its database backend is recorded on the search_query row, so that cancelling the
+    query can cancel the statement. A slice whose statement is cancelled that way cancels the whole export.
+    """
+
+    def __init__(self, session_factory, extent, contact_id, timeout, enricher, logger,
+                 parallelism=SEARCH_QUERY_PARALLELISM, slice_length=timedelta(days=SEARCH_QUERY_SLICE_DAYS),
+                 progress=None, search_query_id=None):
+        self.session_factory = session_factory
+        self.extent = extent
+        self.contact_id = contact_id
+        self.timeout = timeout
+        self.enricher = enricher
+        self.logger = logger
+        self.parallelism = parallelism
+        self.slice_length = slice_length
+        self.progress = progress or ExportProgress()
+        self.search_query_id = search_query_id
+
+    def results(self, start_datetime, end_datetime, after=None):
+        """Yields the enriched results of the query in (date_of_search, id) order, following after if given."""
+        start_datetime = naive_utc(start_datetime)
+        end_datetime = naive_utc(end_datetime)
+        if after:
+            after = (naive_utc(after[0]), after[1])
+            start_datetime = after[0]
+        slices = time_slices(start_datetime, end_datetime, self.slice_length)
+        if after:
+            slices[0] = slices[0]._replace(after=after)
+        slices = iter(slices)
+
+        with ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="export-slice") as executor:
+            # Only a few slices are run ahead of the one being read, bounding the number of spooled files held
+            pending = deque(executor.submit(self.export_slice, time_slice)
+                            for time_slice in islice(slices, self.parallelism))
+            try:
+                while pending:
+                    spools = pending.popleft().result()
+                    time_slice = next(slices, None)
+                    if time_slice:
+                        pending.append(executor.submit(self.export_slice, time_slice))
+                    for spool in spools:
+                        with spool:
+                            for line in spool:
+                                yield json.loads(line)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def export_slice(self, time_slice, attempt=1):
+        """Exports a slice, returning the spooled files holding its results in order."""
+        try:
+            return [self.query_slice(time_slice)]
+        except ExportCancelledError:
+            raise
+        except OperationalError as error:
+            if isinstance(error.orig, QueryCanceled) and 'user request' in str(error.orig):
+                self.progress.cancel()
+                raise ExportCancelledError() from error
+            if isinstance(error.orig, QueryCanceled) and \
+                    time_slice.end - time_slice.start > timedelta(seconds=SEARCH_QUERY_MIN_SLICE_SECONDS):
+                self.logger.warning("Slice {} to {} timed out, splitting it".format(time_slice.start, time_slice.end))
+                first, second = split(time_slice)
+                return self.export_slice(first) + self.export_slice(second)
+            if attempt >= SEARCH_QUERY_SLICE_ATTEMPTS:
+                raise
+        except Exception:
+            if attempt >= SEARCH_QUERY_SLICE_ATTEMPTS:
+                raise
+        self.logger.warning("Slice {} to {} failed, retrying".format(time_slice.start, time_slice.end), exc_info=True)
+        return self.export_slice(time_slice, attempt + 1)
+
+    def query_slice(self, time_slice):
+        session = self.session_factory()
+        spool = SpooledTemporaryFile(max_size=SEARCH_QUERY_BUFFER_SIZE, mode='w+b')
+        backend_pid = None
+        # Counted towards the progress as the slice runs, and taken back off if it fails
+        scanned = 0
+        timings = dict.fromkeys(PHASES, 0.0)
+        try:
+            # SET LOCAL only lasts until the end of the transaction, so isn't left on the pooled connection
+            session.execute(text("SET LOCAL statement_timeout = {}".format(int(self.timeout * 1000))))
+            backend_pid = self.register_backend(session)
+
+            paid_searches = paid_search_query(session, time_slice.start, time_slice.end, self.extent,
+                                              self.contact_id, time_slice.include_end, time_slice.after)
+
+            # Rows are read from a server side cursor in batches, so only one batch of SearchItems is held in memory
+            paid_search_batches = batches(paid_searches.yield_per(SEARCH_QUERY_BATCH_SIZE), SEARCH_QUERY_BATCH_SIZE)
+            while True:
+                self.progress.check_cancelled()
+                with self.progress.timed('query', timings):
+                    batch = next(paid_search_batches, None)
+                    if batch is None:
+                        break
+                    results = [paid_search.to_dict() for paid_search in batch]
+                self.progress.scanned(len(results))
+                scanned += len(results)
+
+                with self.progress.timed('enrich', timings):
+                    self.enricher.enrich(results)
+
+                with self.progress.timed('write', timings):
+                    for result in results:
+                        spool.write(json.dumps(result).encode('utf-8') + b'\n')
+
+            spool.seek(0)
+            return spool
+        except Exception:
+            spool.close()
+            self.progress.discard(scanned, timings)
+            raise
+        finally:
+            # The backend is unregistered before the connection goes back to the pool, so cancelling the query can
+            # never cancel a statement run by something else on the same connection
+            if backend_pid is not None:
+                self.update_backends(func.array_remove(SearchQuery.backend_pids, backend_pid))
+            session.rollback()
+            session.close()
+
+    def register_backend(self, session):
+        if self.search_query_id is None:
+            return None
+        # Only for the slice's transaction, like the statement timeout
+        session.execute(select(func.set_config('application_name', backend_tag(self.search_query_id), True)))
+        backend_pid = session.execute(text("SELECT pg_backend_pid()")).scalar()
+        registered = self.update_backends(func.array_append(SearchQuery.backend_pids, backend_pid),
+                                          SearchQuery.status == "STARTED")
+        if not registered:
+            # Cancelled before the backend could be registered
+            self.progress.cancel()
+            raise ExportCancelledError()
+        return backend_pid
+
+    def update_backends(self, backend_pids, *criteria):
+        # A separate short transaction, as the slice's own would hold a lock on the row until the slice ends
+        session = self.session_factory()
+        try:
+            updated = session.query(SearchQuery).filter(SearchQuery.id == self.search_query_id, *criteria) \
+                .update({SearchQuery.backend_pids: backend_pids}, synchronize_session=False)
+            session.commit()
+            return updated
+        finally:
+            session.close()
+
+
+def naive_utc(value):
+    """The datetime in UTC without an offset, as date_of_search is stored and checkpointed."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def time_slices(start_datetime, end_datetime, slice_length):
+    """Splits a window into consecutive slices of at most slice_length."""
+    slices = []
+    slice_start = start_datetime
+    while slice_start + slice_length < end_datetime:
+        slices.append(TimeSlice(slice_start, slice_start + slice_length, False))
+        slice_start += slice_length
+    slices.append(TimeSlice(slice_start, end_datetime, True))
+    return slices
+
+
+def split(time_slice):
+    middle = time_slice.start + (time_slice.end - time_slice.start) / 2
+    return TimeSlice(time_slice.start, middle, False, time_slice.after), \
+        TimeSlice(middle, time_slice.end, time_slice.include_end)
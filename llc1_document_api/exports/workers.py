@@ -0,0 +1,183 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+from llc1_document_api.app import background_client
+from llc1_document_api.background import BackgroundThreads
+from llc1_document_api.exports.pipeline import search_query
+from llc1_document_api.exports.progress import ExportProgress
+from llc1_document_api.exports.reuse import record_window_state
+from llc1_document_api.metrics import (export_durations, export_phase_seconds,
+                                       export_rows)
+from llc1_document_api.models import SearchQuery
+from sqlalchemy import or_
+from sqlalchemy.orm.scoping import scoped_session
+
+
+class ExportWorkerPool(BackgroundThreads):
+    """Fixed size pool of threads that run the paid search queries queued in the search_query table.
+
+    Queries are queued by inserting a STARTED row. Workers claim them with SELECT ... FOR UPDATE SKIP LOCKED, so any
+    number of processes can share the queue, and heartbeat while they run. A STARTED query whose heartbeat has
+    stopped (e.g. because its worker was recycled) is claimed again, up to SEARCH_QUERY_MAX_ATTEMPTS times, and
+    carries on from its last checkpoint.
+    """
+
+    name = "export-worker"
+    description = "export workers"
+    job_description = "search query"
+    threads_setting = 'SEARCH_QUERY_WORKERS'
+    poll_setting = 'SEARCH_QUERY_POLL_INTERVAL'
+
+    def claim(self):
+        """Claims the oldest unclaimed or abandoned query, returning its details or None if there are none."""
+        session = self.session_factory()
+        try:
+            while True:
+                stale_before = datetime.utcnow() - timedelta(seconds=self.app.config['SEARCH_QUERY_HEARTBEAT_TIMEOUT'])
+                search_query_obj = session.query(SearchQuery) \
+                    .filter(SearchQuery.status == "STARTED") \
+                    .filter(or_(SearchQuery.heartbeat_timestamp.is_(None),
+                                SearchQuery.heartbeat_timestamp < stale_before)) \
+                    .order_by(SearchQuery.request_timestamp) \
+                    .with_for_update(skip_locked=True) \
+                    .first()
+
+                if not search_query_obj:
+                    session.commit()
+                    return None
+
+                if search_query_obj.attempts >= self.app.config['SEARCH_QUERY_MAX_ATTEMPTS'] or \
+                        not search_query_obj.parameters:
+                    self.app.logger.error("Abandoning search query {} after {} attempts".format(
+                        search_query_obj.id, search_query_obj.attempts))
+                    search_query_obj.status = "FAILED"
+                    search_query_obj.completion_timestamp = datetime.utcnow()
+                    session.commit()
+                    continue
+
+                search_query_obj.attempts += 1
+                search_query_obj.heartbeat_timestamp = datetime.utcnow()
+                # Backends left registered by an abandoned attempt, whose worker died mid-slice
+                search_query_obj.backend_pids = None
+                job = {"id": search_query_obj.id,
+                       "parameters": search_query_obj.parameters,
+                       "format": search_query_obj.format,
+                       "compression": search_query_obj.compression,
+                       "checkpoint": search_query_obj.checkpoint,
+                       "trace_id": search_query_obj.trace_id,
+                       "authorization_header": search_query_obj.authorization_header,
+                       "attempt": search_query_obj.attempts}
+                session.commit()
+                return job
+        finally:
+            session.close()
+
+    def execute(self, job):
+        logger = self.app.logger
+        logger.info("Running search query {}, attempt {}".format(job['id'], job['attempt']))
+
+        # A resumed export has already scanned and written the searches up to its checkpoint
+        progress = ExportProgress((job['checkpoint'] or {}).get('rows', 0))
+        heartbeat = Heartbeat(self.session_factory, job['id'], self.app.config['SEARCH_QUERY_HEARTBEAT_INTERVAL'],
+                              logger, progress)
+        heartbeat.start()
+
+        # Each job gets its own client, with the headers of the request that queued it
+        requests = background_client()
+        if job['trace_id']:
+            requests.headers.update({'X-Trace-ID': job['trace_id']})
+        if job['authorization_header']:
+            requests.headers.update({'Authorization': job['authorization_header']})
+
+        parameters = job['parameters']
+        started = time.perf_counter()
+        try:
+            record_window_state(self.session_factory, job['id'], parse(parameters['start_timestamp']),
+                                parse(parameters['end_timestamp']), self.app.config['SEARCH_QUERY_TIMEOUT'])
+        except Exception:
+            # Only stops the results being reused, so the query is still run
+            logger.exception("Failed to record the window state of search query {}".format(job['id']))
+        try:
+            search_query(job['id'], parse(parameters['start_timestamp']), parse(parameters['end_timestamp']),
+                         parameters.get('extent'), parameters.get('contact_id'),
+                         scoped_session(self.session_factory), self.app.config['SEARCH_QUERY_TIMEOUT'],
+                         self.app.config['SEARCH_QUERY_BUCKET'], logger, requests,
+                         export_format=job['format'], compression=job['compression'],
+                         checkpoint=job['checkpoint'], progress=progress)
+        except Exception:
+            logger.exception("Search query {} failed".format(job['id']))
+        finally:
+            heartbeat.stop()
+            requests.close()
+            record_export_metrics(job, progress, time.perf_counter() - started)
+
+
+def record_export_metrics(job, progress, seconds):
+    values = progress.values()
+    # The phase the export ended in is its outcome, completed, cancelled or failed
+    export_durations.observe(seconds, job['format'], values['phase'])
+    # Only the searches written by this attempt, a resumed export starts with those written before it stopped
+    export_rows.inc(job['format'], amount=values['rows_written'] - (job['checkpoint'] or {}).get('rows', 0))
+    for phase, phase_seconds in values['phase_timings'].items():
+        export_phase_seconds.inc(phase, amount=phase_seconds)
+
+
+class Heartbeat(object):
+    """Periodically records that a search query is still being worked on, and how far it has got.
+
+    Once the query is no longer STARTED, i.e. it has been cancelled, the export is told to stop.
+    """
+
+    def __init__(self, session_factory, search_query_id, interval, logger, progress=None):
+        self.session_factory = session_factory
+        self.search_query_id = search_query_id
+        self.interval = interval
+        self.logger = logger
+        self.progress = progress
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="export-heartbeat-{}".format(search_query_id),
+                                       daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.beat()
+
+    def beat(self):
+        values = {SearchQuery.heartbeat_timestamp: datetime.utcnow()}
+        if self.progress:
+            values.update({getattr(SearchQuery, name): value for name, value in self.progress.values().items()})
+        session = self.session_factory()
+        try:
+            updated = session.query(SearchQuery) \
+                .filter(SearchQuery.id == self.search_query_id, SearchQuery.status == "STARTED") \
+                .update(values, synchronize_session=False)
+            session.commit()
+            if not updated and self.progress:
+                self.logger.info("Search query {} is no longer running, stopping export".format(
+                    self.search_query_id))
+                self.progress.cancel()
+        except Exception:
+            self.logger.exception("Failed to record heartbeat for search query {}".format(self.search_query_id))
+            session.rollback()
+        finally:
+            session.close()
+
+
+export_workers = ExportWorkerPool()
+
+
+def register_export_workers(app):
+    """Adds the export worker pool into the app, its threads start on the first request."""
+
+    export_workers.init_app(app)
+
+    app.logger.info("Export workers registered")
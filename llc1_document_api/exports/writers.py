@@ -0,0 +1,146 @@
+import csv
+import gzip
+import io
+import json
+from tempfile import SpooledTemporaryFile
+
+FORMATS = ('json', 'ndjson', 'csv')
+COMPRESSIONS = ('gzip',)
+
+
+class SpooledWriter(object):
+    """Base for writers that serialise items one at a time to a spooled temporary file.
+
+    The file is kept in memory until it grows beyond max_size bytes, after which it rolls over to disk, so the
+    memory used by an export stays bounded however many items are written. With gzip compression the output is
+    compressed as it is written, so max_size applies to the compressed size.
+
+    A writer for a part of a document leaves out the document's prefix and suffix, which are added when the parts
+    are joined. Parts can be joined by concatenation, as concatenated gzip streams are themselves a gzip stream.
+    A continuation is a part that follows other items.
+    """
+
+    content_type = None
+    extension = None
+
+    def __init__(self, max_size, compression=None, part=False, continuation=False):
+        self.file = SpooledTemporaryFile(max_size=max_size, mode='w+b')
+        self.compression = compression
+        if compression == 'gzip':
+            self.stream = gzip.GzipFile(fileobj=self.file, mode='wb')
+            self.content_type = "application/gzip"
+            self.extension = "{}.gz".format(self.extension)
+        else:
+            self.stream = self.file
+        self.part = part
+        self.continuation = continuation
+        self.count = 0
+        if not part:
+            self.stream.write(self.prefix())
+
+    def prefix(self):
+        return b''
+
+    def suffix(self):
+        return b''
+
+    def header(self):
+        """The prefix of the document, compressed ready to be joined with its parts."""
+        return self.compressed(self.prefix())
+
+    def footer(self):
+        """The suffix of the document, compressed ready to be joined with its parts."""
+        return self.compressed(self.suffix())
+
+    def compressed(self, data):
+        if self.compression == 'gzip' and data:
+            return gzip.compress(data)
+        return data
+
+    def write(self, item):
+        self.stream.write(self.serialise(item))
+        self.count += 1
+
+    def serialise(self, item):
+        raise NotImplementedError
+
+    def finish(self):
+        """Terminates the output and rewinds the file ready to be read."""
+        if not self.part:
+            self.stream.write(self.suffix())
+        if self.stream is not self.file:
+            # Closing the gzip stream writes its trailer, but leaves the underlying file open
+            self.stream.close()
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+class JsonArrayWriter(SpooledWriter):
+    """Writes a single JSON array."""
+
+    content_type = "application/json"
+    extension = "json"
+
+    def prefix(self):
+        return b'['
+
+    def suffix(self):
+        return b']'
+
+    def serialise(self, item):
+        return (b',' if self.count or self.continuation else b'') + json.dumps(item).encode('utf-8')
+
+
+class NdjsonWriter(SpooledWriter):
+    """Writes newline delimited JSON, one item per line, so consumers can process items as they read them."""
+
+    content_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def serialise(self, item):
+        return json.dumps(item).encode('utf-8') + b'\n'
+
+
+class CsvWriter(SpooledWriter):
+    """Writes a CSV row per paid search, with its charges and extent flattened into columns."""
+
+    content_type = "text/csv"
+    extension = "csv"
+
+    columns = ('id', 'formatted_id', 'date_of_search', 'document', 'source', 'parent_search_id',
+               'search_area_description', 'generation_status', 'external_url', 'contact_id', 'email', 'language',
+               'number_of_charges', 'charge_ids', 'charge_types', 'search_extent')
+
+    def __init__(self, *args, **kwargs):
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.buffer)
+        super(CsvWriter, self).__init__(*args, **kwargs)
+
+    def prefix(self):
+        return self.row(self.columns)
+
+    def serialise(self, item):
+        charges = item.get('charges') or []
+        values = dict(item,
+                      number_of_charges=len(charges),
+                      charge_ids=";".join(str(charge.get('display-id', '')) for charge in charges),
+                      charge_types=";".join(sorted({charge.get('item', {}).get('charge-type', '')
+                                                    for charge in charges} - {''})),
+                      search_extent=json.dumps(item['search_extent']) if item.get('search_extent') else None)
+        return self.row(values.get(column) for column in self.columns)
+
+    def row(self, values):
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.csv_writer.writerow(values)
+        return self.buffer.getvalue().encode('utf-8')
+
+
+WRITERS = {'json': JsonArrayWriter, 'ndjson': NdjsonWriter, 'csv': CsvWriter}
+
+
+def writer_for(export_format, compression, max_size, part=False, continuation=False):
+    return WRITERS[export_format](max_size, compression, part, continuation)
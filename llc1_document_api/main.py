@@ -1,8 +1,18 @@
 from llc1_document_api.app import app
 from llc1_document_api.blueprints import register_blueprints
 from llc1_document_api.exceptions import register_exception_handlers
+from llc1_document_api.exports.workers import register_export_workers
 from llc1_document_api.extensions import register_extensions
+from llc1_document_api.metrics import register_metrics
+from llc1_document_api.notifications import register_generation_listener
+from llc1_document_api.outbox.dispatcher import register_pdf_dispatcher
+from llc1_document_api.outbox.sweeper import register_generation_sweeper
 
 register_extensions(app)
 register_exception_handlers(app)
 register_blueprints(app)
+register_export_workers(app)
+register_pdf_dispatcher(app)
+register_generation_sweeper(app)
+register_generation_listener(app)
+register_metrics(app)
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import g, request, request_finished, request_started
+from llc1_document_api.extensions import db
+
+# Seconds, for web requests and calls to other APIs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds, for exports, which can take from seconds to the query timeout
+EXPORT_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 900, 1800, 3600)
+
+
+class Metric(object):
+    """A metric whose values are kept per thread, and only added up when they are collected.
+
+    Each thread updates a dict of its own without taking a lock, the lock is only taken the first time a thread records
+    a value, to add its dict to the shards that are summed, and when the thread finishes, to move its values into the
+    retired totals. Values are keyed on a tuple of label values, in the order of labels.
+    """
+
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Shards of running threads by id, as equal dicts can't be told apart in a list
+        self.shards = {}
+        self.retired = {}
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.shards[id(shard)] = shard
+            # The thread local is cleared when its thread finishes, so this is retired along with the thread
+            self.local.thread_exit = thread_exit = ThreadExit()
+            weakref.finalize(thread_exit, self.retire, shard)
+            return shard
+
+    def retire(self, shard):
+        with self.lock:
+            del self.shards[id(shard)]
+            self.merge(self.retired, shard)
+
+    def values(self):
+        # Summed under the lock, so a shard being retired isn't counted both in it and in the retired totals
+        with self.lock:
+            totals = dict(self.retired)
+            for shard in self.shards.values():
+                self.merge(totals, shard)
+        return totals
+
+    def merge(self, totals, shard):
+        # Copied in one step, as the thread it belongs to may be adding to it
+        for label_values, value in list(shard.items()):
+            totals[label_values] = self.add(totals.get(label_values), value)
+
+    def add(self, total, value):
+        return value if total is None else total + value
+
+    def samples(self):
+        """Yields (suffix, label pairs, value) of each sample in the text exposition format."""
+        for label_values, value in sorted(self.values().items()):
+            yield '', list(zip(self.labels, label_values)), value
+
+
+class ThreadExit(object):
+    """Kept in a thread local, so that it is released, calling any finalizers on it, when its thread finishes."""
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount=1):
+        shard = self.shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        shard = self.shard()
+        # The count in each bucket, not including the smaller buckets, then the count above the largest and the sum
+        counts = shard.get(label_values)
+        if counts is None:
+            counts = shard[label_values] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def add(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def samples(self):
+        for label_values, counts in sorted(self.values().items()):
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', labels + [('le', str(bound))], cumulative
+            yield '_sum', labels, counts[-1]
+            yield '_count', labels, cumulative
+
+
+class Collected(Metric):
+    """A metric read when it is collected, from a function returning its values keyed on tuples of label values."""
+
+    def __init__(self, name, description, metric_type, collect, labels=()):
+        super(Collected, self).__init__(name, description, labels)
+        self.type = metric_type
+        self.collect = collect
+
+    def values(self):
+        return self.collect()
+
+
+class Registry(object):
+    """The metrics of one process.
+
+    Every sample is labelled with the process's pid, as each gunicorn worker keeps its own values and a scrape is
+    answered by whichever worker takes it. Each worker is then a series of its own, that only resets when the worker
+    is restarted, and sum() across pids gives the totals.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+        process_labels = [('pid', str(os.getpid()))]
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.description))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                label_text = ','.join('{}="{}"'.format(name, escape(label_value))
+                                      for name, label_value in process_labels + labels)
+                lines.append('{}{}{{{}}} {}'.format(metric.name, suffix, label_text,
+                                                    float(value) if isinstance(value, float) else value))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+http_requests = registry.register(Histogram(
+    'llc1_http_request_duration_seconds', "Time taken to respond to requests, by endpoint",
+    ('endpoint', 'method', 'status')))
+outbound_requests = registry.register(Histogram(
+    'llc1_outbound_request_duration_seconds', "Time taken by calls to other APIs, by dependency",
+    ('dependency', 'method', 'status')))
+export_durations = registry.register(Histogram(
+    'llc1_export_duration_seconds', "Time taken by each attempt at a paid search query export, by outcome",
+    ('format', 'outcome'), buckets=EXPORT_BUCKETS))
+export_rows = registry.register(Counter(
+    'llc1_export_rows_total', "Searches written to paid search query exports", ('format',)))
+export_phase_seconds = registry.register(Counter(
+    'llc1_export_phase_seconds_total', "Time spent by export threads in each phase", ('phase',)))
+pdf_generations = registry.register(Counter(
+    'llc1_pdf_generation_status_total', "Searches that have moved into each generation status", ('status',)))
+swept_generations = registry.register(Counter(
+    'llc1_generation_swept_total', "Searches failed by the sweeper after their PDF generation timed out"))
+
+
+def observe_request_started(sender, **extra):
+    g.metrics_started = time.perf_counter()
+
+
+def observe_request_finished(sender, response, **extra):
+    started = g.get('metrics_started')
+    if started is not None:
+        http_requests.observe(time.perf_counter() - started, request.endpoint or 'none', request.method,
+                              str(response.status_code))
+
+
+def register_metrics(app):
+    """Times every request, and adds the gauges read from the database pool when metrics are collected."""
+    request_started.connect(observe_request_started, app)
+    request_finished.connect(observe_request_finished, app)
+
+    def pool_value(method):
+        def collect():
+            pool = db.engine.pool
+            return {(): getattr(pool, method)()} if hasattr(pool, method) else {}
+        return collect
+
+    for name, method, description in (
+            ('size', 'size', "Connections the database pool keeps open"),
+            ('checked_out', 'checkedout', "Database connections in use"),
+            ('checked_in', 'checkedin', "Database connections idle in the pool"),
+            ('overflow', 'overflow', "Database connections beyond the pool size, negative while there are fewer")):
+        registry.register(Collected('llc1_db_pool_{}'.format(name), description, 'gauge', pool_value(method)))
+
+    app.logger.info("Metrics registered")
@@ -1,14 +1,27 @@
+import json
+from datetime import datetime
+
 from geoalchemy2 import Geometry, shape
 from llc1_document_api.extensions import db
 from shapely.geometry import mapping
 from shapely.geometry import shape as shapely_shape
 from shapely.geometry.collection import GeometryCollection
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import func, inspect, text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
 from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import column_property, deferred, validates
 
 
 class SearchItem(db.Model):
     __tablename__ = 'document_reference'
+    __table_args__ = (
+        # Used by paid search queries, which only ever return completed searches ordered by date
+        db.Index('ix_document_reference_completed_date_of_search', 'date_of_search',
+                 postgresql_where=text("generation_status IN ('success', 'not required')")),
+        db.Index('ix_document_reference_contact_id_date_of_search', 'contact_id', 'date_of_search'),
+        # Used by the sweeper to find searches that have been generating for too long
+        db.Index('ix_document_reference_generation_status_date_of_search', 'generation_status', 'date_of_search'),
+    )
 
     id = db.Column(db.BigInteger, primary_key=True)
     date_of_search = db.Column(db.DateTime)
@@ -18,10 +31,16 @@ class SearchItem(db.Model):
     search_area_description = db.Column(db.String)
     generation_status = db.Column(db.DateTime)
     external_url = db.Column(db.String)
-    charges = db.Column(JSONB)
-    search_geom = db.Column(Geometry(srid=27700))
+    # charges and search_geom can be large so are deferred, undefer them when loading rows that use them
+    charges = deferred(db.Column(JSONB))
+    search_geom = deferred(db.Column(Geometry(srid=27700)))
     contact_id = db.Column(db.String)
     language = db.Column(db.String)
+    # Kept in step with charges, so that the number of charges can be read without loading them
+    number_of_charges = db.Column(db.Integer, nullable=True)
+    # search_geom serialised to GeoJSON by PostGIS. Undefer it when loading rows to be returned by the API, so that
+    # to_dict doesn't have to decode each geometry with Shapely
+    search_extent_geojson = column_property(func.ST_AsGeoJSON(search_geom.columns[0]), deferred=True)
 
     def __init__(self, date_of_search, source, document=None, parent_search_id=None, search_area_description=None,
                  generation_status=None, external_url=None, charges=None, search_extent=None, contact_id=None,
@@ -38,6 +57,11 @@ class SearchItem(db.Model):
         self.contact_id = contact_id
         self.language = language
 
+    @validates('charges')
+    def validate_charges(self, key, charges):
+        self.number_of_charges = len(charges) if isinstance(charges, list) else None
+        return charges
+
     def formatted_id(self):
         padded_id = '{}'.format(self.id).zfill(9)
         formatted_id = ' '.join(padded_id[i:i + 3] for i in range(0, len(padded_id), 3))
@@ -49,14 +73,7 @@ class SearchItem(db.Model):
     def search_extent(self):
         if self.search_geom is None:
             return None
-        extents = mapping(shape.to_shape(self.search_geom))
-        features = []
-        if extents.get('type') == 'GeometryCollection':
-            for geo in extents.get('geometries'):
-                features.append({"type": "Feature", "properties": {}, "geometry": geo})
-        else:
-            features.append({"type": "Feature", "properties": {}, "geometry": extents})
-        return {"type": "FeatureCollection", "features": features}
+        return to_feature_collection(mapping(shape.to_shape(self.search_geom)))
 
     # Convert geojson to geom column
     @search_extent.setter
@@ -83,12 +100,55 @@ class SearchItem(db.Model):
                     "generation_status": self.generation_status,
                     "external_url": self.external_url,
                     "charges": self.charges,
-                    "search_extent": self.search_extent,
+                    "search_extent": self.search_extent_dict(),
                     "contact_id": self.contact_id,
                     "language": self.language,
                     "formatted_id": self.formatted_id()}
         return dict_obj
 
+    def search_extent_dict(self):
+        if 'search_extent_geojson' in inspect(self).unloaded:
+            return self.search_extent
+        if self.search_extent_geojson is None:
+            return None
+        return to_feature_collection(json.loads(self.search_extent_geojson))
+
+
+class PdfGenerationRequest(db.Model):
+    """Outbox of requests to the PDF generation API, written in the same transaction as their SearchItem.
+
+    Rows are delivered and then deleted by the PDF dispatcher. A row is only claimable once its next attempt is due,
+    which is pushed into the future while it is being delivered and after a failed attempt.
+    """
+    __tablename__ = 'pdf_generation_outbox'
+    __table_args__ = (
+        db.Index('ix_pdf_generation_outbox_next_attempt', 'next_attempt_timestamp'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    search_id = db.Column(db.BigInteger, db.ForeignKey('document_reference.id'), nullable=False)
+    payload = db.Column(JSONB, nullable=False)
+    callback_url = db.Column(db.String, nullable=False)
+    trace_id = db.Column(db.String, nullable=True)
+    authorization_header = db.Column(db.String, nullable=True)
+    created_timestamp = db.Column(db.DateTime, nullable=False)
+    next_attempt_timestamp = db.Column(db.DateTime, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __init__(self, search_id, payload, callback_url, trace_id=None, authorization_header=None):
+        self.search_id = search_id
+        self.payload = payload
+        self.callback_url = callback_url
+        self.trace_id = trace_id
+        self.authorization_header = authorization_header
+        self.created_timestamp = datetime.utcnow()
+        self.next_attempt_timestamp = self.created_timestamp
+        self.attempts = 0
+
+
+# Statuses of a search query that has finished running, one way or another
+SEARCH_QUERY_ENDED = ("COMPLETED", "FAILED", "CANCELLED")
+
 
 class SearchQuery(db.Model):
     __tablename__ = 'search_query'
@@ -100,27 +160,89 @@ class SearchQuery(db.Model):
     document = db.Column(db.String, nullable=True)
     external_url = db.Column(db.String, nullable=True)
     status = db.Column(db.String, nullable=False)
-
-    def __init__(self, request_timestamp, completion_timestamp, userid, document, external_url, status):
+    # Job queue state, the export workers claim STARTED queries whose heartbeat is missing or stale
+    parameters = db.Column(JSONB, nullable=True)
+    trace_id = db.Column(db.String, nullable=True)
+    authorization_header = db.Column(db.String, nullable=True)
+    heartbeat_timestamp = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # How the results document is serialised, compression is null when it isn't compressed
+    format = db.Column(db.String, nullable=False, default='json', server_default='json')
+    compression = db.Column(db.String, nullable=True)
+    # Progress of a running or failed export: the last exported (date_of_search, id), rows exported and parts uploaded
+    checkpoint = db.Column(JSONB, nullable=True)
+    # Hash of the normalised parameters, and the state of a past window when queried, for reusing identical queries
+    fingerprint = db.Column(db.String, nullable=True)
+    window_state = db.Column(JSONB, nullable=True)
+    # Progress of the export, saved periodically while it runs. Phase timings are seconds spent in each phase
+    phase = db.Column(db.String, nullable=True)
+    rows_scanned = db.Column(db.BigInteger, nullable=True)
+    rows_written = db.Column(db.BigInteger, nullable=True)
+    bytes_uploaded = db.Column(db.BigInteger, nullable=True)
+    phase_timings = db.Column(JSONB, nullable=True)
+    # PIDs of the database backends running the export's statements, for cancelling them when the query is cancelled
+    backend_pids = db.Column(ARRAY(db.Integer), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_search_query_started', 'request_timestamp', postgresql_where=text("status = 'STARTED'")),
+        db.Index('ix_search_query_fingerprint', 'fingerprint', 'status'),
+    )
+
+    def __init__(self, request_timestamp, completion_timestamp, userid, document, external_url, status,
+                 parameters=None, trace_id=None, authorization_header=None, format='json', compression=None,
+                 fingerprint=None):
         self.request_timestamp = request_timestamp
         self.completion_timestamp = completion_timestamp
         self.userid = userid
         self.document = document
         self.external_url = external_url
         self.status = status
+        self.parameters = parameters
+        self.trace_id = trace_id
+        self.authorization_header = authorization_header
+        self.attempts = 0
+        self.format = format
+        self.compression = compression
+        self.fingerprint = fingerprint
+
+    @validates('status')
+    def validate_status(self, key, status):
+        # The caller's credentials are only needed while the query may still run, so aren't kept once it has ended
+        if status in SEARCH_QUERY_ENDED:
+            self.authorization_header = None
+        return status
 
     def to_dict(self):
         result = {"id": self.id,
                   "request_timestamp": self.request_timestamp.isoformat(),
                   "userid": self.userid,
-                  "status": self.status}
+                  "status": self.status,
+                  "format": self.format}
+        append_to_dict_if_exists(result, 'compression', self.compression)
         append_to_dict_if_exists(result, 'completion_timestamp', format_timestamp_if_exists(self.completion_timestamp))
         append_to_dict_if_exists(result, 'document', self.document)
         append_to_dict_if_exists(result, 'external_url', self.external_url)
+        if self.phase is not None:
+            result['progress'] = {"phase": self.phase,
+                                  "rows_scanned": self.rows_scanned,
+                                  "rows_written": self.rows_written,
+                                  "bytes_uploaded": self.bytes_uploaded,
+                                  "phase_timings": self.phase_timings}
 
         return result
 
 
+def to_feature_collection(extents):
+    """Wraps a GeoJSON geometry in a FeatureCollection, with a feature per geometry of a GeometryCollection"""
+    features = []
+    if extents.get('type') == 'GeometryCollection':
+        for geo in extents.get('geometries'):
+            features.append({"type": "Feature", "properties": {}, "geometry": geo})
+    else:
+        features.append({"type": "Feature", "properties": {}, "geometry": extents})
+    return {"type": "FeatureCollection", "features": features}
+
+
 def append_to_dict_if_exists(item, key, value):
     if value is not None:
         item[key] = value
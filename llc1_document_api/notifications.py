@@ -0,0 +1,114 @@
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from llc1_document_api.background import BackgroundThreads
+from sqlalchemy import func
+from sqlalchemy import select as sql_select
+
+# Channel notified when the PDF generation of a search finishes, successfully or not, with the search id as payload
+GENERATION_CHANNEL = 'llc1_generation'
+# Seconds between attempts to reconnect the listening connection, and between checks that it is still alive
+RECONNECT_INTERVAL = 5
+SELECT_TIMEOUT = 60
+
+
+def notify_generation_finished(session, search_id):
+    """Notifies the listeners of every process that the generation of search_id has finished.
+
+    The notification is sent when the session's transaction commits, so it is never seen before the new status is.
+    """
+    session.execute(sql_select(func.pg_notify(GENERATION_CHANNEL, str(search_id))))
+
+
+class GenerationListener(BackgroundThreads):
+    """LISTENs for finished PDF generations and wakes the long-polls waiting for them.
+
+    Each process has one listening connection, taken out of the pool, which a thread reads notifications from. NOTIFY
+    goes to every listening connection, so a callback handled by any process wakes the polls waiting in all of them.
+    Whenever the connection is lost or reconnected every waiting poll is woken to check the database for itself.
+    """
+
+    name = "generation-listener"
+    description = "PDF generation listener"
+    # Started by the first long-poll instead
+    start_on_request = False
+
+    def __init__(self):
+        super(GenerationListener, self).__init__()
+        self.waiters = {}
+
+    def thread_count(self):
+        return 1
+
+    @contextmanager
+    def waiter(self, search_id):
+        """Yields an Event that is set when the generation of search_id finishes.
+
+        Enter this before checking the status of the search, so that a notification sent after the check isn't missed.
+        """
+        self.start()
+        search_id = str(search_id)
+        event = threading.Event()
+        with self.lock:
+            self.waiters.setdefault(search_id, set()).add(event)
+        try:
+            yield event
+        finally:
+            with self.lock:
+                events = self.waiters[search_id]
+                events.discard(event)
+                if not events:
+                    del self.waiters[search_id]
+
+    def wake(self, search_id=None):
+        """Wakes the polls waiting for search_id, or every waiting poll."""
+        with self.lock:
+            if search_id is None:
+                events = [event for events in self.waiters.values() for event in events]
+            else:
+                events = list(self.waiters.get(search_id, ()))
+        for event in events:
+            event.set()
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception:
+                self.app.logger.exception("Lost connection listening for PDF generation notifications")
+            self.wake()
+            time.sleep(RECONNECT_INTERVAL)
+
+    def listen(self):
+        connection = self.engine.raw_connection()
+        # Kept listening for the life of the process, so it is taken out of the pool
+        connection.detach()
+        try:
+            dbapi_connection = connection.connection
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute("LISTEN {}".format(GENERATION_CHANNEL))
+            # Polls that started waiting while this was (re)connecting may have missed their notification
+            self.wake()
+
+            while True:
+                if select.select([dbapi_connection], [], [], SELECT_TIMEOUT) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    self.wake(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+
+generation_listener = GenerationListener()
+
+
+def register_generation_listener(app):
+    """Adds the PDF generation listener into the app, its thread starts on the first long-poll."""
+
+    generation_listener.init_app(app)
+
+    app.logger.info("PDF generation listener registered")
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+
+from llc1_document_api.app import background_client
+from llc1_document_api.background import BackgroundThreads
+from llc1_document_api.dependencies.pdf_generation_service import \
+    PdfGenerationService
+from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.metrics import pdf_generations
+from llc1_document_api.models import PdfGenerationRequest, SearchItem
+from llc1_document_api.notifications import notify_generation_finished
+
+
+class PdfDispatcher(BackgroundThreads):
+    """Fixed size pool of threads that deliver the requests queued in the pdf_generation_outbox table.
+
+    The size of the pool limits how many requests each process makes to the PDF generation API at once. Requests are
+    claimed with SELECT ... FOR UPDATE SKIP LOCKED and leased for PDF_DISPATCH_LEASE seconds while they are sent, so a
+    request whose dispatcher dies is sent again once its lease expires. The API may therefore receive a request more
+    than once, the callbacks are keyed on the search reference so the last one to arrive is kept.
+
+    A request that fails with a server error, or doesn't get a response, is retried with exponential backoff up to
+    PDF_DISPATCH_MAX_ATTEMPTS times. A search whose request is rejected or runs out of attempts is marked failed.
+
+    Rows hold the bearer token of the request that queued them, so none is kept once it is finished with. Delivered
+    and failed requests are deleted, as are any left behind (e.g. by a dispatcher that died after sending one) once
+    the callback for their search arrives.
+    """
+
+    name = "pdf-dispatcher"
+    description = "PDF dispatchers"
+    job_description = "PDF generation request"
+    threads_setting = 'PDF_DISPATCH_CONCURRENCY'
+    poll_setting = 'PDF_DISPATCH_POLL_INTERVAL'
+
+    def claim(self):
+        """Claims the request that has been due longest, returning its details or None if none are due."""
+        session = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            pdf_request_obj = session.query(PdfGenerationRequest) \
+                .filter(PdfGenerationRequest.next_attempt_timestamp <= now) \
+                .order_by(PdfGenerationRequest.next_attempt_timestamp) \
+                .with_for_update(skip_locked=True) \
+                .first()
+
+            if not pdf_request_obj:
+                session.commit()
+                return None
+
+            pdf_request_obj.attempts += 1
+            pdf_request_obj.next_attempt_timestamp = now + timedelta(seconds=self.app.config['PDF_DISPATCH_LEASE'])
+            pdf_request = {"id": pdf_request_obj.id,
+                           "search_id": pdf_request_obj.search_id,
+                           "payload": pdf_request_obj.payload,
+                           "callback_url": pdf_request_obj.callback_url,
+                           "trace_id": pdf_request_obj.trace_id,
+                           "authorization_header": pdf_request_obj.authorization_header,
+                           "attempt": pdf_request_obj.attempts}
+            session.commit()
+            return pdf_request
+        finally:
+            session.close()
+
+    def execute(self, pdf_request):
+        logger = self.app.logger
+        try:
+            # The headers of each request are sent with it by dispatch_pdf
+            PdfGenerationService.dispatch_pdf(pdf_request, background_client(), logger)
+        except Exception as ex:
+            retry = not isinstance(ex, ApplicationError) or ex.http_code >= 500 or ex.http_code == 429
+            if retry and pdf_request['attempt'] < self.app.config['PDF_DISPATCH_MAX_ATTEMPTS']:
+                delay = self.app.config['PDF_DISPATCH_RETRY_SECONDS'] * 2 ** (pdf_request['attempt'] - 1)
+                logger.warning("Failed to send PDF generation request for search reference {}, retrying in {}s"
+                               .format(pdf_request['search_id'], delay), exc_info=True)
+                self.complete(pdf_request, retry_after=delay)
+            else:
+                logger.exception("Failed to send PDF generation request for search reference {} after {} attempts"
+                                 .format(pdf_request['search_id'], pdf_request['attempt']))
+                self.complete(pdf_request, failed=True)
+        else:
+            self.complete(pdf_request)
+
+    def complete(self, pdf_request, retry_after=None, failed=False):
+        """Removes a request from the outbox, or reschedules it if it is to be retried."""
+        session = self.session_factory()
+        search_failed = 0
+        try:
+            outbox = session.query(PdfGenerationRequest).filter(PdfGenerationRequest.id == pdf_request['id'])
+            if retry_after is not None:
+                outbox.update({PdfGenerationRequest.next_attempt_timestamp:
+                               datetime.utcnow() + timedelta(seconds=retry_after)}, synchronize_session=False)
+            else:
+                outbox.delete(synchronize_session=False)
+            if failed:
+                # Only while still generating, a callback may have arrived from an earlier attempt that got through
+                search_failed = session.query(SearchItem) \
+                    .filter(SearchItem.id == pdf_request['search_id'], SearchItem.generation_status == 'generating') \
+                    .update({SearchItem.generation_status: 'failed'}, synchronize_session=False)
+                notify_generation_finished(session, pdf_request['search_id'])
+            session.commit()
+            if search_failed:
+                pdf_generations.inc('failed')
+        except Exception:
+            self.app.logger.exception("Failed to update PDF generation request for search reference {}".format(
+                pdf_request['search_id']))
+            session.rollback()
+        finally:
+            session.close()
+
+
+pdf_dispatcher = PdfDispatcher()
+
+
+def register_pdf_dispatcher(app):
+    """Adds the PDF dispatcher into the app, its threads start on the first request."""
+
+    pdf_dispatcher.init_app(app)
+
+    app.logger.info("PDF dispatcher registered")
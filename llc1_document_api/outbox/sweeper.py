@@ -0,0 +1,119 @@
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import with_appcontext
+from llc1_document_api.background import BackgroundThreads
+from llc1_document_api.extensions import db
+from llc1_document_api.metrics import pdf_generations, swept_generations
+from llc1_document_api.models import PdfGenerationRequest, SearchItem
+from llc1_document_api.notifications import notify_generation_finished
+from sqlalchemy import select, update
+from sqlalchemy.orm.session import sessionmaker
+
+
+class GenerationSweeper(BackgroundThreads):
+    """Marks searches whose PDF has been generating for longer than ASYNC_PDF_TIMEOUT as failed.
+
+    Otherwise a search whose callback never arrives stays generating until it is polled, or forever. Each process runs
+    a thread sweeping every GENERATION_SWEEP_INTERVAL seconds, and the sweep can also be run with the
+    sweep-expired-generations command. Expired searches are found with the (generation_status, date_of_search) index
+    and updated GENERATION_SWEEP_BATCH_SIZE at a time, each batch in its own short transaction. Rows locked by a
+    callback, or another sweeper, are skipped and left for the next sweep.
+
+    Each sweep that finds anything is logged, and the searches swept are counted in the llc1_generation_swept_total
+    metric.
+    """
+
+    name = "generation-sweeper"
+    description = "generation sweeper"
+    poll_setting = 'GENERATION_SWEEP_INTERVAL'
+
+    def init_app(self, app):
+        super(GenerationSweeper, self).init_app(app)
+        app.cli.add_command(sweep_expired_generations)
+
+    def thread_count(self):
+        return 1 if self.app.config['GENERATION_SWEEP_INTERVAL'] else 0
+
+    def run(self):
+        while True:
+            # Nothing notifies the sweeper, so this waits for the whole interval
+            self.wait()
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception("Failed to sweep expired PDF generations")
+
+    def sweep(self):
+        """Fails every search that has been generating for too long, returning how many were swept."""
+        if not self.session_factory:
+            self.session_factory = sessionmaker(bind=db.engine)
+        batch_size = self.app.config['GENERATION_SWEEP_BATCH_SIZE']
+        # date_of_search is recorded in local time, as it is compared in check_for_result
+        expired_before = datetime.now() - timedelta(seconds=self.app.config['ASYNC_PDF_TIMEOUT'])
+
+        started = time.perf_counter()
+        swept = 0
+        while True:
+            count = self.sweep_batch(expired_before, batch_size)
+            swept += count
+            if count < batch_size:
+                break
+        elapsed = time.perf_counter() - started
+
+        if swept:
+            self.app.logger.info("Swept {} expired PDF generations in {:.3f}s".format(swept, elapsed))
+        return swept
+
+    def sweep_batch(self, expired_before, batch_size):
+        session = self.session_factory()
+        try:
+            expired = select(SearchItem.id) \
+                .where(SearchItem.generation_status == 'generating', SearchItem.date_of_search < expired_before) \
+                .order_by(SearchItem.date_of_search) \
+                .limit(batch_size) \
+                .with_for_update(skip_locked=True) \
+                .scalar_subquery()
+            search_ids = session.execute(
+                update(SearchItem)
+                .where(SearchItem.id.in_(expired))
+                .values(generation_status='failed')
+                .returning(SearchItem.id)
+                .execution_options(synchronize_session=False)).scalars().all()
+
+            if search_ids:
+                # Requests still waiting to be sent are for PDFs that are no longer wanted
+                session.query(PdfGenerationRequest) \
+                    .filter(PdfGenerationRequest.search_id.in_(search_ids)) \
+                    .delete(synchronize_session=False)
+                for search_id in search_ids:
+                    notify_generation_finished(session, search_id)
+            session.commit()
+            if search_ids:
+                pdf_generations.inc('failed', amount=len(search_ids))
+                swept_generations.inc(amount=len(search_ids))
+            return len(search_ids)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+generation_sweeper = GenerationSweeper()
+
+
+@click.command('sweep-expired-generations')
+@with_appcontext
+def sweep_expired_generations():
+    """Marks searches whose PDF generation has timed out as failed."""
+    click.echo("Swept {} expired PDF generations".format(generation_sweeper.sweep()))
+
+
+def register_generation_sweeper(app):
+    """Adds the generation sweeper into the app, its thread starts on the first request."""
+
+    generation_sweeper.init_app(app)
+
+    app.logger.info("Generation sweeper registered")
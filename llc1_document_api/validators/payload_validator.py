@@ -1,27 +1,70 @@
 import simplejson as json
-from jsonschema import validate
+from jsonschema import validators
 from llc1_document_api.schema.callback import CALLBACK_SCHEMA
 from llc1_document_api.schema.extents import PAYLOAD_SCHEMA
 
+DEFINITION_REF = '#/definitions/'
+
+
+def inline_definitions(schema, definitions=None):
+    """Replaces each $ref to the schema's definitions with the definition itself.
+
+    Resolving a $ref is a large part of validating each point of an extent, and the schemas' definitions don't refer
+    to themselves, so they can all be inlined before validating.
+    """
+    if definitions is None:
+        definitions = schema.get('definitions', {})
+    if isinstance(schema, dict):
+        if list(schema) == ['$ref'] and schema['$ref'].startswith(DEFINITION_REF):
+            return inline_definitions(definitions[schema['$ref'][len(DEFINITION_REF):]], definitions)
+        return {key: inline_definitions(value, definitions) for key, value in schema.items() if key != 'definitions'}
+    if isinstance(schema, list):
+        return [inline_definitions(item, definitions) for item in schema]
+    return schema
+
+
+def compile_schema(schema):
+    # Built once at import, jsonschema.validate checks the schema and builds a new validator for it on every call
+    return validators.validator_for(schema)(inline_definitions(schema))
+
+
+PAYLOAD_VALIDATOR = compile_schema(PAYLOAD_SCHEMA)
+CALLBACK_VALIDATOR = compile_schema(CALLBACK_SCHEMA)
+
+
+def parse_valid(body, validator):
+    try:
+        json_ = json.loads(body)
+    except Exception:
+        return None
+    if not validator.is_valid(json_):
+        return None
+    return json_
+
 
 class PayloadValidator(object):
 
     @staticmethod
     def validate(extents):
-        """Returns true if the given extents are valid. False otherwise."""
+        """Returns the parsed request if the given extents are valid, so it isn't parsed again. None otherwise."""
+        return parse_valid(extents, PAYLOAD_VALIDATOR)
+
+    @staticmethod
+    def validate_batch(payloads):
+        """Returns each of a batch of payloads with its first error, or None if it is valid.
+
+        Returns None if the batch isn't a JSON array.
+        """
         try:
-            json_ = json.loads(extents)
-            validate(json_, PAYLOAD_SCHEMA)
-            return True
+            json_ = json.loads(payloads)
         except Exception:
-            return False
+            return None
+        if not isinstance(json_, list):
+            return None
+        return [(payload, next((error.message for error in PAYLOAD_VALIDATOR.iter_errors(payload)), None))
+                for payload in json_]
 
     @staticmethod
     def validate_callback(callback):
-        """Returns true if the given extents are valid. False otherwise."""
-        try:
-            json_ = json.loads(callback)
-            validate(json_, CALLBACK_SCHEMA)
-            return True
-        except Exception:
-            return False
+        """Returns the parsed callback if it is valid. None otherwise."""
+        return parse_valid(callback, CALLBACK_VALIDATOR)
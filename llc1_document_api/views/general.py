@@ -1,11 +1,35 @@
 import datetime
 import json
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import lru_cache
 
 from flask import Blueprint, Response, current_app, g, request
+from llc1_document_api.config import (DEPENDENCIES, HEALTH_CASCADE_CACHE_TTL,
+                                      HEALTH_CASCADE_TIMEOUT,
+                                      MAX_HEALTH_CASCADE)
+from llc1_document_api.extensions import db
+from llc1_document_api.metrics import registry
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+from sqlalchemy import create_engine, func, select, text
 
 # This is the blueprint object that gets registered into the app in blueprints.py.
 general = Blueprint('general', __name__)
 
+# Seconds a cascade has left, sent to each dependency so it gives up on its own dependencies before we give up on it
+CASCADE_BUDGET_HEADER = 'X-Health-Cascade-Budget'
+
+# Cascade results by depth, shared by the probes of every load balancer. Only one probe at a time checks each depth,
+# the others wait for its result
+cascade_cache = TTLCache(int(MAX_HEALTH_CASCADE) + 1, HEALTH_CASCADE_CACHE_TTL)
+cascade_locks = [threading.Lock() for _ in range(int(MAX_HEALTH_CASCADE) + 1)]
+# Enough threads to check the database and every dependency at every depth at once, twice over for the checks of an
+# earlier probe that are still finishing after it timed out
+health_executor = ThreadPoolExecutor(max_workers=2 * (len(DEPENDENCIES) + 1) * (int(MAX_HEALTH_CASCADE) + 1),
+                                     thread_name_prefix="health-cascade")
+
 
 @general.route("/health")
 def check_status():
@@ -17,6 +41,11 @@ def check_status():
     }), mimetype='application/json', status=200)
 
 
+@general.route("/metrics")
+def metrics():
+    return Response(response=registry.exposition(), mimetype='text/plain; version=0.0.4', status=200)
+
+
 @general.route("/health/cascade/<str_depth>")
 def cascade_health(str_depth):
     depth = int(str_depth)
@@ -30,73 +59,17 @@ def cascade_health(str_depth):
             "status": "ERROR",
             "timestamp": str(datetime.datetime.now())
         }), mimetype='application/json', status=500)
-    dbs = []
-    services = []
-    overall_status = 200  # if we encounter a failure at any point then this will be set to != 200
-    if current_app.config.get("DEPENDENCIES") is not None:
-        for dependency, value in current_app.config.get("DEPENDENCIES").items():
-            # Below is an example of hitting a database dependency - in this instance postgresql
-            # It requires a route to obtain the current timestamp to be declared somewhere in code
-            # In the below example we have an sql.py script containing the get_current_timestamp() function
-            # if "postgres" in value:
-            #    # postgres db url - try calling current timestamp routine
-            #    db = {}
-            #    db["name"] = dependency
-            #    try:
-            #        db_timestamp = db_timestamp = postgres.get_current_timestamp()
-            #        # trim microseconds to 3 to match java
-            #        db["current_timestamp"] = db_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
-            #        db["status"] = "OK"
-            #    except Exception as e:
-            #        current_app.logger.error("Unknown error occured during health cascade on request to database: {};"
-            #                                 " full error: {}.".format(dependency, e))
-            #        overall_status = 500
-            #        db["status"] = "BAD"
-            #    finally:
-            #        dbs.append(db)
-            # else:  # indent the following code to match the if..else block when database checks are included
-            if depth > 0:
-                # As there is an inconsistant approach to url variables we need to check
-                # to see if we have a trailing '/' and add one if not
-                if value[-1] != '/':
-                    value = value + '/'
-                # Setup our service entry
-                service = {
-                    "name": dependency,
-                    "type": "http"
-                }
-                try:
-                    resp = g.requests.get(value + 'health/cascade/' + str(depth - 1))  # Try and request the health
-                except ConnectionAbortedError as e:  # More specific logging statement for abortion error
-                    current_app.logger.error("Connection Aborted during health cascade on attempt to connect to {};"
-                                             " full error: {}".format(dependency, e))
-                    service["status"] = "UNKNOWN"
-                    overall_status = 500
-                    service["status_code"] = None
-                    service["content_type"] = None
-                    service["content"] = None
-                except Exception as e:  # Generic catch-all exception
-                    current_app.logger.error("Unknown error occured during health cascade on request to {};"
-                                             " full error: {}".format(dependency, e))
-                    service["status"] = "UNKNOWN"
-                    overall_status = 500
-                    service["status_code"] = None
-                    service["content_type"] = None
-                    service["content"] = None
-                else:   # Everything worked
-                    service["status_code"] = resp.status_code
-                    service["content_type"] = resp.headers["content-type"]
-                    service["content"] = resp.json()
-                    if resp.status_code == 200:  # Happy route, happy service, happy status_code.
-                        service["status"] = "OK"
-                    elif resp.status_code == 500:  # Something went wrong
-                        service["status"] = "BAD"
-                        overall_status = 500
-                    else:   # Who knows what happened.
-                        service["status"] = "UNKNOWN"
-                        overall_status = 500
-                finally:
-                    services.append(service)
+    full_budget = current_app.config["HEALTH_CASCADE_TIMEOUT"]
+    budget = full_budget
+    try:
+        budget = min(budget, float(request.headers.get(CASCADE_BUDGET_HEADER, budget)))
+    except ValueError:
+        pass
+    checked = cascade_cache.get(depth)
+    if checked is MISSING:
+        checked = refresh_cascade(depth, budget, budget >= full_budget)
+    dbs, services, overall_status = checked
+
     response_json = {
         "cascade_depth": depth,
         "server_timestamp": str(datetime.datetime.now()),
@@ -112,3 +85,162 @@ def cascade_health(str_depth):
     else:
         response_json['status'] = "OK"
     return Response(response=json.dumps(response_json), mimetype='application/json', status=overall_status)
+
+
+def refresh_cascade(depth, budget, full_budget):
+    """Checks the dependencies at depth, unless another probe is already checking them, in which case its result is
+    waited for.
+
+    Results are only cached if every check finished within the full budget. One that timed out, or was checked with
+    less than the full budget because the caller's was smaller or it had to wait, may not hold for the next probe.
+    """
+    deadline = time.monotonic() + budget
+    lock = cascade_locks[depth]
+    waited = not lock.acquire(blocking=False)
+    if waited and not lock.acquire(timeout=budget):
+        return summarise([timed_out(entry, budget, current_app.logger) for entry, _ in cascade_checks(depth)])
+    try:
+        checked = cascade_cache.get(depth)
+        if checked is MISSING:
+            checked = check_dependencies(depth, max(deadline - time.monotonic(), 0))
+            dbs, services, _ = checked
+            if full_budget and not waited and not any(result.get("error") == "timed out"
+                                                      for result in dbs + services):
+                cascade_cache.set(depth, checked)
+        return checked
+    finally:
+        lock.release()
+
+
+def cascade_checks(depth):
+    """The entry in the response of each check made at depth, and the URL of the dependency's cascade if it has one."""
+    checks = [({"name": "postgres"}, None)]
+    if depth > 0:
+        for dependency, value in (current_app.config.get("DEPENDENCIES") or {}).items():
+            # As there is an inconsistant approach to url variables we need to check
+            # to see if we have a trailing '/' and add one if not
+            if value[-1] != '/':
+                value = value + '/'
+            checks.append(({"name": dependency, "type": "http"}, value + 'health/cascade/' + str(depth - 1)))
+    return checks
+
+
+def check_dependencies(depth, budget):
+    """Checks the database and, if depth > 0, each dependency at depth - 1, all at once.
+
+    Returns the db and services sections of the response and its status. Checks still running when the budget runs out
+    are reported as timed out.
+    """
+    deadline = time.monotonic() + budget
+    timeout = max(budget - current_app.config["HEALTH_CASCADE_HOP_MARGIN"], 0.1)
+    logger = current_app.logger
+    engine = health_engine(db.engine.url)
+    checks = {}
+    for entry, url in cascade_checks(depth):
+        if url is None:
+            future = health_executor.submit(check_database, engine, db.engine.pool, timeout, logger)
+        else:
+            future = health_executor.submit(check_service, entry["name"], url, timeout, g.requests, logger)
+        checks[future] = entry
+
+    wait(checks, timeout=max(deadline - time.monotonic(), 0))
+
+    results = []
+    for future, entry in checks.items():
+        if future.done():
+            results.append(future.result())
+        else:
+            future.cancel()
+            results.append(timed_out(entry, budget, logger))
+    return summarise(results)
+
+
+def timed_out(entry, budget, logger):
+    logger.error("Health cascade check of {} timed out after {}s".format(entry["name"], budget))
+    result = dict(entry, status="UNKNOWN", error="timed out")
+    if "type" in entry:
+        result.update(status_code=None, content_type=None, content=None)
+    return result
+
+
+def summarise(results):
+    """Splits the results of the checks into the db and services sections of the response, and gives its status."""
+    dbs = []
+    services = []
+    overall_status = 200  # if we encounter a failure at any point then this will be set to != 200
+    for result in results:
+        if result["status"] != "OK":
+            overall_status = 500
+        (services if "type" in result else dbs).append(result)
+    return dbs, services, overall_status
+
+
+@lru_cache(maxsize=None)
+def health_engine(url):
+    """An engine of the health checks' own, with a single connection.
+
+    A connection can't be taken from the app's pool with a timeout of its own, and that pool may be in use by exports,
+    so a health check could wait for it long after the probe has given up. Connecting and checking out the connection
+    each give up within HEALTH_CASCADE_TIMEOUT. Each check only reads the current timestamp, so checks of different
+    depths at once take turns with it rather than each process opening more connections.
+    """
+    return create_engine(url, pool_size=1, max_overflow=0, pool_timeout=HEALTH_CASCADE_TIMEOUT,
+                         pool_recycle=current_app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_recycle"],
+                         connect_args={"connect_timeout": max(2, math.ceil(HEALTH_CASCADE_TIMEOUT))})
+
+
+def check_database(engine, pool, timeout, logger):
+    """Reads the database's current timestamp, giving up after timeout, and reports the state of the app's pool."""
+    database = {"name": "postgres"}
+    try:
+        with engine.begin() as connection:
+            # SET LOCAL only lasts until the end of the transaction, so isn't left on the pooled connection
+            connection.execute(text("SET LOCAL statement_timeout = {}".format(int(timeout * 1000))))
+            db_timestamp = connection.execute(select(func.now())).scalar()
+        # trim microseconds to 3 to match java
+        database["current_timestamp"] = db_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
+        database["status"] = "OK"
+    except Exception as e:
+        logger.error("Unknown error occured during health cascade on request to database: postgres;"
+                     " full error: {}.".format(e))
+        database["status"] = "BAD"
+    if hasattr(pool, "checkedout"):
+        database["pool"] = {"size": pool.size(),
+                            "checked_in": pool.checkedin(),
+                            "checked_out": pool.checkedout(),
+                            "overflow": pool.overflow()}
+    return database
+
+
+def check_service(dependency, url, timeout, requests, logger):
+    service = {
+        "name": dependency,
+        "type": "http"
+    }
+    try:
+        resp = requests.get(url, timeout=timeout, headers={CASCADE_BUDGET_HEADER: str(round(timeout, 3))})
+    except ConnectionAbortedError as e:  # More specific logging statement for abortion error
+        logger.error("Connection Aborted during health cascade on attempt to connect to {};"
+                     " full error: {}".format(dependency, e))
+        service["status"] = "UNKNOWN"
+        service["status_code"] = None
+        service["content_type"] = None
+        service["content"] = None
+    except Exception as e:  # Generic catch-all exception
+        logger.error("Unknown error occured during health cascade on request to {};"
+                     " full error: {}".format(dependency, e))
+        service["status"] = "UNKNOWN"
+        service["status_code"] = None
+        service["content_type"] = None
+        service["content"] = None
+    else:   # Everything worked
+        service["status_code"] = resp.status_code
+        service["content_type"] = resp.headers["content-type"]
+        service["content"] = resp.json()
+        if resp.status_code == 200:  # Happy route, happy service, happy status_code.
+            service["status"] = "OK"
+        elif resp.status_code == 500:  # Something went wrong
+            service["status"] = "BAD"
+        else:   # Who knows what happened.
+            service["status"] = "UNKNOWN"
+    return service
@@ -7,33 +7,40 @@ from llc1_document_api.dependencies.pdf_generation_service import \
     PdfGenerationService
 from llc1_document_api.exceptions import ApplicationError
 from llc1_document_api.extensions import db
+from llc1_document_api.metrics import pdf_generations
 from llc1_document_api.models import SearchItem
+from llc1_document_api.notifications import generation_listener
+from llc1_document_api.outbox.dispatcher import pdf_dispatcher
 from llc1_document_api.validators.payload_validator import PayloadValidator
+from sqlalchemy.orm import load_only, undefer
 
 generate = Blueprint('generate', __name__, url_prefix='/v1.0')
 
+# Columns loaded to check the result of a search, charges are only loaded when supporting documents are asked for
+POLL_COLUMNS = load_only(SearchItem.id, SearchItem.date_of_search, SearchItem.document, SearchItem.external_url,
+                         SearchItem.generation_status, SearchItem.number_of_charges)
+WITH_CHARGES = undefer(SearchItem.charges)
+# The callback only sets columns, which don't have to be loaded to be set
+CALLBACK_COLUMNS = load_only(SearchItem.id)
+
 
 @generate.route("/generate_async", methods=['POST'])
 def generate_llc1_async():
     """Generates an LLC1 document from the given extents and returns the URL to it's location in the file store."""
     current_app.logger.info("Endpoint called, validating payload")
 
-    if not PayloadValidator.validate(request.get_data()):
+    request_json = PayloadValidator.validate(request.get_data())
+    if request_json is None:
         raise ApplicationError('The request body was invalid', None, 400)
 
-    request_json = request.get_json()
     request_format = request_json.get('format', 'PDF')
 
-    search_item = SearchItem(datetime.now(), request_json.get('source'),
-                             parent_search_id=request_json.get('parent_search_id'),
-                             search_area_description=request_json.get('description'),
-                             search_extent=request_json.get('extents'),
-                             contact_id=request_json.get('contact_id'),
-                             language=request_json.get('language'))
+    search_item = new_search_item(request_json)
 
     if request_format == 'PDF':
-        current_app.logger.info("Payload validated, generating PDF")
+        current_app.logger.info("Payload validated, queueing PDF generation")
         PdfGenerationService.generate_pdf(request_json, search_item)
+        pdf_dispatcher.notify()
         return Response(json.dumps({"status": search_item.generation_status,
                                     "search_reference": search_item.formatted_id()}), 202, mimetype="application/json")
     else:
@@ -47,6 +54,7 @@ def generate_llc1_async():
         try:
             db.session.add(search_item)
             db.session.commit()
+            pdf_generations.inc('not required')
             current_app.logger.info("Alternative format LLC1 completed for reference {}".format(search_item.id))
         except Exception as ex:
             db.session.rollback()
@@ -58,21 +66,84 @@ def generate_llc1_async():
                                     "search_reference": search_item.formatted_id()}), 201, mimetype="application/json")
 
 
+@generate.route("/generate_async/batch", methods=['POST'])
+def generate_llc1_async_batch():
+    """Generates a batch of LLC1 documents, returning the search reference and status of each in the order given."""
+    current_app.logger.info("Endpoint called, validating batch")
+
+    validated = PayloadValidator.validate_batch(request.get_data())
+    if not validated:
+        raise ApplicationError('The request body was invalid', None, 400)
+    if len(validated) > config.LLC1_BATCH_MAX_SIZE:
+        raise ApplicationError('A batch can contain at most {} requests'.format(config.LLC1_BATCH_MAX_SIZE), None,
+                               400)
+
+    results = []
+    batch = []
+    for request_json, error in validated:
+        if not error and request_json.get('format', 'PDF') != 'PDF' and request_json.get('charges') is None:
+            error = 'Alternative format requests must contain a list of charges'
+        if error:
+            results.append({"status": "invalid", "error": error})
+            continue
+
+        search_item = new_search_item(request_json)
+        if request_json.get('format', 'PDF') != 'PDF':
+            search_item.charges = request_json['charges']
+            search_item.generation_status = 'not required'
+        batch.append((request_json, search_item))
+        results.append(search_item)
+
+    current_app.logger.info("Batch validated, recording {} of {} requests".format(len(batch), len(validated)))
+    try:
+        queued = PdfGenerationService.generate_pdfs(batch)
+    except Exception as ex:
+        db.session.rollback()
+        current_app.logger.exception('Failed to record LLC1 batch. TraceID : {} - Exception :{}'.format(
+            g.trace_id,
+            ex))
+        raise ApplicationError("Error recording LLC1", "LLC1-01", 500)
+    if queued:
+        pdf_dispatcher.notify(queued)
+
+    results = [result if isinstance(result, dict) else
+               {"status": "created" if result.generation_status == 'not required' else result.generation_status,
+                "search_reference": result.formatted_id()}
+               for result in results]
+    return Response(json.dumps(results), 202, mimetype="application/json")
+
+
 @generate.route("/poll_llc1/<search_ref>", methods=['GET'])
 def poll_llc1(search_ref):
-    """Polls for LLC1 document PDF"""
+    """Polls for LLC1 document PDF
+
+    With wait=<seconds> this is a long-poll, that responds as soon as the PDF is generated or the wait is over
+    """
 
     return_supporting_docs = False
     if request.args.get('return_supporting_docs') and request.args.get('return_supporting_docs').lower() == 'true':
         return_supporting_docs = True
 
-    current_app.logger.info("Payload validated, polling for PDF")
+    try:
+        wait = min(float(request.args.get('wait', 0)), config.LLC1_POLL_MAX_WAIT)
+    except ValueError:
+        raise ApplicationError("wait must be a number of seconds", "POL-02", 400)
 
-    search_item = SearchItem.query.get(int(search_ref.replace(' ', '')))
-    if not search_item:
-        raise ApplicationError("Requested search reference not found", "POL-01", 404)
+    current_app.logger.info("Payload validated, polling for PDF")
 
-    pdf = PdfGenerationService.check_for_result(search_item, config.ASYNC_PDF_TIMEOUT, return_supporting_docs)
+    search_id = int(search_ref.replace(' ', ''))
+
+    if wait > 0:
+        with generation_listener.waiter(search_id) as finished:
+            pdf = poll_for_result(search_id, return_supporting_docs)
+            if not pdf:
+                # Return the database connection to the pool while waiting, the search is only read again once the
+                # callback has been handled
+                db.session.close()
+                if finished.wait(wait):
+                    pdf = poll_for_result(search_id, return_supporting_docs)
+    else:
+        pdf = poll_for_result(search_id, return_supporting_docs)
 
     if not pdf:
         return Response(json.dumps({"status": "generating"}), 202, mimetype="application/json")
@@ -80,21 +151,31 @@ def poll_llc1(search_ref):
     return Response(json.dumps(pdf), 201, mimetype="application/json")
 
 
+def poll_for_result(search_id, return_supporting_docs):
+    options = (POLL_COLUMNS, WITH_CHARGES) if return_supporting_docs else (POLL_COLUMNS,)
+    search_item = SearchItem.query.options(*options).get(search_id)
+    if not search_item:
+        raise ApplicationError("Requested search reference not found", "POL-01", 404)
+
+    return PdfGenerationService.check_for_result(search_item, config.ASYNC_PDF_TIMEOUT, return_supporting_docs)
+
+
 @generate.route("/pdf_callback/<search_ref>", methods=['POST'])
 def callback_llc1(search_ref):
     """Callback for LLC1 document PDF"""
     current_app.logger.info("Endpoint called, validating payload")
 
-    if not PayloadValidator.validate_callback(request.get_data()):
+    callback = PayloadValidator.validate_callback(request.get_data())
+    if callback is None:
         raise ApplicationError('The request body was invalid', None, 400)
 
     current_app.logger.info("Payload validated, polling for PDF")
 
-    search_item = SearchItem.query.get(int(search_ref.replace(' ', '')))
+    search_item = SearchItem.query.options(CALLBACK_COLUMNS).get(int(search_ref.replace(' ', '')))
     if not search_item:
         raise ApplicationError("Requested search reference not found", "CBAC-01", 404)
 
-    PdfGenerationService.callback(search_item, request.get_json())
+    PdfGenerationService.callback(search_item, callback)
 
     return Response(json.dumps({"status": "accepted"}), 202, mimetype="application/json")
 
@@ -104,4 +185,19 @@ def llc1_languages():
     """Retrieve available languages from pdf generator"""
     current_app.logger.info("Endpoint called, polling for PDF languages")
 
-    return Response(PdfGenerationService.get_languages(), 200, mimetype="application/json")
+    languages = PdfGenerationService.get_languages()
+    response = Response(languages.text, 200, mimetype="application/json")
+    # Lets clients reuse their copy, and revalidate it with If-None-Match once it is stale
+    response.set_etag(languages.etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = config.LANGUAGES_CACHE_TTL
+    return response.make_conditional(request)
+
+
+def new_search_item(request_json):
+    return SearchItem(datetime.now(), request_json.get('source'),
+                      parent_search_id=request_json.get('parent_search_id'),
+                      search_area_description=request_json.get('description'),
+                      search_extent=request_json.get('extents'),
+                      contact_id=request_json.get('contact_id'),
+                      language=request_json.get('language'))
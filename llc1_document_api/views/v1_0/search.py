@@ -1,23 +1,18 @@
 import json
-import uuid
 from datetime import datetime
-from threading import Thread
 
 from dateutil.parser import parse
 from flask import Blueprint, Response, current_app, g, request
-from geoalchemy2 import shape
-from llc1_document_api.dependencies.search_local_land_charge_service import \
-    SearchLocalLandChargeService
-from llc1_document_api.dependencies.storage_api_service import \
-    StorageAPIService
 from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.exports.reuse import (query_fingerprint,
+                                             reuse_existing_results)
+from llc1_document_api.exports.slicing import backend_tag
+from llc1_document_api.exports.workers import export_workers
+from llc1_document_api.exports.writers import COMPRESSIONS, FORMATS
 from llc1_document_api.extensions import db
 from llc1_document_api.models import SearchItem, SearchQuery
-from shapely.geometry import shape as shapely_shape
-from shapely.geometry.collection import GeometryCollection
-from sqlalchemy import func
-from sqlalchemy.orm.scoping import scoped_session
-from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy import column, func, select, table
+from sqlalchemy.orm import undefer
 
 search = Blueprint('search', __name__, url_prefix='/v1.0/paid-searches')
 
@@ -32,6 +27,7 @@ def get_paid_search_by_id(search_id):
     current_app.logger.info("Endpoint called, retrieving data for search {}".format(search_id))
 
     paid_searches_query = SearchItem.query \
+        .options(undefer(SearchItem.search_extent_geojson), undefer(SearchItem.charges)) \
         .filter(SearchItem.id == search_id, SearchItem.generation_status.in_(('success', 'not required')))
 
     paid_searches = paid_searches_query.all()
@@ -58,6 +54,8 @@ def post_paid_search_query():
     extent = request_json.get('extent')
     customer_id = request_json.get('customer_id')
     uuid = request_json.get('uuid')
+    export_format = request_json.get('format', 'json')
+    compression = request_json.get('compression')
 
     contact_id = None
     if uuid:
@@ -68,27 +66,44 @@ def post_paid_search_query():
     if not (start_timestamp and end_timestamp):
         raise ApplicationError('The request body was invalid', None, 400)
 
-    start_datetime = parse(start_timestamp)
-    end_datetime = parse(end_timestamp)
-
-    search_query_obj = SearchQuery(datetime.utcnow(), None, g.jwt.principle.principle_id, None, None, "STARTED")
-    db.session.add(search_query_obj)
-    db.session.flush()
-    db.session.refresh(search_query_obj)
+    if export_format not in FORMATS:
+        raise ApplicationError("Format must be one of {}".format(", ".join(FORMATS)), None, 400)
 
-    session_factory = sessionmaker(bind=db.engine)
-    session = scoped_session(session_factory)
+    if compression is not None and compression not in COMPRESSIONS:
+        raise ApplicationError("Compression must be one of {}".format(", ".join(COMPRESSIONS)), None, 400)
 
-    current_app.logger.info("Querying for charges with filter {}".format(request_json))
+    start_datetime = parse(start_timestamp)
+    end_datetime = parse(end_timestamp)
 
-    extract_thread = Thread(target=search_query, args=(
-        search_query_obj.id, start_datetime, end_datetime, extent, contact_id, session,
-        current_app.config['SEARCH_QUERY_TIMEOUT'], current_app.config['SEARCH_QUERY_BUCKET'], current_app.logger,
-        g.requests), daemon=True)
-    extract_thread.start()
+    # The query is queued for the export workers, which pick up everything needed to run it from this row
+    parameters = {"start_timestamp": start_datetime.isoformat(),
+                  "end_timestamp": end_datetime.isoformat(),
+                  "extent": extent,
+                  "contact_id": contact_id}
+
+    search_query_obj = SearchQuery(datetime.utcnow(), None, g.jwt.principle.principle_id, None, None, "STARTED",
+                                   parameters=parameters, trace_id=g.trace_id,
+                                   authorization_header=request.headers['Authorization'],
+                                   format=export_format, compression=compression,
+                                   fingerprint=query_fingerprint(parameters, export_format, compression))
+
+    # An identical query that is still running is shared rather than run twice
+    shared_query = reuse_existing_results(db.session, search_query_obj, start_datetime, end_datetime)
+    if shared_query:
+        db.session.commit()
+        current_app.logger.info("Sharing running query {}".format(shared_query.id))
+        return json.dumps(shared_query.to_dict(), sort_keys=True), 202, \
+            {"Content-Type": "application/json"}
 
+    db.session.add(search_query_obj)
     db.session.commit()
 
+    if search_query_obj.status == "COMPLETED":
+        current_app.logger.info("Reused results of an identical query")
+    else:
+        current_app.logger.info("Queueing query for charges with filter {}".format(request_json))
+        export_workers.notify()
+
     return json.dumps(search_query_obj.to_dict(), sort_keys=True), 202, \
         {"Content-Type": "application/json"}
 
@@ -107,111 +122,68 @@ def get_paid_search_query(query_id):
         {"Content-Type": "application/json"}
 
 
-def search_query(id, start_datetime, end_datetime, extent, contact_id, session, timeout, bucket, logger, requests):
-
-    logger.info("Starting search query")
-
-    try:
-
-        # prevent query taking too long
-        session.connection().execute("SET statement_timeout={}".format(timeout * 1000))
-
-        if extent:
-            geometries = []
-            if extent.get('type') == 'FeatureCollection':
-                for feature in extent.get("features"):
-                    geometry = feature.get("geometry")
-                    if geometry.get("type") == "GeometryCollection":
-                        for geo in geometry.get("geometries"):
-                            geometries.append(shapely_shape(geo))
-                    else:
-                        geometries.append(shapely_shape(feature.get("geometry")))
-                search_geom = shape.from_shape(GeometryCollection(geometries), srid=27700)
-            elif extent.get('type') == 'Feature':
-                search_geom = shape.from_shape(shapely_shape(extent.get("geometry")), srid=27700)
-            else:
-                search_geom = shape.from_shape(shapely_shape(extent), srid=27700)
-
-            if contact_id:
-                paid_searches = session.query(SearchItem) \
-                    .filter(func.ST_DWithin(SearchItem.search_geom, search_geom, 0)) \
-                    .filter(SearchItem.contact_id == contact_id) \
-                    .filter(SearchItem.date_of_search >= start_datetime) \
-                    .filter(SearchItem.date_of_search <= end_datetime) \
-                    .filter(SearchItem.generation_status.in_(['success', 'not required'])) \
-                    .order_by(SearchItem.date_of_search).all()
-            else:
-                paid_searches = session.query(SearchItem) \
-                    .filter(func.ST_DWithin(SearchItem.search_geom, search_geom, 0)) \
-                    .filter(SearchItem.date_of_search >= start_datetime) \
-                    .filter(SearchItem.date_of_search <= end_datetime) \
-                    .filter(SearchItem.generation_status.in_(['success', 'not required'])) \
-                    .order_by(SearchItem.date_of_search).all()
-        else:
-            # allow no extent, in which case do not filter searches by an extent
-            if contact_id:
-                paid_searches = session.query(SearchItem) \
-                    .filter(SearchItem.contact_id == contact_id) \
-                    .filter(SearchItem.date_of_search >= start_datetime) \
-                    .filter(SearchItem.date_of_search <= end_datetime) \
-                    .filter(SearchItem.generation_status.in_(['success', 'not required'])) \
-                    .order_by(SearchItem.date_of_search).all()
-            else:
-                paid_searches = session.query(SearchItem) \
-                    .filter(SearchItem.date_of_search >= start_datetime) \
-                    .filter(SearchItem.date_of_search <= end_datetime) \
-                    .filter(SearchItem.generation_status.in_(['success', 'not required'])) \
-                    .order_by(SearchItem.date_of_search).all()
-
-        logger.info("Query completed for {} searches".format(len(paid_searches)))
-
-        logger.info("Looking up emails")
-        user_info_cache = {}
-        results_json = [paid_search.to_dict() for paid_search in paid_searches]
-        for result in results_json:
-            if result.get("source") == "SEARCH":
-                result['email'] = get_email(result.get('contact_id'), user_info_cache, logger, requests)
-
-        logger.info("Storing results")
-        storage_result = StorageAPIService.save_files(
-            {'file': (uuid.uuid4().hex + ".json", json.dumps(results_json),
-                      "application/json")}, bucket, logger, requests)
-
-        search_query_obj = session.query(SearchQuery).filter(SearchQuery.id == id).one_or_none()
-        if not search_query_obj:
-            raise ApplicationError("Search query object not found", None, 500)
-
-        search_query_obj.document = "/" + storage_result['file'][0]['reference']
-        search_query_obj.external_url = storage_result['file'][0]['external_reference']
-        search_query_obj.completion_timestamp = datetime.utcnow()
-        search_query_obj.status = "COMPLETED"
-
-        session.commit()
-
-        logger.info("Results stored")
-
-    except Exception:
-        logger.exception("Failed to complete search query")
-        search_query_obj = session.query(SearchQuery).filter(SearchQuery.id == id).one_or_none()
-        if not search_query_obj:
-            raise ApplicationError("Search query object not found", None, 500)
-
-        search_query_obj.completion_timestamp = datetime.utcnow()
-        search_query_obj.status = "FAILED"
-
-        session.commit()
-
-    finally:
-        session.rollback()
-        session.close()
-
-
-def get_email(user_id, user_info_cache, logger, requests):
-    if not user_id:
-        return "N/A"
-    if user_id not in user_info_cache:
-        user_info_cache[user_id] = SearchLocalLandChargeService.get_user_information(user_id, logger, requests)
-    user_info = user_info_cache[user_id]
-    if user_info:
-        return user_info.get("email")
-    return None
+@search.route("/query/<query_id>/resume", methods=["POST"])
+def resume_paid_search_query(query_id):
+    """Resume a failed query from its last checkpoint"""
+
+    current_app.logger.info("Resuming query {}".format(query_id))
+
+    search_query_obj = SearchQuery.query.filter(SearchQuery.id == query_id).with_for_update().one_or_none()
+
+    if not search_query_obj:
+        raise ApplicationError("Extract request not found", None, 404)
+
+    if search_query_obj.status != "FAILED" or not search_query_obj.parameters:
+        raise ApplicationError("Only failed extract requests can be resumed", None, 409)
+
+    # Queue the query again, the worker that claims it carries on from the checkpoint saved on the row. The backends
+    # of the failed attempt are no longer running its slices
+    search_query_obj.status = "STARTED"
+    search_query_obj.backend_pids = None
+    search_query_obj.completion_timestamp = None
+    search_query_obj.heartbeat_timestamp = None
+    search_query_obj.attempts = 0
+    search_query_obj.phase = "queued"
+    search_query_obj.trace_id = g.trace_id
+    search_query_obj.authorization_header = request.headers['Authorization']
+    db.session.commit()
+
+    export_workers.notify()
+
+    return json.dumps(search_query_obj.to_dict(), sort_keys=True), 202, \
+        {"Content-Type": "application/json"}
+
+
+@search.route("/query/<query_id>", methods=["DELETE"])
+def cancel_paid_search_query(query_id):
+    """Cancel a running query
+
+    The statements it is running are cancelled, and the worker running it stops before uploading any more results
+    """
+
+    current_app.logger.info("Cancelling query {}".format(query_id))
+
+    search_query_obj = SearchQuery.query.filter(SearchQuery.id == query_id).with_for_update().one_or_none()
+
+    if not search_query_obj:
+        raise ApplicationError("Extract request not found", None, 404)
+
+    if search_query_obj.status != "STARTED":
+        raise ApplicationError("Only running extract requests can be cancelled", None, 409)
+
+    search_query_obj.status = "CANCELLED"
+    search_query_obj.completion_timestamp = datetime.utcnow()
+    search_query_obj.phase = "cancelled"
+
+    # Cancelled while the row is locked: a slice unregisters its backend before releasing the connection, and can't
+    # while the lock is held. A worker that died mid-slice never unregistered its backends though, so only those still
+    # tagged as running one of the query's slices are cancelled, not later sessions that were given the same PIDs
+    if search_query_obj.backend_pids:
+        activity = table('pg_stat_activity', column('pid'), column('application_name'))
+        db.session.execute(select(func.pg_cancel_backend(activity.c.pid))
+                           .where(activity.c.pid.in_(search_query_obj.backend_pids),
+                                  activity.c.application_name == backend_tag(search_query_obj.id)))
+    db.session.commit()
+
+    return json.dumps(search_query_obj.to_dict(), sort_keys=True), 200, \
+        {"Content-Type": "application/json"}
@@ -0,0 +1,40 @@
+"""Add number of charges to document reference
+
+Revision ID: 0e7c2b9d4f15
+Revises: 6a1f8c4e2d97
+Create Date: 2026-10-18 18:12:27.551208
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0e7c2b9d4f15'
+down_revision = '6a1f8c4e2d97'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+
+# Rows of document_reference backfilled per transaction
+BATCH_SIZE = 5000
+
+
+def upgrade():
+    op.add_column('document_reference', sa.Column('number_of_charges', sa.Integer(), nullable=True))
+
+    # Backfilled a range of ids at a time, each batch committed on its own, so that rows are only locked (and their
+    # charges read) for as long as their batch takes and PDF callbacks updating them aren't blocked for the whole run
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        first_id, last_id = connection.execute(sa.text("SELECT min(id), max(id) FROM document_reference")).one()
+        if first_id is None:
+            return
+        for batch_start in range(first_id, last_id + 1, BATCH_SIZE):
+            connection.execute(sa.text("UPDATE document_reference SET number_of_charges = jsonb_array_length(charges) "
+                                       "WHERE id >= :batch_start AND id < :batch_end "
+                                       "AND number_of_charges IS NULL AND jsonb_typeof(charges) = 'array'"),
+                               {"batch_start": batch_start, "batch_end": batch_start + BATCH_SIZE})
+
+
+def downgrade():
+    op.drop_column('document_reference', 'number_of_charges')
@@ -0,0 +1,27 @@
+"""Add format and compression to search query
+
+Revision ID: 3f6b0e2c9a41
+Revises: 84028ac1536b
+Create Date: 2026-10-18 13:02:47.118203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3f6b0e2c9a41'
+down_revision = '84028ac1536b'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    # Existing documents were all written as uncompressed JSON arrays
+    op.add_column('search_query', sa.Column('format', sa.String(), nullable=False, server_default='json'))
+    op.add_column('search_query', sa.Column('compression', sa.String(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('search_query', 'compression')
+    op.drop_column('search_query', 'format')
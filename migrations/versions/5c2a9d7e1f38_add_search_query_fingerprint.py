@@ -0,0 +1,29 @@
+"""Add fingerprint and window state to search query
+
+Revision ID: 5c2a9d7e1f38
+Revises: b81d4e6f2c05
+Create Date: 2026-10-18 15:07:33.284617
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c2a9d7e1f38'
+down_revision = 'b81d4e6f2c05'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('search_query', sa.Column('fingerprint', sa.String(), nullable=True))
+    op.add_column('search_query', sa.Column('window_state', postgresql.JSONB(), nullable=True))
+    op.create_index('ix_search_query_fingerprint', 'search_query', ['fingerprint', 'status'])
+
+
+def downgrade():
+    op.drop_index('ix_search_query_fingerprint', table_name='search_query')
+    op.drop_column('search_query', 'window_state')
+    op.drop_column('search_query', 'fingerprint')
@@ -0,0 +1,40 @@
+"""Add pdf generation outbox
+
+Revision ID: 6a1f8c4e2d97
+Revises: 9d3e5b7a2c64
+Create Date: 2026-10-18 17:05:41.903126
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a1f8c4e2d97'
+down_revision = '9d3e5b7a2c64'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from flask import current_app
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.create_table('pdf_generation_outbox',
+                    sa.Column('id', sa.BigInteger(), primary_key=True),
+                    sa.Column('search_id', sa.BigInteger(), sa.ForeignKey('document_reference.id'), nullable=False),
+                    sa.Column('payload', postgresql.JSONB(), nullable=False),
+                    sa.Column('callback_url', sa.String(), nullable=False),
+                    sa.Column('trace_id', sa.String(), nullable=True),
+                    sa.Column('authorization_header', sa.String(), nullable=True),
+                    sa.Column('created_timestamp', sa.DateTime(), nullable=False),
+                    sa.Column('next_attempt_timestamp', sa.DateTime(), nullable=False),
+                    sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_pdf_generation_outbox_next_attempt', 'pdf_generation_outbox', ['next_attempt_timestamp'])
+    op.execute("GRANT ALL ON pdf_generation_outbox TO " + current_app.config.get("APP_SQL_USERNAME"))
+    op.execute("GRANT ALL ON SEQUENCE pdf_generation_outbox_id_seq TO {};".format(
+        current_app.config.get('APP_SQL_USERNAME')))
+
+
+def downgrade():
+    op.drop_index('ix_pdf_generation_outbox_next_attempt', table_name='pdf_generation_outbox')
+    op.drop_table('pdf_generation_outbox')
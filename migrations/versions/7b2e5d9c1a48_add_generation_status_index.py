@@ -0,0 +1,28 @@
+"""Add index for sweeping expired PDF generations
+
+Revision ID: 7b2e5d9c1a48
+Revises: 0e7c2b9d4f15
+Create Date: 2026-10-18 19:04:51.326817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7b2e5d9c1a48'
+down_revision = '0e7c2b9d4f15'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, but avoids locking document_reference against writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_document_reference_generation_status_date_of_search', 'document_reference',
+                        ['generation_status', 'date_of_search'], postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_document_reference_generation_status_date_of_search', table_name='document_reference',
+                      postgresql_concurrently=True)
@@ -0,0 +1,40 @@
+"""Add job queue columns to search query
+
+Revision ID: 84028ac1536b
+Revises: da7a597d0572
+Create Date: 2026-10-18 11:40:05.392811
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '84028ac1536b'
+down_revision = 'da7a597d0572'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('search_query', sa.Column('parameters', postgresql.JSONB(), nullable=True))
+    op.add_column('search_query', sa.Column('trace_id', sa.String(), nullable=True))
+    op.add_column('search_query', sa.Column('authorization_header', sa.String(), nullable=True))
+    op.add_column('search_query', sa.Column('heartbeat_timestamp', sa.DateTime(), nullable=True))
+    op.add_column('search_query', sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.create_index('ix_search_query_started', 'search_query', ['request_timestamp'],
+                    postgresql_where=sa.text("status = 'STARTED'"))
+    # Queries started before the queue existed were run in threads that no longer exist and have no parameters
+    # recorded to rerun them with
+    op.execute("UPDATE search_query SET status = 'FAILED', completion_timestamp = now() AT TIME ZONE 'UTC' "
+               "WHERE status = 'STARTED'")
+
+
+def downgrade():
+    op.drop_index('ix_search_query_started', table_name='search_query')
+    op.drop_column('search_query', 'attempts')
+    op.drop_column('search_query', 'heartbeat_timestamp')
+    op.drop_column('search_query', 'authorization_header')
+    op.drop_column('search_query', 'trace_id')
+    op.drop_column('search_query', 'parameters')
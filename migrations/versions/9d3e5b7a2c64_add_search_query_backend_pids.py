@@ -0,0 +1,25 @@
+"""Add backend pids to search query
+
+Revision ID: 9d3e5b7a2c64
+Revises: e4f7a1c3b926
+Create Date: 2026-10-18 16:40:03.218754
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9d3e5b7a2c64'
+down_revision = 'e4f7a1c3b926'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('search_query', sa.Column('backend_pids', postgresql.ARRAY(sa.Integer()), nullable=True))
+
+
+def downgrade():
+    op.drop_column('search_query', 'backend_pids')
@@ -0,0 +1,25 @@
+"""Add checkpoint to search query
+
+Revision ID: b81d4e6f2c05
+Revises: 3f6b0e2c9a41
+Create Date: 2026-10-18 14:21:09.551734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b81d4e6f2c05'
+down_revision = '3f6b0e2c9a41'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('search_query', sa.Column('checkpoint', postgresql.JSONB(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('search_query', 'checkpoint')
@@ -0,0 +1,34 @@
+"""Add indexes for paid search query filters
+
+Revision ID: da7a597d0572
+Revises: a6d9cf93c38a
+Create Date: 2026-10-18 09:12:41.118204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'da7a597d0572'
+down_revision = 'a6d9cf93c38a'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction, but avoids locking document_reference against writes
+    with op.get_context().autocommit_block():
+        op.create_index('ix_document_reference_completed_date_of_search', 'document_reference', ['date_of_search'],
+                        postgresql_where=sa.text("generation_status IN ('success', 'not required')"),
+                        postgresql_concurrently=True)
+        op.create_index('ix_document_reference_contact_id_date_of_search', 'document_reference',
+                        ['contact_id', 'date_of_search'], postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_document_reference_contact_id_date_of_search', table_name='document_reference',
+                      postgresql_concurrently=True)
+        op.drop_index('ix_document_reference_completed_date_of_search', table_name='document_reference',
+                      postgresql_concurrently=True)
@@ -0,0 +1,33 @@
+"""Add progress to search query
+
+Revision ID: e4f7a1c3b926
+Revises: 5c2a9d7e1f38
+Create Date: 2026-10-18 15:52:18.640275
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e4f7a1c3b926'
+down_revision = '5c2a9d7e1f38'
+branch_labels = None
+depends_on = None
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+def upgrade():
+    op.add_column('search_query', sa.Column('phase', sa.String(), nullable=True))
+    op.add_column('search_query', sa.Column('rows_scanned', sa.BigInteger(), nullable=True))
+    op.add_column('search_query', sa.Column('rows_written', sa.BigInteger(), nullable=True))
+    op.add_column('search_query', sa.Column('bytes_uploaded', sa.BigInteger(), nullable=True))
+    op.add_column('search_query', sa.Column('phase_timings', postgresql.JSONB(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('search_query', 'phase_timings')
+    op.drop_column('search_query', 'bytes_uploaded')
+    op.drop_column('search_query', 'rows_written')
+    op.drop_column('search_query', 'rows_scanned')
+    op.drop_column('search_query', 'phase')
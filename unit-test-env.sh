@@ -24,3 +24,6 @@ export FLASK_APP='llc1_document_api.main'
 export SEARCH_LOCAL_LAND_CHARGE_API_URL="http://search-local-land-charge-api:8080"
 export SEARCH_QUERY_BUCKET="paid-search-query"
 export SEARCH_QUERY_TIMEOUT="900"
+export SEARCH_QUERY_WORKERS="0"
+export PDF_DISPATCH_CONCURRENCY="0"
+export GENERATION_SWEEP_INTERVAL="0"
@@ -1,13 +1,14 @@
+import threading
 from datetime import datetime
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
 from flask import g
 from llc1_document_api import main
-from llc1_document_api.dependencies.pdf_generation_service import \
-    PdfGenerationService
+from llc1_document_api.dependencies.pdf_generation_service import (
+    LanguagesCache, PdfGenerationService, external_url_cache, languages_cache)
 from llc1_document_api.exceptions import ApplicationError
-from llc1_document_api.models import SearchItem
+from llc1_document_api.models import PdfGenerationRequest, SearchItem
 
 mock_lon = {
     "display-id": "LLC-0",
@@ -25,57 +26,92 @@ mock_lon = {
 }
 
 
+def lon_with_document(display_id, subdirectory):
+    return {"display-id": display_id,
+            "item": {"charge-type": "Light obstruction notice",
+                     "documents-filed": {"form-a": [{"bucket": "lon", "subdirectory": subdirectory}]}}}
+
+
+PDF_REQUEST = {"id": 1, "search_id": 12, "payload": {"reference_number": 12}, "callback_url": "http://callback/12",
+               "trace_id": "test_id", "authorization_header": "Fake JWT", "attempt": 1}
+
+
 class TestPdfGenerationService(TestCase):
 
+    def setUp(self):
+        external_url_cache.clear()
+        languages_cache.clear()
+
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
-    @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API')
-    def test_generate_pdf_successful_response(self, mock_config, mock_db):
+    def test_generate_pdf_queues_request(self, mock_db):
         with main.app.test_request_context():
             g.trace_id = "test_id"
             g.requests = MagicMock()
-            mock_config.return_value = "abc"
-            g.requests.post.return_value.status_code = 202
-            g.requests.post.return_value.json.return_value = {"status": "generating"}
+            g.requests.headers = {'Authorization': 'Fake JWT'}
 
             mock_reference_item = SearchItem(MagicMock(), "", "")
             mock_reference_item.id = 12
-            PdfGenerationService.generate_pdf({"things": "ABC"}, mock_reference_item)
-            mock_db.session.add.assert_called_with(mock_reference_item)
-            mock_db.session.commit.assert_called()
+            extents = {"things": "ABC"}
+            PdfGenerationService.generate_pdf(extents, mock_reference_item)
+
+            mock_db.session.add.assert_any_call(mock_reference_item)
+            pdf_request = mock_db.session.add.call_args.args[0]
+            self.assertIsInstance(pdf_request, PdfGenerationRequest)
+            self.assertEqual(pdf_request.search_id, 12)
+            self.assertEqual(pdf_request.payload, {"things": "ABC", "reference_number": 12})
+            self.assertTrue(pdf_request.callback_url.endswith("/v1.0/pdf_callback/12"))
+            self.assertEqual(pdf_request.trace_id, "test_id")
+            self.assertEqual(pdf_request.authorization_header, "Fake JWT")
+            mock_db.session.commit.assert_called_once()
             self.assertEqual(mock_reference_item.generation_status, "generating")
+            g.requests.post.assert_not_called()
 
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
-    @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API')
-    def test_generate_pdf_non_202(self, mock_config, mock_db):
+    def test_generate_pdfs(self, mock_db):
         with main.app.test_request_context():
             g.trace_id = "test_id"
             g.requests = MagicMock()
-            mock_config.return_value = "abc"
-            g.requests.post.return_value.status_code = 500
+            g.requests.headers = {'Authorization': 'Fake JWT'}
+            mock_db.session.execute.return_value.scalars.return_value.all.return_value = [12, 13]
 
-            mock_reference_item = SearchItem(MagicMock(), "", "")
-            mock_reference_item.id = 12
-            PdfGenerationService.generate_pdf({"things": "ABC"}, mock_reference_item)
-            mock_db.session.add.assert_called_with(mock_reference_item)
-            mock_db.session.commit.assert_called()
-            self.assertEqual(mock_reference_item.generation_status, "failed")
+            pdf_item = SearchItem(datetime.now(), "source")
+            json_item = SearchItem(datetime.now(), "source", generation_status='not required', charges=[])
+            pdf_extents = {"things": "ABC"}
+            queued = PdfGenerationService.generate_pdfs([(pdf_extents, pdf_item), ({}, json_item)])
+
+            self.assertEqual(queued, 1)
+            self.assertEqual((pdf_item.id, json_item.id), (12, 13))
+            self.assertEqual(pdf_item.generation_status, "generating")
+            self.assertEqual(json_item.generation_status, "not required")
+            search_insert, outbox_insert = [args.args[0] for args in mock_db.session.execute.call_args_list]
+            self.assertIn("RETURNING document_reference.id", str(search_insert))
+            self.assertIn("pdf_generation_outbox", str(outbox_insert))
+            self.assertEqual(pdf_extents['reference_number'], 12)
+            mock_db.session.commit.assert_called_once()
+            g.requests.post.assert_not_called()
 
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
-    @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API')
-    def test_generate_pdf_exception(self, mock_config, mock_db):
-        with main.app.test_request_context():
-            g.trace_id = "test_id"
-            g.requests = MagicMock()
-            mock_config.return_value = "abc"
-            g.requests.post.side_effect = ApplicationError("blah", "blah1", 500)
+    def test_generate_pdfs_empty(self, mock_db):
+        self.assertEqual(PdfGenerationService.generate_pdfs([]), 0)
+        mock_db.session.execute.assert_not_called()
 
-            mock_reference_item = SearchItem(MagicMock(), "", "")
-            mock_reference_item.id = 12
+    @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API', "http://pdf")
+    def test_dispatch_pdf(self):
+        mock_requests = MagicMock()
+        mock_requests.post.return_value.status_code = 202
+        PdfGenerationService.dispatch_pdf(PDF_REQUEST, mock_requests, MagicMock())
+        mock_requests.post.assert_called_with("http://pdf", data='{"reference_number": 12}',
+                                              headers={'Content-Type': 'application/json',
+                                                       'ReplyTo': "http://callback/12",
+                                                       'X-Trace-ID': "test_id",
+                                                       'Authorization': "Fake JWT"})
 
-            PdfGenerationService.generate_pdf({"things": "ABC"}, mock_reference_item)
-            mock_db.session.add.assert_called_with(mock_reference_item)
-            mock_db.session.commit.assert_called()
-            self.assertEqual(mock_reference_item.generation_status, "failed")
+    def test_dispatch_pdf_non_202(self):
+        mock_requests = MagicMock()
+        mock_requests.post.return_value.status_code = 500
+        with self.assertRaises(ApplicationError) as context:
+            PdfGenerationService.dispatch_pdf(PDF_REQUEST, mock_requests, MagicMock())
+        self.assertEqual(context.exception.http_code, 500)
 
     @patch('llc1_document_api.dependencies.pdf_generation_service.StorageAPIService')
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
@@ -103,6 +139,34 @@ class TestPdfGenerationService(TestCase):
             }
             self.assertEqual(result, expected_result)
 
+    @patch('llc1_document_api.dependencies.pdf_generation_service.StorageAPIService')
+    def test_check_for_results_lons_concurrent_and_cached(self, mock_storage_api):
+        with main.app.test_request_context():
+            g.trace_id = "test_id"
+            g.requests = mock_requests = MagicMock()
+            started = threading.Barrier(3, timeout=5)
+
+            def get_external_url(subdirectory, bucket, logger=None, requests=None):
+                # Only returns once all three are in flight at the same time
+                started.wait()
+                self.assertIs(requests, mock_requests)
+                return 'external-{}'.format(subdirectory)
+
+            mock_storage_api.get_external_url.side_effect = get_external_url
+            lons = [lon_with_document("LLC-{}".format(index), str(index % 3)) for index in range(6)]
+            mock_reference_item = SearchItem(datetime.now(), "Blah", document="abc123",
+                                             generation_status="success", external_url="external123",
+                                             charges=lons)
+            mock_reference_item.id = 12
+
+            for _ in range(2):
+                result = PdfGenerationService.check_for_result(mock_reference_item, 60, return_supporting_docs=True)
+                self.assertEqual(result['supporting_documents'],
+                                 {"LLC-{}".format(index): "external-{}".format(index % 3) for index in range(6)})
+
+            # Each (bucket, subdirectory) is resolved once, and the repeat poll is served from the cache
+            self.assertEqual(mock_storage_api.get_external_url.call_count, 3)
+
     @patch('llc1_document_api.dependencies.pdf_generation_service.StorageAPIService')
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
     def test_check_for_results_failed(self, mock_db, mock_storage_api):
@@ -153,6 +217,10 @@ class TestPdfGenerationService(TestCase):
             self.assertEqual(mock_reference_item.document, "doc_url")
             self.assertEqual(mock_reference_item.external_url, "ext_url")
             self.assertEqual(mock_reference_item.generation_status, "success")
+            self.assertIn("pg_notify", str(mock_db.session.execute.call_args.args[0]))
+            mock_db.session.commit.assert_called()
+            # The outbox row of the delivered request, and its token, are removed
+            mock_db.session.query.return_value.filter.return_value.delete.assert_called_once()
 
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
     def test_callback_fail(self, mock_db):
@@ -168,6 +236,7 @@ class TestPdfGenerationService(TestCase):
                 PdfGenerationService.callback(mock_reference_item, {"status": "failed"})
 
             self.assertEqual(mock_reference_item.generation_status, "failed")
+            mock_db.session.query.return_value.filter.return_value.delete.assert_called_once()
 
     @patch('llc1_document_api.dependencies.pdf_generation_service.db')
     @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API')
@@ -190,6 +259,62 @@ class TestPdfGenerationService(TestCase):
             mock_config.return_value = "abc"
             g.requests.get.return_value.status_code = 200
             g.requests.get.return_value.text = "languages"
+            g.requests.get.return_value.content = b"languages"
 
             result = PdfGenerationService.get_languages()
-            self.assertEqual("languages", result)
+            self.assertEqual("languages", result.text)
+            self.assertEqual(64, len(result.etag))
+
+            # Served from the cache after the first call
+            self.assertEqual(result, PdfGenerationService.get_languages())
+            g.requests.get.assert_called_once()
+
+    @patch('llc1_document_api.dependencies.pdf_generation_service.PDF_GENERATION_API', 'http://pdf')
+    def test_languages_cache_revalidates_stale_list_in_background(self):
+        cache = LanguagesCache(60, 600)
+        requests = MagicMock()
+        requests.get.return_value.status_code = 200
+        requests.get.return_value.text = "languages"
+        requests.get.return_value.content = b"languages"
+        requests.get.return_value.headers = {'ETag': '"v1"', 'Last-Modified': 'Tue, 01 Aug 2023 00:00:00 GMT'}
+        cached = cache.get(MagicMock(), requests)
+
+        cache.cache.set('languages', cached._replace(fetched=cached.fetched - 61))
+        background = MagicMock()
+        background.get.return_value.status_code = 304
+        with patch('llc1_document_api.dependencies.pdf_generation_service.background_client',
+                   return_value=background) as mock_client, \
+                patch('llc1_document_api.dependencies.pdf_generation_service.threading.Thread') as mock_thread:
+            stale = cache.get(MagicMock(), requests)
+            # Only one refresh at a time
+            cache.get(MagicMock(), requests)
+            mock_thread.assert_called_once()
+            thread_kwargs = mock_thread.call_args[1]
+            thread_kwargs['target'](*thread_kwargs['args'])
+            mock_client.assert_called_with(requests.headers)
+
+        self.assertEqual(stale, cached._replace(fetched=cached.fetched - 61))
+        background.get.assert_called_with("http://pdf/languages",
+                                          headers={'If-None-Match': '"v1"',
+                                                   'If-Modified-Since': 'Tue, 01 Aug 2023 00:00:00 GMT'})
+        background.close.assert_called_once()
+        self.assertFalse(cache.refreshing)
+
+        refreshed = cache.get(MagicMock(), requests)
+        self.assertEqual("languages", refreshed.text)
+        self.assertEqual(cached.etag, refreshed.etag)
+        self.assertGreater(refreshed.fetched, cached.fetched - 61)
+        requests.get.assert_called_once()
+
+    def test_languages_cache_keeps_stale_list_when_refresh_fails(self):
+        cache = LanguagesCache(60, 600)
+        requests = MagicMock()
+        requests.get.return_value.status_code = 500
+        stale = MagicMock()
+        logger = MagicMock()
+
+        cache.revalidate(stale, logger, requests)
+
+        logger.exception.assert_called_once()
+        requests.close.assert_called_once()
+        self.assertFalse(cache.refreshing)
@@ -1,13 +1,68 @@
+import hashlib
+import json
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import TestCase
 from unittest.mock import MagicMock
 
+import requests
 from flask import current_app, g
 from llc1_document_api import main
+from llc1_document_api.dependencies import storage_api_service
 from llc1_document_api.dependencies.storage_api_service import \
     StorageAPIService
 from llc1_document_api.exceptions import ApplicationError
 
 
+class StandInStorageHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for storage-api that hashes an uploaded file part as it is received."""
+
+    def do_POST(self):  # noqa: N802
+        boundary = self.headers['Content-Type'].split('boundary=')[1]
+        trailer = '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+        digest = hashlib.sha256()
+        head = b''
+        tail = b''
+        in_file = False
+        for chunk in self.read_chunks():
+            if not in_file:
+                head += chunk
+                if b'\r\n\r\n' not in head:
+                    continue
+                head, chunk = head.split(b'\r\n\r\n', 1)
+                in_file = True
+            tail += chunk
+            if len(tail) > len(trailer):
+                digest.update(tail[:-len(trailer)])
+                tail = tail[-len(trailer):]
+
+        self.server.uploads.append({"path": self.path,
+                                    "transfer_encoding": self.headers['Transfer-Encoding'],
+                                    "part_headers": head.decode('utf-8'),
+                                    "complete": tail == trailer,
+                                    "sha256": digest.hexdigest()})
+
+        body = json.dumps({"file": [{"reference": "bucket/file", "external_reference": "http://external/file"}]})
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def read_chunks(self):
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return
+            yield self.rfile.read(size)
+            self.rfile.readline()
+
+    def log_message(self, format, *args):
+        pass
+
+
 class TestStorageApiService(TestCase):
 
     def test_get_external_url_successful(self):
@@ -60,6 +115,16 @@ class TestStorageApiService(TestCase):
 
             self.assertRaises(ApplicationError, StorageAPIService.get_external_url, 'file', 'bucket')
 
+    def test_get_external_url_given_requests(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value.status_code = 200
+        mock_requests.get.return_value.json.return_value = {'external_reference': 'test-reference'}
+
+        result = StorageAPIService.get_external_url('file', 'bucket', logger=MagicMock(), requests=mock_requests)
+
+        self.assertEqual('test-reference', result)
+        self.assertTrue(mock_requests.get.call_args.args[0].endswith("/bucket/file/external-url"))
+
     def test_save_files_ok(self):
         with main.app.test_request_context():
             g.trace_id = "test_id"
@@ -84,3 +149,91 @@ class TestStorageApiService(TestCase):
                 result = StorageAPIService.save_files('files', 'bucket')
                 self.assertEqual(result, {"some": "json"})
                 g.requests.post.assert_called()
+
+    def test_get_file_stream_ok(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value.status_code = 200
+        mock_requests.get.return_value.iter_content.return_value = iter([b'some', b'content'])
+        chunks = list(StorageAPIService.get_file_stream('bucket/file', MagicMock(), mock_requests))
+        self.assertEqual(chunks, [b'some', b'content'])
+        mock_requests.get.assert_called_with("{}/bucket/file".format(storage_api_service.STORAGE_API), stream=True)
+        mock_requests.get.return_value.close.assert_called()
+
+    def test_get_file_stream_bad(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value.status_code = 404
+        with self.assertRaises(ApplicationError):
+            list(StorageAPIService.get_file_stream('bucket/file', MagicMock(), mock_requests))
+        mock_requests.get.return_value.close.assert_called()
+
+    def test_delete_file_ok(self):
+        for status_code in (204, 404):
+            mock_requests = MagicMock()
+            mock_requests.delete.return_value.status_code = status_code
+            StorageAPIService.delete_file('bucket/file', MagicMock(), mock_requests)
+            mock_requests.delete.assert_called_with("{}/bucket/file".format(storage_api_service.STORAGE_API))
+
+    def test_delete_file_bad(self):
+        mock_requests = MagicMock()
+        mock_requests.delete.return_value.status_code = 500
+        with self.assertRaises(ApplicationError):
+            StorageAPIService.delete_file('bucket/file', MagicMock(), mock_requests)
+
+
+class TestStorageApiServiceStreaming(TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInStorageHandler)
+        self.server.uploads = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.storage_api = storage_api_service.STORAGE_API
+        storage_api_service.STORAGE_API = "http://127.0.0.1:{}/v1.0/storage".format(self.server.server_port)
+
+    def tearDown(self):
+        storage_api_service.STORAGE_API = self.storage_api
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_save_file_stream_generator(self):
+        digest = hashlib.sha256()
+        chunk_count = 512
+
+        def chunks():
+            for index in range(chunk_count):
+                chunk = bytes([index % 256]) * 64 * 1024
+                digest.update(chunk)
+                yield chunk
+
+        with requests.Session() as session:
+            tracemalloc.start()
+            result = StorageAPIService.save_file_stream('export.json', chunks(), 'application/json', 'bucket',
+                                                        MagicMock(), session)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        self.assertEqual(result['file'][0]['reference'], 'bucket/file')
+        upload = self.server.uploads[0]
+        self.assertEqual(upload['path'], '/v1.0/storage/bucket')
+        self.assertEqual(upload['transfer_encoding'], 'chunked')
+        self.assertIn('filename="export.json"', upload['part_headers'])
+        self.assertTrue(upload['complete'])
+        self.assertEqual(upload['sha256'], digest.hexdigest())
+        # 32MB uploaded, but only a few chunks should ever be held in memory
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_save_file_stream_file(self):
+        with open(__file__, 'rb') as source:
+            expected = hashlib.sha256(source.read()).hexdigest()
+            source.seek(0)
+            with requests.Session() as session:
+                StorageAPIService.save_file_stream('source.py', source, 'text/plain', 'bucket', MagicMock(), session)
+
+        self.assertEqual(self.server.uploads[0]['sha256'], expected)
+        self.assertIn('Content-Type: text/plain', self.server.uploads[0]['part_headers'])
+
+    def test_save_file_stream_bad(self):
+        mock_requests = MagicMock()
+        mock_requests.post.return_value.status_code = 500
+        with self.assertRaises(ApplicationError):
+            StorageAPIService.save_file_stream('export.json', [b'{}'], 'application/json', 'bucket',
+                                               MagicMock(), mock_requests)
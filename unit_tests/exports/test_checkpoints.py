@@ -0,0 +1,42 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api.exports.checkpoints import Checkpoint
+from llc1_document_api.exports.writers import writer_for
+
+
+class TestCheckpoints(TestCase):
+
+    def test_checkpoint_new(self):
+        checkpoint = Checkpoint(1)
+        self.assertIsNone(checkpoint.after)
+        self.assertEqual(checkpoint.to_dict(), {"date_of_search": None, "id": None, "rows": 0, "parts": []})
+
+    def test_checkpoint_after(self):
+        checkpoint = Checkpoint(1, {"date_of_search": "2019-01-02T03:04:05", "id": 7, "rows": 10, "parts": ["a"]})
+        self.assertEqual(checkpoint.after, (datetime(2019, 1, 2, 3, 4, 5), 7))
+        self.assertEqual(checkpoint.rows, 10)
+        self.assertEqual(checkpoint.parts, ["a"])
+
+    @patch('llc1_document_api.exports.checkpoints.StorageAPIService')
+    def test_save_part(self, mock_storage):
+        mock_storage.save_file_stream.return_value = {"file": [{"reference": "abucket/part"}]}
+        mock_session = MagicMock()
+        checkpoint = Checkpoint(1, {"date_of_search": "2019-01-01T00:00:00", "id": 3, "rows": 3, "parts": ["first"]})
+        writer = writer_for('ndjson', None, 1024, part=True, continuation=True)
+        writer.write({"id": 4})
+        writer.write({"id": 5})
+
+        checkpoint.save_part(writer, {"id": 5, "date_of_search": "2019-01-02T00:00:00"}, mock_session, "abucket",
+                             MagicMock(), MagicMock())
+
+        args = mock_storage.save_file_stream.call_args.args
+        self.assertTrue(args[0].endswith(".part1.ndjson"))
+        self.assertEqual(args[1].read(), b'{"id": 4}\n{"id": 5}\n')
+        self.assertEqual(args[3], "abucket")
+        expected = {"date_of_search": "2019-01-02T00:00:00", "id": 5, "rows": 5, "parts": ["first", "abucket/part"]}
+        self.assertEqual(checkpoint.to_dict(), expected)
+        update = mock_session.query.return_value.filter.return_value.update
+        self.assertEqual(list(update.call_args.args[0].values()), [expected])
+        mock_session.commit.assert_called()
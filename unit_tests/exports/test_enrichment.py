@@ -0,0 +1,74 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api.exports.enrichment import EmailEnricher, get_email
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+
+
+class TestEnrichment(TestCase):
+
+    def test_get_email_none(self):
+        self.assertEqual(get_email(None, {}), "N/A")
+
+    def test_get_email_found(self):
+        self.assertEqual(get_email("custard", {"custard": {"email": "an@email.com"}}), "an@email.com")
+
+    def test_get_email_not_found(self):
+        self.assertIsNone(get_email("custard", {"custard": None}))
+
+    @patch('llc1_document_api.exports.enrichment.SearchLocalLandChargeService')
+    def test_enrich(self, mock_sllc):
+        mock_sllc.get_user_information.side_effect = lambda user_id, logger, requests: {"email": user_id + "@a.com"}
+        enricher = EmailEnricher(MagicMock(), MagicMock(), 4, TTLCache(10, 60))
+        results = [{"source": "SEARCH", "contact_id": "one"},
+                   {"source": "SEARCH", "contact_id": "two"},
+                   {"source": "SEARCH", "contact_id": "one"},
+                   {"source": "SEARCH", "contact_id": None},
+                   {"source": "MAINTAIN", "contact_id": "three"}]
+        enricher.enrich(results)
+        enricher.close()
+        self.assertEqual([result.get('email') for result in results], ["one@a.com", "two@a.com", "one@a.com", "N/A",
+                                                                       None])
+        self.assertEqual(mock_sllc.get_user_information.call_count, 2)
+
+    @patch('llc1_document_api.exports.enrichment.SearchLocalLandChargeService')
+    def test_enrich_uses_shared_cache(self, mock_sllc):
+        mock_sllc.get_user_information.return_value = {"email": "an@email.com"}
+        cache = TTLCache(10, 60)
+        for _ in range(2):
+            enricher = EmailEnricher(MagicMock(), MagicMock(), 4, cache)
+            results = [{"source": "SEARCH", "contact_id": "custard"}]
+            enricher.enrich(results)
+            enricher.close()
+            self.assertEqual(results[0]['email'], "an@email.com")
+        mock_sllc.get_user_information.assert_called_once()
+
+    @patch('llc1_document_api.exports.enrichment.USER_INFO_NOT_FOUND_CACHE_TTL', 5)
+    @patch('llc1_document_api.exports.enrichment.SearchLocalLandChargeService')
+    def test_enrich_caches_not_found(self, mock_sllc):
+        mock_sllc.get_user_information.return_value = None
+        cache = MagicMock()
+        cache.get.return_value = MISSING
+        enricher = EmailEnricher(MagicMock(), MagicMock(), 4, cache)
+        results = [{"source": "SEARCH", "contact_id": "custard"}]
+        enricher.enrich(results)
+        enricher.close()
+        self.assertIsNone(results[0]['email'])
+        cache.set.assert_called_with("custard", None, 5)
+
+    @patch('llc1_document_api.exports.enrichment.SearchLocalLandChargeService')
+    def test_enrich_concurrently(self, mock_sllc):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def get_user_information(user_id, logger, requests):
+            # Only returns once three lookups are in flight at the same time
+            barrier.wait()
+            return {"email": user_id}
+
+        mock_sllc.get_user_information.side_effect = get_user_information
+        enricher = EmailEnricher(MagicMock(), MagicMock(), 3, TTLCache(10, 60))
+        results = [{"source": "SEARCH", "contact_id": contact_id} for contact_id in ("a", "b", "c")]
+        enricher.enrich(results)
+        enricher.close()
+        self.assertEqual(sorted(result['email'] for result in results), ["a", "b", "c"])
@@ -0,0 +1,249 @@
+import gzip
+import json
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from flask_testing import TestCase
+from llc1_document_api import main
+from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.exports.pipeline import document_chunks, search_query
+from llc1_document_api.exports.progress import ExportCancelledError
+from llc1_document_api.exports.writers import writer_for
+from unit_tests.test_models import POLYGON_FC
+
+STORAGE_RESULT = {"file": [{"reference": "filereference", "external_reference": "externalfilereference"}]}
+
+
+class TestPipeline(TestCase):
+
+    def create_app(self):
+        return main.app
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_ok(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_logger = MagicMock()
+        mock_sliced_query.return_value.results.return_value = [{"source": "SEARCH", "contact_id": "anid"}]
+        mock_storage.save_file_stream.return_value = STORAGE_RESULT
+        mock_search_query = MagicMock()
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        start = datetime(2019, 1, 1)
+        end = datetime(2019, 2, 1)
+
+        search_query(123, start, end, POLYGON_FC, "anid", mock_session, 1, "abucket", mock_logger, MagicMock())
+
+        args = mock_sliced_query.call_args.args
+        self.assertEqual(args[:5], (mock_session.session_factory, POLYGON_FC, "anid", 1, args[4]))
+        mock_sliced_query.return_value.results.assert_called_with(start, end, None)
+        mock_session.commit.assert_called()
+        mock_storage.save_file_stream.assert_called()
+        self.assertEqual(mock_storage.save_file_stream.call_args.args[3], "abucket")
+        self.assertEqual(mock_search_query.status, "COMPLETED")
+        self.assertEqual(mock_search_query.document, "/filereference")
+        self.assertEqual(mock_search_query.external_url, "externalfilereference")
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_streams_results(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.return_value = iter([{"id": index} for index in range(3)])
+        uploaded = {}
+
+        def save_file_stream(file_name, stream, content_type, bucket, logger, requests):
+            uploaded['file_name'] = file_name
+            uploaded['content'] = b''.join(stream)
+            uploaded['content_type'] = content_type
+            return STORAGE_RESULT
+
+        mock_storage.save_file_stream.side_effect = save_file_stream
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket",
+                     MagicMock(), MagicMock())
+        self.assertTrue(uploaded['file_name'].endswith(".json"))
+        self.assertEqual(uploaded['content_type'], "application/json")
+        self.assertEqual(json.loads(uploaded['content']), [{"id": 0}, {"id": 1}, {"id": 2}])
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_not_found(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.return_value = [{"source": "SEARCH", "contact_id": "anid"}]
+        mock_storage.save_file_stream.return_value = STORAGE_RESULT
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = None
+        with self.assertRaises(ApplicationError):
+            search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket",
+                         MagicMock(), MagicMock())
+        mock_session.commit.assert_not_called()
+        mock_storage.save_file_stream.assert_called()
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_exception(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.side_effect = Exception("Badness")
+        mock_search_query = MagicMock()
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        search_query(123, datetime.now(), datetime.now(), POLYGON_FC['features'][0], "anid", mock_session, 1,
+                     "abucket", MagicMock(), MagicMock())
+        mock_session.rollback.assert_called()
+        mock_session.commit.assert_called()
+        mock_storage.save_file_stream.assert_not_called()
+        self.assertEqual(mock_search_query.status, "FAILED")
+        self.assertEqual(mock_search_query.phase, "failed")
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_cancelled(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.side_effect = ExportCancelledError()
+        mock_search_query = MagicMock(status="CANCELLED")
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket", MagicMock(),
+                     MagicMock())
+        self.assertEqual(mock_sliced_query.call_args.kwargs['search_query_id'], 123)
+        mock_storage.save_file_stream.assert_not_called()
+        self.assertEqual(mock_search_query.status, "CANCELLED")
+        self.assertEqual(mock_search_query.phase, "cancelled")
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_cancelled_while_uploading(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.return_value = [{"id": 1}]
+        mock_storage.save_file_stream.return_value = STORAGE_RESULT
+        mock_search_query = MagicMock(status="CANCELLED", document=None)
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket", MagicMock(),
+                     MagicMock())
+        self.assertEqual(mock_search_query.status, "CANCELLED")
+        self.assertIsNone(mock_search_query.document)
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_format(self, mock_storage, mock_sliced_query):
+        mock_sliced_query.return_value.results.return_value = [{"id": 1, "charges": []}]
+        mock_storage.save_file_stream.return_value = STORAGE_RESULT
+        search_query(123, datetime.now(), datetime.now(), None, None, MagicMock(), 1, "abucket", MagicMock(),
+                     MagicMock(), export_format="csv", compression="gzip")
+        args = mock_storage.save_file_stream.call_args.args
+        self.assertTrue(args[0].endswith(".csv.gz"))
+        self.assertEqual(args[2], "application/gzip")
+
+    @patch('llc1_document_api.exports.pipeline.SEARCH_QUERY_PART_ROWS', 2)
+    @patch('llc1_document_api.exports.checkpoints.StorageAPIService')
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_checkpoints_parts(self, mock_storage, mock_sliced_query, mock_part_storage):
+        mock_session = MagicMock()
+        results = [{"id": index, "date_of_search": "2019-01-0{}T00:00:00".format(index)} for index in range(1, 6)]
+        mock_sliced_query.return_value.results.return_value = results
+        parts = []
+
+        def save_part(file_name, stream, content_type, bucket, logger, requests):
+            parts.append(b''.join(stream))
+            return {"file": [{"reference": "abucket/part{}".format(len(parts))}]}
+
+        mock_part_storage.save_file_stream.side_effect = save_part
+        mock_storage.get_file_stream.side_effect = lambda reference, logger, requests: \
+            iter([parts[int(reference[-1]) - 1]])
+        uploaded = {}
+
+        def save_file_stream(file_name, stream, content_type, bucket, logger, requests):
+            uploaded['content'] = b''.join(stream)
+            return STORAGE_RESULT
+
+        mock_storage.save_file_stream.side_effect = save_file_stream
+        mock_search_query = MagicMock()
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket", MagicMock(),
+                     MagicMock())
+
+        self.assertEqual(len(parts), 2)
+        checkpoint = mock_session.query.return_value.filter.return_value.update.call_args.args[0]
+        self.assertEqual(list(checkpoint.values())[0], {"date_of_search": "2019-01-04T00:00:00", "id": 4, "rows": 4,
+                                                        "parts": ["abucket/part1", "abucket/part2"]})
+        self.assertEqual(json.loads(uploaded['content']), results)
+        self.assertEqual(mock_search_query.status, "COMPLETED")
+        self.assertIsNone(mock_search_query.checkpoint)
+        self.assertEqual(mock_search_query.phase, "completed")
+        self.assertEqual(mock_search_query.rows_written, 5)
+        self.assertEqual(mock_search_query.bytes_uploaded, sum(len(part) for part in parts) + len(uploaded['content']))
+        self.assertEqual([args.args[0] for args in mock_storage.delete_file.call_args_list],
+                         ["abucket/part1", "abucket/part2"])
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_cancelled_deletes_parts(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.side_effect = ExportCancelledError()
+        mock_search_query = MagicMock(status="CANCELLED")
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        mock_storage.delete_file.side_effect = [Exception("Badness"), None]
+        mock_logger = MagicMock()
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket", mock_logger,
+                     MagicMock(), checkpoint={"date_of_search": "2019-01-02T00:00:00", "id": 2, "rows": 2,
+                                              "parts": ["abucket/part1", "abucket/part2"]})
+        self.assertIsNone(mock_search_query.checkpoint)
+        self.assertEqual([args.args[0] for args in mock_storage.delete_file.call_args_list],
+                         ["abucket/part1", "abucket/part2"])
+        mock_logger.warning.assert_called()
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_failure_keeps_parts(self, mock_storage, mock_sliced_query):
+        mock_session = MagicMock()
+        mock_sliced_query.return_value.results.side_effect = Exception("Badness")
+        mock_search_query = MagicMock(status="STARTED", checkpoint={"parts": ["abucket/part1"]})
+        mock_locked = mock_session.query.return_value.filter.return_value.with_for_update.return_value
+        mock_locked.one_or_none.return_value = mock_search_query
+        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket", MagicMock(),
+                     MagicMock(), checkpoint={"date_of_search": "2019-01-02T00:00:00", "id": 2, "rows": 2,
+                                              "parts": ["abucket/part1"]})
+        self.assertEqual(mock_search_query.status, "FAILED")
+        self.assertEqual(mock_search_query.checkpoint, {"parts": ["abucket/part1"]})
+        mock_storage.delete_file.assert_not_called()
+
+    @patch('llc1_document_api.exports.pipeline.SlicedQuery')
+    @patch('llc1_document_api.exports.pipeline.StorageAPIService')
+    def test_search_query_resumes_from_checkpoint(self, mock_storage, mock_sliced_query):
+        mock_sliced_query.return_value.results.return_value = [{"id": 3}]
+        mock_storage.get_file_stream.return_value = iter([b'{"id": 1},{"id": 2}'])
+        uploaded = {}
+
+        def save_file_stream(file_name, stream, content_type, bucket, logger, requests):
+            uploaded['content'] = b''.join(stream)
+            return STORAGE_RESULT
+
+        mock_storage.save_file_stream.side_effect = save_file_stream
+        start = datetime(2019, 1, 1)
+        end = datetime(2019, 2, 1)
+        search_query(123, start, end, None, None, MagicMock(), 1, "abucket", MagicMock(), MagicMock(),
+                     checkpoint={"date_of_search": "2019-01-02T00:00:00", "id": 2, "rows": 2,
+                                 "parts": ["abucket/part1"]})
+
+        mock_sliced_query.return_value.results.assert_called_with(start, end, (datetime(2019, 1, 2), 2))
+        self.assertEqual(mock_storage.get_file_stream.call_args.args[0], "abucket/part1")
+        self.assertEqual(json.loads(uploaded['content']), [{"id": 1}, {"id": 2}, {"id": 3}])
+
+    def test_document_chunks_gzip_csv(self):
+        first = writer_for('csv', 'gzip', 1024, part=True)
+        first.write({"id": 1})
+        writer = writer_for('csv', 'gzip', 1024, part=True, continuation=True)
+        writer.write({"id": 2})
+        mock_storage = MagicMock()
+        mock_storage.get_file_stream.return_value = iter([first.finish().read()])
+        with patch('llc1_document_api.exports.pipeline.StorageAPIService', mock_storage):
+            content = gzip.decompress(b''.join(document_chunks(writer, ["abucket/part1"], MagicMock(), MagicMock())))
+        lines = content.decode('utf-8').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("id,"))
+        self.assertTrue(lines[1].startswith("1,"))
+        self.assertTrue(lines[2].startswith("2,"))
@@ -0,0 +1,83 @@
+import io
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from llc1_document_api.exports.progress import (ExportCancelledError,
+                                                ExportProgress)
+
+
+class TestProgress(TestCase):
+
+    def test_values(self):
+        progress = ExportProgress(rows=10)
+        progress.set_phase("querying")
+        progress.scanned(5)
+        progress.written(2)
+        progress.uploaded(100)
+        self.assertEqual(progress.values(), {"phase": "querying", "rows_scanned": 15, "rows_written": 12,
+                                             "bytes_uploaded": 100,
+                                             "phase_timings": {"query": 0.0, "enrich": 0.0, "write": 0.0,
+                                                               "upload": 0.0}})
+
+    def test_timed(self):
+        progress = ExportProgress()
+        with self.assertRaises(ValueError):
+            with progress.timed('enrich'):
+                raise ValueError("Badness")
+        with progress.timed('enrich'):
+            pass
+        self.assertGreater(progress.timings['enrich'], 0)
+        self.assertEqual(progress.timings['query'], 0)
+
+    def test_discard(self):
+        progress = ExportProgress()
+        progress.scanned(10)
+        timings = dict.fromkeys(progress.timings, 0.0)
+        with progress.timed('query', timings):
+            progress.scanned(4)
+        self.assertGreater(timings['query'], 0)
+        progress.discard(4, timings)
+        self.assertEqual(progress.rows_scanned, 10)
+        self.assertEqual(progress.timings['query'], 0)
+
+    def test_counted(self):
+        progress = ExportProgress()
+        self.assertEqual(b''.join(progress.counted([b'abc', b'de'])), b'abcde')
+        self.assertEqual(b''.join(progress.counted(io.BytesIO(b'fghi'))), b'fghi')
+        self.assertEqual(progress.bytes_uploaded, 9)
+
+    def test_counted_cancelled(self):
+        progress = ExportProgress()
+        chunks = progress.counted([b'abc', b'de'])
+        self.assertEqual(next(chunks), b'abc')
+        progress.cancel()
+        with self.assertRaises(ExportCancelledError):
+            next(chunks)
+        self.assertEqual(progress.bytes_uploaded, 3)
+
+    def test_concurrent_updates(self):
+        progress = ExportProgress()
+
+        def update():
+            for _ in range(1000):
+                progress.scanned(1)
+                with progress.timed('query'):
+                    pass
+
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(progress.rows_scanned, 4000)
+
+    def test_apply(self):
+        progress = ExportProgress()
+        progress.set_phase("completed")
+        progress.written(3)
+        mock_search_query = MagicMock()
+        progress.apply(mock_search_query)
+        self.assertEqual(mock_search_query.phase, "completed")
+        self.assertEqual(mock_search_query.rows_written, 3)
+        self.assertEqual(mock_search_query.phase_timings['upload'], 0.0)
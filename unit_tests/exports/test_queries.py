@@ -0,0 +1,80 @@
+from datetime import datetime
+from unittest import TestCase
+
+from llc1_document_api.exports.queries import (batches, extent_geometries,
+                                               paid_search_query)
+from shapely.geometry import Point, mapping
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from unit_tests.test_models import POLYGON_FC, POLYGON_FC_GC
+
+
+def compile_query(query):
+    return str(query.statement.compile(dialect=postgresql.dialect()))
+
+
+class TestQueries(TestCase):
+
+    def test_paid_search_query(self):
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), None, None))
+        self.assertNotIn("ST_Intersects", sql)
+        self.assertNotIn("document_reference.contact_id =", sql)
+        self.assertIn("document_reference.date_of_search >=", sql)
+        self.assertIn("document_reference.date_of_search <=", sql)
+        self.assertIn("document_reference.generation_status IN", sql)
+        self.assertIn("ORDER BY document_reference.date_of_search, document_reference.id", sql)
+        self.assertNotIn("(document_reference.date_of_search, document_reference.id) >", sql)
+        self.assertIn("ST_AsGeoJSON(document_reference.search_geom)", sql)
+
+    def test_paid_search_query_extent_and_contact(self):
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), POLYGON_FC,
+                                              "anid"))
+        self.assertIn("document_reference.search_geom && ", sql)
+        self.assertIn("ST_Intersects(document_reference.search_geom", sql)
+        self.assertNotIn("ST_Subdivide", sql)
+        self.assertIn("document_reference.contact_id =", sql)
+
+    def test_paid_search_query_exclude_end(self):
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), None, None,
+                                              include_end=False))
+        self.assertIn("document_reference.date_of_search <", sql)
+        self.assertNotIn("document_reference.date_of_search <=", sql)
+
+    def test_paid_search_query_after(self):
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), None, None,
+                                              after=(datetime(2019, 1, 5), 10)))
+        self.assertIn("(document_reference.date_of_search, document_reference.id) >", sql)
+
+    def test_paid_search_query_subdivides_large_extent(self):
+        district = {"type": "Feature", "geometry": mapping(Point(0, 0).buffer(1000, 128))}
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), district,
+                                              "anid"))
+        self.assertIn("document_reference.id IN (SELECT candidate.id", sql)
+        self.assertEqual(sql.count("ST_Subdivide("), 1)
+        self.assertIn("candidate.search_geom && extent_pieces.geom", sql)
+        self.assertIn("ST_Intersects(candidate.search_geom, extent_pieces.geom)", sql)
+        self.assertIn("candidate.contact_id =", sql)
+        self.assertIn("candidate.date_of_search >=", sql)
+        self.assertNotIn("ST_DWithin", sql)
+
+    def test_paid_search_query_subdivides_each_feature(self):
+        two_features = {"type": "FeatureCollection",
+                        "features": [POLYGON_FC['features'][0],
+                                     {"type": "Feature", "geometry": mapping(Point(1000, 0).buffer(10))}]}
+        sql = compile_query(paid_search_query(Session(), datetime(2019, 1, 1), datetime(2019, 2, 1), two_features,
+                                              None))
+        self.assertEqual(sql.count("ST_Subdivide("), 2)
+        self.assertIn("UNION ALL", sql)
+
+    def test_extent_geometries(self):
+        collection = {"type": "GeometryCollection",
+                      "geometries": [POLYGON_FC['features'][0]['geometry'], mapping(Point(5, 5))]}
+        self.assertEqual([geometry.geom_type for geometry in extent_geometries(collection)], ["Polygon", "Point"])
+        self.assertEqual([geometry.bounds for geometry in extent_geometries(POLYGON_FC_GC)], [(0.0, 0.0, 1.0, 1.0)])
+        self.assertEqual(len(extent_geometries(POLYGON_FC)), 1)
+        self.assertEqual(len(extent_geometries(POLYGON_FC['features'][0])), 1)
+        self.assertEqual(len(extent_geometries(POLYGON_FC['features'][0]['geometry'])), 1)
+
+    def test_batches(self):
+        self.assertEqual(list(batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batches([], 2)), [])
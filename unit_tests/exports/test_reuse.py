@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta, timezone
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from llc1_document_api.exports.reuse import (query_fingerprint,
+                                             record_window_state,
+                                             reuse_existing_results,
+                                             window_in_past, window_state)
+from llc1_document_api.models import SearchQuery
+from psycopg2.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
+
+PARAMETERS = {"start_timestamp": "2019-01-01T00:00:00", "end_timestamp": "2019-01-02T00:00:00",
+              "extent": {"type": "Polygon", "coordinates": [[[0, 0], [0, 1], [1, 1], [0, 0]]]}, "contact_id": "anid"}
+
+
+def new_query():
+    return SearchQuery(datetime.utcnow(), None, "auser", None, None, "STARTED", parameters=PARAMETERS,
+                       fingerprint=query_fingerprint(PARAMETERS, 'json', None))
+
+
+class TestReuse(TestCase):
+
+    def test_query_fingerprint_normalised(self):
+        reordered = {"contact_id": "anid",
+                     "extent": {"coordinates": [[[0, 0], [0, 1], [1, 1], [0, 0]]], "type": "Polygon"},
+                     "end_timestamp": "2019-01-02T00:00:00", "start_timestamp": "2019-01-01T00:00:00"}
+        self.assertEqual(query_fingerprint(PARAMETERS, 'json', None), query_fingerprint(reordered, 'json', None))
+
+    def test_query_fingerprint_differs(self):
+        fingerprint = query_fingerprint(PARAMETERS, 'json', None)
+        self.assertNotEqual(fingerprint, query_fingerprint(PARAMETERS, 'csv', None))
+        self.assertNotEqual(fingerprint, query_fingerprint(PARAMETERS, 'json', 'gzip'))
+        self.assertNotEqual(fingerprint, query_fingerprint(dict(PARAMETERS, contact_id="other"), 'json', None))
+
+    def test_window_in_past(self):
+        self.assertTrue(window_in_past(datetime(2019, 1, 1)))
+        self.assertFalse(window_in_past(datetime.utcnow() + timedelta(hours=1)))
+        self.assertTrue(window_in_past(datetime(2019, 1, 1, tzinfo=timezone.utc)))
+        self.assertFalse(window_in_past(datetime.now(timezone.utc) + timedelta(hours=1)))
+
+    def test_window_state(self):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.one.return_value = (3, 10)
+        self.assertEqual(window_state(mock_session, datetime(2019, 1, 1), datetime(2019, 1, 2)),
+                         {"count": 3, "max_id": 10})
+
+    def test_reuse_shares_running_query(self):
+        mock_session = MagicMock()
+        mock_running = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = mock_running
+        search_query = new_query()
+        self.assertEqual(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                datetime(2019, 1, 2)), mock_running)
+        mock_session.execute.assert_called()
+        self.assertEqual(search_query.status, "STARTED")
+
+    def test_reuse_ignores_current_window(self):
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
+        search_query = new_query()
+        self.assertIsNone(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                 datetime.utcnow() + timedelta(days=1)))
+        self.assertIsNone(search_query.window_state)
+        self.assertEqual(search_query.status, "STARTED")
+
+    def test_reuse_completed_query(self):
+        mock_session = MagicMock()
+        mock_previous = MagicMock()
+        mock_previous.document = "/abucket/afile"
+        mock_previous.external_url = "http://external/afile"
+        mock_previous.window_state = {"count": 3, "max_id": 10}
+        mock_changed = MagicMock()
+        mock_changed.window_state = {"count": 2, "max_id": 9}
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = \
+            [mock_changed, mock_previous]
+        mock_session.query.return_value.filter.return_value.one.return_value = (3, 10)
+        search_query = new_query()
+
+        self.assertIsNone(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                 datetime(2019, 1, 2)))
+
+        self.assertEqual(str(mock_session.execute.call_args_list[1].args[0]), "SET LOCAL statement_timeout = 2000")
+        self.assertEqual(search_query.window_state, {"count": 3, "max_id": 10})
+        self.assertEqual(search_query.status, "COMPLETED")
+        self.assertEqual(search_query.document, "/abucket/afile")
+        self.assertEqual(search_query.external_url, "http://external/afile")
+        self.assertIsNotNone(search_query.completion_timestamp)
+        self.assertIsNone(search_query.authorization_header)
+
+    def test_reuse_nothing_to_reuse(self):
+        """The window isn't summarised unless there is a completed query it could match."""
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = []
+        search_query = new_query()
+        self.assertIsNone(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                 datetime(2019, 1, 2)))
+        mock_session.query.return_value.filter.return_value.one.assert_not_called()
+        mock_session.begin_nested.assert_not_called()
+        self.assertIsNone(search_query.window_state)
+        self.assertEqual(search_query.status, "STARTED")
+
+    def test_reuse_window_state_changed(self):
+        mock_session = MagicMock()
+        mock_previous = MagicMock()
+        mock_previous.window_state = {"count": 2, "max_id": 9}
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = [mock_previous]
+        mock_session.query.return_value.filter.return_value.one.return_value = (3, 10)
+        search_query = new_query()
+        self.assertIsNone(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                 datetime(2019, 1, 2)))
+        self.assertEqual(search_query.window_state, {"count": 3, "max_id": 10})
+        self.assertEqual(search_query.status, "STARTED")
+
+    def test_reuse_window_state_timeout(self):
+        """A window that takes too long to summarise is run rather than reused."""
+        mock_session = MagicMock()
+        mock_session.query.return_value.filter.return_value.order_by.return_value.first.return_value = None
+        mock_session.query.return_value.filter.return_value.order_by.return_value.all.return_value = [MagicMock()]
+        mock_session.query.return_value.filter.return_value.one.side_effect = \
+            OperationalError("SELECT", {}, QueryCanceled())
+        search_query = new_query()
+        self.assertIsNone(reuse_existing_results(mock_session, search_query, datetime(2019, 1, 1),
+                                                 datetime(2019, 1, 2)))
+        self.assertIsNone(search_query.window_state)
+        self.assertEqual(search_query.status, "STARTED")
+
+    def test_record_window_state(self):
+        mock_session_factory = MagicMock()
+        mock_session = mock_session_factory.return_value
+        mock_session.query.return_value.filter.return_value.one.return_value = (3, 10)
+
+        record_window_state(mock_session_factory, 1, datetime(2019, 1, 1), datetime(2019, 1, 2), 900)
+
+        self.assertEqual(str(mock_session.execute.call_args.args[0]), "SET LOCAL statement_timeout = 900000")
+        mock_session.query.return_value.filter.return_value.update.assert_called_once()
+        self.assertEqual(list(mock_session.query.return_value.filter.return_value.update.call_args.args[0].values()),
+                         [{"count": 3, "max_id": 10}])
+        mock_session.commit.assert_called()
+        mock_session.close.assert_called()
+
+    def test_record_window_state_current_window(self):
+        mock_session_factory = MagicMock()
+        record_window_state(mock_session_factory, 1, datetime(2019, 1, 1), datetime.utcnow() + timedelta(days=1), 900)
+        mock_session_factory.assert_not_called()
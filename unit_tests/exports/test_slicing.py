@@ -0,0 +1,214 @@
+import json
+from datetime import datetime, timedelta
+from tempfile import SpooledTemporaryFile
+from unittest import TestCase
+from unittest.mock import MagicMock, call, patch
+
+from dateutil.parser import parse
+from llc1_document_api.exports.checkpoints import Checkpoint
+from llc1_document_api.exports.progress import ExportCancelledError
+from llc1_document_api.exports.slicing import (SlicedQuery, TimeSlice, split,
+                                               time_slices)
+from psycopg2.errors import QueryCanceled
+from sqlalchemy.exc import OperationalError
+
+START = datetime(2019, 1, 1)
+
+
+def spool_of(*results):
+    spool = SpooledTemporaryFile(mode='w+b')
+    for result in results:
+        spool.write(json.dumps(result).encode('utf-8') + b'\n')
+    spool.seek(0)
+    return spool
+
+
+def sliced_query(session_factory=None, enricher=None, **kwargs):
+    return SlicedQuery(session_factory or MagicMock(), None, None, 1, enricher or MagicMock(), MagicMock(), **kwargs)
+
+
+class TestSlicing(TestCase):
+
+    def test_time_slices(self):
+        slices = time_slices(START, START + timedelta(days=70), timedelta(days=30))
+        self.assertEqual(slices, [TimeSlice(START, START + timedelta(days=30), False),
+                                  TimeSlice(START + timedelta(days=30), START + timedelta(days=60), False),
+                                  TimeSlice(START + timedelta(days=60), START + timedelta(days=70), True)])
+
+    def test_time_slices_single(self):
+        self.assertEqual(time_slices(START, START + timedelta(days=30), timedelta(days=30)),
+                         [TimeSlice(START, START + timedelta(days=30), True)])
+
+    def test_split(self):
+        first, second = split(TimeSlice(START, START + timedelta(days=2), True))
+        self.assertEqual(first, TimeSlice(START, START + timedelta(days=1), False))
+        self.assertEqual(second, TimeSlice(START + timedelta(days=1), START + timedelta(days=2), True))
+
+    def test_split_keeps_position_in_first_half(self):
+        first, second = split(TimeSlice(START, START + timedelta(days=2), True, (START, 5)))
+        self.assertEqual(first.after, (START, 5))
+        self.assertIsNone(second.after)
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice(self, mock_paid_search_query):
+        mock_session_factory = MagicMock()
+        mock_session = mock_session_factory.return_value
+        mock_item = MagicMock()
+        mock_item.to_dict.return_value = {"id": 1}
+        mock_paid_search_query.return_value.yield_per.return_value = [mock_item, mock_item]
+        mock_enricher = MagicMock()
+        time_slice = TimeSlice(START, START + timedelta(days=1), False)
+
+        query = sliced_query(mock_session_factory, mock_enricher)
+        spool = query.query_slice(time_slice)
+
+        self.assertEqual(str(mock_session.execute.call_args.args[0]), "SET LOCAL statement_timeout = 1000")
+        mock_paid_search_query.assert_called_with(mock_session, time_slice.start, time_slice.end, None, None, False,
+                                                  None)
+        mock_enricher.enrich.assert_called_with([{"id": 1}, {"id": 1}])
+        self.assertEqual([json.loads(line) for line in spool], [{"id": 1}, {"id": 1}])
+        self.assertEqual(query.progress.rows_scanned, 2)
+        mock_session.rollback.assert_called()
+        mock_session.close.assert_called()
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice_registers_backend(self, mock_paid_search_query):
+        mock_session_factory = MagicMock()
+        mock_session = mock_session_factory.return_value
+        mock_session.execute.return_value.scalar.return_value = 1234
+        mock_paid_search_query.return_value.yield_per.return_value = []
+
+        sliced_query(mock_session_factory, search_query_id=7).query_slice(TimeSlice(START, START + timedelta(days=1),
+                                                                                    False))
+
+        tag = mock_session.execute.call_args_list[1].args[0]
+        self.assertIn("set_config", str(tag))
+        self.assertIn("llc1-export-7", tag.compile().params.values())
+        updates = mock_session.query.return_value.filter.return_value.update.call_args_list
+        self.assertEqual(len(updates), 2)
+        self.assertIn("array_append", str(list(updates[0].args[0].values())[0]))
+        self.assertIn("array_remove", str(list(updates[1].args[0].values())[0]))
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice_already_cancelled(self, mock_paid_search_query):
+        mock_session_factory = MagicMock()
+        mock_session_factory.return_value.query.return_value.filter.return_value.update.return_value = 0
+        query = sliced_query(mock_session_factory, search_query_id=7)
+        with self.assertRaises(ExportCancelledError):
+            query.query_slice(TimeSlice(START, START + timedelta(days=1), False))
+        mock_paid_search_query.assert_not_called()
+        self.assertTrue(query.progress.cancelled.is_set())
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice_stops_when_cancelled(self, mock_paid_search_query):
+        mock_paid_search_query.return_value.yield_per.return_value = [MagicMock()]
+        query = sliced_query()
+        query.progress.cancel()
+        with self.assertRaises(ExportCancelledError):
+            query.query_slice(TimeSlice(START, START + timedelta(days=1), False))
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice_exception(self, mock_paid_search_query):
+        mock_session_factory = MagicMock()
+        mock_paid_search_query.return_value.yield_per.side_effect = Exception("Badness")
+        with self.assertRaises(Exception):
+            sliced_query(mock_session_factory).query_slice(TimeSlice(START, START + timedelta(days=1), False))
+        mock_session_factory.return_value.close.assert_called()
+
+    @patch('llc1_document_api.exports.slicing.paid_search_query')
+    def test_query_slice_failure_not_counted(self, mock_paid_search_query):
+        """The rows and time of a failed slice are taken back off the progress, as the slice is run again."""
+        mock_item = MagicMock()
+        mock_item.to_dict.return_value = {"id": 1}
+
+        def rows(batch_size):
+            yield mock_item
+            raise Exception("Badness")
+
+        mock_paid_search_query.return_value.yield_per.side_effect = rows
+        query = sliced_query()
+        query.progress.scanned(5)
+        with patch('llc1_document_api.exports.slicing.SEARCH_QUERY_BATCH_SIZE', 1):
+            with self.assertRaises(Exception):
+                query.query_slice(TimeSlice(START, START + timedelta(days=1), False))
+        self.assertEqual(query.progress.rows_scanned, 5)
+        self.assertEqual(set(query.progress.values()['phase_timings'].values()), {0.0})
+        query.enricher.enrich.assert_called_with([{"id": 1}])
+
+    def test_export_slice_retries(self):
+        query = sliced_query()
+        spool = spool_of({"id": 1})
+        time_slice = TimeSlice(START, START + timedelta(days=1), False)
+        with patch.object(query, 'query_slice', side_effect=[Exception("Badness"), spool]) as mock_query_slice:
+            self.assertEqual(query.export_slice(time_slice), [spool])
+        mock_query_slice.assert_has_calls([call(time_slice), call(time_slice)])
+
+    def test_export_slice_gives_up(self):
+        query = sliced_query()
+        with patch.object(query, 'query_slice', side_effect=Exception("Badness")) as mock_query_slice:
+            with self.assertRaises(Exception):
+                query.export_slice(TimeSlice(START, START + timedelta(days=1), False))
+        self.assertEqual(mock_query_slice.call_count, 3)
+
+    def test_export_slice_splits_on_timeout(self):
+        query = sliced_query()
+        time_slice = TimeSlice(START, START + timedelta(days=2), True)
+        first, second = split(time_slice)
+        timeout = OperationalError("SELECT", {}, QueryCanceled())
+        spools = [spool_of({"id": 1}), spool_of({"id": 2})]
+        with patch.object(query, 'query_slice', side_effect=[timeout] + spools) as mock_query_slice:
+            self.assertEqual(query.export_slice(time_slice), spools)
+        mock_query_slice.assert_has_calls([call(time_slice), call(first), call(second)])
+
+    def test_export_slice_cancelled_by_user(self):
+        query = sliced_query()
+        cancelled = OperationalError("SELECT", {}, QueryCanceled("canceling statement due to user request"))
+        with patch.object(query, 'query_slice', side_effect=cancelled) as mock_query_slice:
+            with self.assertRaises(ExportCancelledError):
+                query.export_slice(TimeSlice(START, START + timedelta(days=2), True))
+        self.assertEqual(mock_query_slice.call_count, 1)
+        self.assertTrue(query.progress.cancelled.is_set())
+
+    def test_results_in_slice_order(self):
+        query = sliced_query(parallelism=2, slice_length=timedelta(days=1))
+
+        def export_slice(time_slice):
+            day = (time_slice.start - START).days
+            return [spool_of({"day": day, "part": 0}), spool_of({"day": day, "part": 1})]
+
+        with patch.object(query, 'export_slice', side_effect=export_slice):
+            results = list(query.results(START, START + timedelta(days=5)))
+        self.assertEqual(results, [{"day": day, "part": part} for day in range(5) for part in range(2)])
+
+    def test_results_exception(self):
+        query = sliced_query(parallelism=2, slice_length=timedelta(days=1))
+        with patch.object(query, 'export_slice', side_effect=Exception("Badness")):
+            with self.assertRaises(Exception):
+                list(query.results(START, START + timedelta(days=5)))
+
+    def test_results_after(self):
+        query = sliced_query(parallelism=2, slice_length=timedelta(days=1))
+        after = (START + timedelta(hours=36), 5)
+        with patch.object(query, 'export_slice', return_value=[]) as mock_export_slice:
+            list(query.results(START, START + timedelta(days=3), after))
+        slices = [args.args[0] for args in mock_export_slice.call_args_list]
+        self.assertEqual(slices[0], TimeSlice(after[0], after[0] + timedelta(days=1), False, after))
+        self.assertEqual(slices[-1].end, START + timedelta(days=3))
+        self.assertIsNone(slices[1].after)
+
+    def test_results_after_with_offsets(self):
+        """A window with UTC offsets, as given in the request, is resumed from a checkpoint of date_of_search."""
+        query = sliced_query(parallelism=2, slice_length=timedelta(days=1))
+        after = Checkpoint(7, {"date_of_search": "2019-01-02T12:00:00", "id": 5, "rows": 10}).after
+        with patch.object(query, 'export_slice', return_value=[]) as mock_export_slice:
+            list(query.results(parse("2019-01-01T00:00:00Z"), parse("2019-01-04T01:00:00+01:00"), after))
+        slices = [args.args[0] for args in mock_export_slice.call_args_list]
+        self.assertEqual(slices[0], TimeSlice(datetime(2019, 1, 2, 12), datetime(2019, 1, 3, 12), False,
+                                              (datetime(2019, 1, 2, 12), 5)))
+        self.assertEqual(slices[-1], TimeSlice(datetime(2019, 1, 3, 12), datetime(2019, 1, 4), True))
+
+    def test_results_with_offsets(self):
+        query = sliced_query(parallelism=2, slice_length=timedelta(days=1))
+        with patch.object(query, 'export_slice', return_value=[]) as mock_export_slice:
+            list(query.results(parse("2019-01-01T01:00:00+01:00"), parse("2019-01-02T00:00:00Z")))
+        mock_export_slice.assert_called_once_with(TimeSlice(START, START + timedelta(days=1), True))
@@ -0,0 +1,174 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api.exports.progress import ExportProgress
+from llc1_document_api.exports.workers import (ExportWorkerPool, Heartbeat,
+                                               record_export_metrics)
+from llc1_document_api.models import SearchQuery
+from unit_tests.test_background import with_mock_app
+
+
+class TestWorkers(TestCase):
+
+    def create_pool(self):
+        return with_mock_app(ExportWorkerPool(), {"SEARCH_QUERY_WORKERS": 2,
+                                                  "SEARCH_QUERY_POLL_INTERVAL": 10,
+                                                  "SEARCH_QUERY_HEARTBEAT_INTERVAL": 15,
+                                                  "SEARCH_QUERY_HEARTBEAT_TIMEOUT": 60,
+                                                  "SEARCH_QUERY_MAX_ATTEMPTS": 3,
+                                                  "SEARCH_QUERY_TIMEOUT": 900,
+                                                  "SEARCH_QUERY_BUCKET": "abucket"})
+
+    def claim_query(self, pool):
+        return pool.session_factory.return_value.query.return_value.filter.return_value.filter.return_value.\
+            order_by.return_value.with_for_update.return_value.first
+
+    def test_claim_nothing_queued(self):
+        pool = self.create_pool()
+        self.claim_query(pool).return_value = None
+        self.assertIsNone(pool.claim())
+        pool.session_factory.return_value.close.assert_called()
+
+    def test_claim(self):
+        pool = self.create_pool()
+        mock_search_query = MagicMock()
+        mock_search_query.id = 1
+        mock_search_query.attempts = 0
+        mock_search_query.parameters = {"start_timestamp": "2019-01-01T00:00:00"}
+        mock_search_query.trace_id = "atrace"
+        mock_search_query.authorization_header = "Fake JWT"
+        mock_search_query.format = "csv"
+        mock_search_query.compression = "gzip"
+        mock_search_query.checkpoint = {"rows": 10}
+        mock_search_query.backend_pids = [1234]
+        self.claim_query(pool).return_value = mock_search_query
+
+        job = pool.claim()
+
+        self.assertEqual(job, {"id": 1, "parameters": {"start_timestamp": "2019-01-01T00:00:00"}, "format": "csv",
+                               "compression": "gzip", "checkpoint": {"rows": 10}, "trace_id": "atrace",
+                               "authorization_header": "Fake JWT", "attempt": 1})
+        self.assertEqual(mock_search_query.attempts, 1)
+        self.assertIsInstance(mock_search_query.heartbeat_timestamp, datetime)
+        self.assertIsNone(mock_search_query.backend_pids)
+        pool.session_factory.return_value.query.return_value.filter.return_value.filter.return_value.\
+            order_by.return_value.with_for_update.assert_called_with(skip_locked=True)
+        pool.session_factory.return_value.commit.assert_called()
+
+    def test_claim_abandons_exhausted_query(self):
+        pool = self.create_pool()
+        mock_search_query = MagicMock()
+        mock_search_query.attempts = 3
+        mock_search_query.parameters = {"start_timestamp": "2019-01-01T00:00:00"}
+        self.claim_query(pool).side_effect = [mock_search_query, None]
+
+        self.assertIsNone(pool.claim())
+        self.assertEqual(mock_search_query.status, "FAILED")
+
+    @patch('llc1_document_api.exports.workers.record_window_state')
+    @patch('llc1_document_api.exports.workers.Heartbeat')
+    @patch('llc1_document_api.exports.workers.background_client')
+    @patch('llc1_document_api.exports.workers.search_query')
+    def test_execute(self, mock_search_query, mock_requests, mock_heartbeat, mock_record_window_state):
+        pool = self.create_pool()
+        pool.execute({"id": 1,
+                      "parameters": {"start_timestamp": "2019-01-01T00:00:00", "end_timestamp": "2019-01-02T00:00:00",
+                                     "extent": None, "contact_id": "anid"},
+                      "format": "ndjson", "compression": "gzip", "checkpoint": {"rows": 10}, "trace_id": "atrace",
+                      "authorization_header": "Fake JWT", "attempt": 1})
+
+        args = mock_search_query.call_args.args
+        self.assertEqual(args[0], 1)
+        self.assertEqual(args[1], datetime(2019, 1, 1))
+        self.assertEqual(args[2], datetime(2019, 1, 2))
+        self.assertEqual(args[4], "anid")
+        kwargs = mock_search_query.call_args.kwargs
+        self.assertEqual(kwargs['export_format'], "ndjson")
+        self.assertEqual(kwargs['compression'], "gzip")
+        self.assertEqual(kwargs['checkpoint'], {"rows": 10})
+        self.assertIs(kwargs['progress'], mock_heartbeat.call_args.args[4])
+        self.assertEqual(kwargs['progress'].rows_written, 10)
+        mock_requests.return_value.headers.update.assert_any_call({'X-Trace-ID': 'atrace'})
+        mock_requests.return_value.headers.update.assert_any_call({'Authorization': 'Fake JWT'})
+        mock_heartbeat.return_value.start.assert_called()
+        mock_heartbeat.return_value.stop.assert_called()
+        mock_record_window_state.assert_called_with(pool.session_factory, 1, datetime(2019, 1, 1),
+                                                    datetime(2019, 1, 2), 900)
+
+    @patch('llc1_document_api.exports.workers.record_window_state')
+    @patch('llc1_document_api.exports.workers.Heartbeat')
+    @patch('llc1_document_api.exports.workers.background_client')
+    @patch('llc1_document_api.exports.workers.search_query')
+    def test_execute_window_state_failure(self, mock_search_query, mock_requests, mock_heartbeat,
+                                          mock_record_window_state):
+        """The query is still run if its window state can't be recorded, it just can't be reused."""
+        pool = self.create_pool()
+        mock_record_window_state.side_effect = Exception("Badness")
+        pool.execute({"id": 1,
+                      "parameters": {"start_timestamp": "2019-01-01T00:00:00", "end_timestamp": "2019-01-02T00:00:00"},
+                      "format": "json", "compression": None, "checkpoint": None, "trace_id": None,
+                      "authorization_header": None, "attempt": 1})
+        mock_search_query.assert_called()
+        pool.app.logger.exception.assert_called_with("Failed to record the window state of search query 1")
+
+    @patch('llc1_document_api.exports.workers.Heartbeat')
+    @patch('llc1_document_api.exports.workers.background_client')
+    @patch('llc1_document_api.exports.workers.search_query')
+    def test_execute_exception(self, mock_search_query, mock_requests, mock_heartbeat):
+        pool = self.create_pool()
+        mock_search_query.side_effect = Exception("Badness")
+        pool.execute({"id": 1,
+                      "parameters": {"start_timestamp": "2019-01-01T00:00:00", "end_timestamp": "2019-01-02T00:00:00"},
+                      "format": "json", "compression": None, "checkpoint": None, "trace_id": None,
+                      "authorization_header": None, "attempt": 1})
+        mock_heartbeat.return_value.stop.assert_called()
+        pool.app.logger.exception.assert_called()
+
+    @patch('llc1_document_api.exports.workers.export_phase_seconds')
+    @patch('llc1_document_api.exports.workers.export_rows')
+    @patch('llc1_document_api.exports.workers.export_durations')
+    def test_record_export_metrics(self, mock_durations, mock_rows, mock_phase_seconds):
+        progress = ExportProgress(rows=10)
+        progress.written(5)
+        progress.set_phase("completed")
+        progress.timings['query'] = 2.5
+
+        record_export_metrics({"format": "csv", "checkpoint": {"rows": 10}}, progress, 12.0)
+
+        mock_durations.observe.assert_called_with(12.0, "csv", "completed")
+        mock_rows.inc.assert_called_with("csv", amount=5)
+        mock_phase_seconds.inc.assert_any_call('query', amount=2.5)
+
+    def test_heartbeat_beat(self):
+        mock_session_factory = MagicMock()
+        heartbeat = Heartbeat(mock_session_factory, 1, 15, MagicMock())
+        heartbeat.beat()
+        mock_session_factory.return_value.query.return_value.filter.return_value.update.assert_called()
+        mock_session_factory.return_value.commit.assert_called()
+
+    def test_heartbeat_beat_progress(self):
+        mock_session_factory = MagicMock()
+        progress = ExportProgress()
+        progress.set_phase("querying")
+        progress.scanned(10)
+        heartbeat = Heartbeat(mock_session_factory, 1, 15, MagicMock(), progress)
+        heartbeat.beat()
+        values = mock_session_factory.return_value.query.return_value.filter.return_value.update.call_args.args[0]
+        self.assertEqual(values[SearchQuery.phase], "querying")
+        self.assertEqual(values[SearchQuery.rows_scanned], 10)
+        self.assertIn(SearchQuery.heartbeat_timestamp, values)
+
+    def test_heartbeat_beat_cancelled(self):
+        mock_session_factory = MagicMock()
+        mock_session_factory.return_value.query.return_value.filter.return_value.update.return_value = 0
+        progress = ExportProgress()
+        heartbeat = Heartbeat(mock_session_factory, 1, 15, MagicMock(), progress)
+        heartbeat.beat()
+        self.assertTrue(progress.cancelled.is_set())
+
+    def test_heartbeat_stop(self):
+        heartbeat = Heartbeat(MagicMock(), 1, 15, MagicMock())
+        heartbeat.start()
+        heartbeat.stop()
+        self.assertFalse(heartbeat.thread.is_alive())
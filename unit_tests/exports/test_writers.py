@@ -0,0 +1,99 @@
+import csv
+import gzip
+import io
+import json
+from unittest import TestCase
+
+from llc1_document_api.exports.writers import (FORMATS, CsvWriter,
+                                               JsonArrayWriter, NdjsonWriter,
+                                               writer_for)
+from unit_tests.test_models import POLYGON_FC
+
+
+class TestWriters(TestCase):
+
+    def test_json_array_writer_empty(self):
+        writer = JsonArrayWriter(1024)
+        self.assertEqual(json.loads(writer.finish().read()), [])
+        self.assertEqual(writer.count, 0)
+        writer.close()
+
+    def test_json_array_writer_items(self):
+        writer = JsonArrayWriter(1024)
+        writer.write({"id": 1})
+        writer.write({"id": 2})
+        self.assertEqual(json.loads(writer.finish().read()), [{"id": 1}, {"id": 2}])
+        self.assertEqual(writer.count, 2)
+        writer.close()
+
+    def test_json_array_writer_rolls_over_to_disk(self):
+        writer = JsonArrayWriter(16)
+        for index in range(10):
+            writer.write({"id": index})
+        self.assertTrue(writer.file._rolled)
+        self.assertEqual(len(json.loads(writer.finish().read())), 10)
+        writer.close()
+
+    def test_ndjson_writer(self):
+        writer = NdjsonWriter(1024)
+        writer.write({"id": 1})
+        writer.write({"id": 2})
+        self.assertEqual([json.loads(line) for line in writer.finish()], [{"id": 1}, {"id": 2}])
+        self.assertEqual(writer.extension, "ndjson")
+        writer.close()
+
+    def test_csv_writer(self):
+        writer = CsvWriter(1024)
+        writer.write({"id": 1, "date_of_search": "2019-01-01T00:00:00", "search_area_description": "a, b",
+                      "charges": [{"display-id": "LLC1", "item": {"charge-type": "Planning"}},
+                                  {"display-id": "LLC2", "item": {"charge-type": "Planning"}},
+                                  {"display-id": "LLC3", "item": {"charge-type": "Listed building"}}],
+                      "search_extent": POLYGON_FC, "email": "a@example.com"})
+        writer.write({"id": 2, "charges": None})
+        rows = list(csv.DictReader(io.TextIOWrapper(writer.finish(), encoding='utf-8', newline='')))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]['search_area_description'], "a, b")
+        self.assertEqual(rows[0]['number_of_charges'], "3")
+        self.assertEqual(rows[0]['charge_ids'], "LLC1;LLC2;LLC3")
+        self.assertEqual(rows[0]['charge_types'], "Listed building;Planning")
+        self.assertEqual(json.loads(rows[0]['search_extent']), POLYGON_FC)
+        self.assertEqual(rows[0]['email'], "a@example.com")
+        self.assertEqual(rows[1]['number_of_charges'], "0")
+        self.assertEqual(rows[1]['search_extent'], "")
+
+    def test_gzip_writer(self):
+        for export_format in FORMATS:
+            writer = writer_for(export_format, 'gzip', 1024)
+            writer.write({"id": 1, "charges": []})
+            content = gzip.decompress(writer.finish().read()).decode('utf-8')
+            self.assertIn("1", content)
+            self.assertEqual(writer.content_type, "application/gzip")
+            self.assertTrue(writer.extension.endswith(".gz"))
+            writer.close()
+
+    def test_writer_for(self):
+        self.assertIsInstance(writer_for('json', None, 1024), JsonArrayWriter)
+        self.assertIsInstance(writer_for('ndjson', None, 1024), NdjsonWriter)
+        csv_writer = writer_for('csv', None, 1024)
+        self.assertIsInstance(csv_writer, CsvWriter)
+        self.assertEqual(csv_writer.content_type, "text/csv")
+
+    def test_parts_join_into_document(self):
+        items = [{"id": index, "charges": []} for index in range(5)]
+        for export_format in FORMATS:
+            for compression in (None, 'gzip'):
+                document = writer_for(export_format, compression, 1024)
+                for item in items:
+                    document.write(item)
+                first = writer_for(export_format, compression, 1024, part=True)
+                for item in items[:2]:
+                    first.write(item)
+                second = writer_for(export_format, compression, 1024, part=True, continuation=True)
+                for item in items[2:]:
+                    second.write(item)
+                joined = second.header() + first.finish().read() + second.finish().read() + second.footer()
+                expected = document.finish().read()
+                if compression:
+                    joined = gzip.decompress(joined)
+                    expected = gzip.decompress(expected)
+                self.assertEqual(joined, expected, "{} {}".format(export_format, compression))
@@ -0,0 +1,91 @@
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api.exceptions import ApplicationError
+from llc1_document_api.outbox.dispatcher import PdfDispatcher
+from unit_tests.test_background import with_mock_app
+
+PDF_REQUEST = {"id": 1, "search_id": 12, "payload": {"reference_number": 12}, "callback_url": "http://callback/12",
+               "trace_id": "atrace", "authorization_header": "Fake JWT", "attempt": 1}
+
+
+class TestDispatcher(TestCase):
+
+    def create_dispatcher(self):
+        return with_mock_app(PdfDispatcher(), {"PDF_DISPATCH_CONCURRENCY": 2,
+                                               "PDF_DISPATCH_POLL_INTERVAL": 5,
+                                               "PDF_DISPATCH_LEASE": 60,
+                                               "PDF_DISPATCH_RETRY_SECONDS": 2,
+                                               "PDF_DISPATCH_MAX_ATTEMPTS": 3})
+
+    def claim_query(self, dispatcher):
+        return dispatcher.session_factory.return_value.query.return_value.filter.return_value.order_by.return_value.\
+            with_for_update.return_value.first
+
+    def outbox_query(self, dispatcher):
+        return dispatcher.session_factory.return_value.query.return_value.filter.return_value
+
+    def test_claim_nothing_due(self):
+        dispatcher = self.create_dispatcher()
+        self.claim_query(dispatcher).return_value = None
+        self.assertIsNone(dispatcher.claim())
+        dispatcher.session_factory.return_value.close.assert_called()
+
+    def test_claim(self):
+        dispatcher = self.create_dispatcher()
+        mock_pdf_request = MagicMock()
+        mock_pdf_request.id = 1
+        mock_pdf_request.search_id = 12
+        mock_pdf_request.payload = {"reference_number": 12}
+        mock_pdf_request.callback_url = "http://callback/12"
+        mock_pdf_request.trace_id = "atrace"
+        mock_pdf_request.authorization_header = "Fake JWT"
+        mock_pdf_request.attempts = 0
+        self.claim_query(dispatcher).return_value = mock_pdf_request
+
+        self.assertEqual(dispatcher.claim(), PDF_REQUEST)
+        self.assertEqual(mock_pdf_request.attempts, 1)
+        self.assertGreater(mock_pdf_request.next_attempt_timestamp, datetime.utcnow())
+        dispatcher.session_factory.return_value.query.return_value.filter.return_value.order_by.return_value.\
+            with_for_update.assert_called_with(skip_locked=True)
+        dispatcher.session_factory.return_value.commit.assert_called()
+
+    @patch('llc1_document_api.outbox.dispatcher.background_client')
+    @patch('llc1_document_api.outbox.dispatcher.PdfGenerationService')
+    def test_execute(self, mock_pdf, mock_requests):
+        dispatcher = self.create_dispatcher()
+        dispatcher.execute(PDF_REQUEST)
+        mock_pdf.dispatch_pdf.assert_called_with(PDF_REQUEST, mock_requests.return_value, dispatcher.app.logger)
+        self.outbox_query(dispatcher).delete.assert_called()
+        self.outbox_query(dispatcher).update.assert_not_called()
+        dispatcher.session_factory.return_value.commit.assert_called()
+
+    @patch('llc1_document_api.outbox.dispatcher.PdfGenerationService')
+    def test_execute_retries(self, mock_pdf):
+        dispatcher = self.create_dispatcher()
+        mock_pdf.dispatch_pdf.side_effect = ApplicationError("Error generating PDF", "GEN-01", 503)
+        dispatcher.execute(dict(PDF_REQUEST, attempt=2))
+        self.outbox_query(dispatcher).delete.assert_not_called()
+        values = self.outbox_query(dispatcher).update.call_args.args[0]
+        self.assertEqual(len(values), 1)
+        self.assertGreater(list(values.values())[0], datetime.utcnow())
+
+    @patch('llc1_document_api.outbox.dispatcher.PdfGenerationService')
+    def test_execute_gives_up(self, mock_pdf):
+        dispatcher = self.create_dispatcher()
+        mock_pdf.dispatch_pdf.side_effect = Exception("Badness")
+        dispatcher.execute(dict(PDF_REQUEST, attempt=3))
+        self.outbox_query(dispatcher).delete.assert_called()
+        values = self.outbox_query(dispatcher).update.call_args.args[0]
+        self.assertEqual(list(values.values()), ['failed'])
+        dispatcher.app.logger.exception.assert_called()
+
+    @patch('llc1_document_api.outbox.dispatcher.PdfGenerationService')
+    def test_execute_rejected(self, mock_pdf):
+        dispatcher = self.create_dispatcher()
+        mock_pdf.dispatch_pdf.side_effect = ApplicationError("Error generating PDF", "GEN-01", 400)
+        dispatcher.execute(PDF_REQUEST)
+        self.outbox_query(dispatcher).delete.assert_called()
+        values = self.outbox_query(dispatcher).update.call_args.args[0]
+        self.assertEqual(list(values.values()), ['failed'])
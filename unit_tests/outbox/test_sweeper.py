@@ -0,0 +1,82 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api import main
+from llc1_document_api.outbox.sweeper import (GenerationSweeper,
+                                              sweep_expired_generations)
+from unit_tests.test_background import StopRunning, with_mock_app
+
+
+class TestSweeper(TestCase):
+
+    def create_sweeper(self):
+        return with_mock_app(GenerationSweeper(), {"GENERATION_SWEEP_INTERVAL": 60,
+                                                   "GENERATION_SWEEP_BATCH_SIZE": 2,
+                                                   "ASYNC_PDF_TIMEOUT": 300})
+
+    def swept_ids(self, sweeper):
+        return sweeper.session_factory.return_value.execute.return_value.scalars.return_value.all
+
+    def test_init_app_registers_start_and_command(self):
+        sweeper = GenerationSweeper()
+        mock_app = MagicMock()
+        sweeper.init_app(mock_app)
+        mock_app.before_request.assert_called_with(sweeper.start)
+        mock_app.cli.add_command.assert_called_with(sweep_expired_generations)
+
+    def test_thread_count(self):
+        sweeper = self.create_sweeper()
+        self.assertEqual(sweeper.thread_count(), 1)
+        sweeper.app.config['GENERATION_SWEEP_INTERVAL'] = 0
+        self.assertEqual(sweeper.thread_count(), 0)
+
+    def test_run(self):
+        sweeper = self.create_sweeper()
+        with patch.object(sweeper, 'wait'), patch.object(sweeper, 'sweep') as mock_sweep:
+            mock_sweep.side_effect = [Exception("Badness"), StopRunning()]
+            with self.assertRaises(StopRunning):
+                sweeper.run()
+        sweeper.app.logger.exception.assert_called_once()
+
+    @patch('llc1_document_api.outbox.sweeper.notify_generation_finished')
+    def test_sweep_batches(self, mock_notify):
+        sweeper = self.create_sweeper()
+        self.swept_ids(sweeper).side_effect = [[1, 2], [3]]
+
+        self.assertEqual(sweeper.sweep(), 3)
+
+        mock_session = sweeper.session_factory.return_value
+        self.assertEqual(mock_session.execute.call_count, 2)
+        self.assertEqual(mock_session.commit.call_count, 2)
+        self.assertEqual(mock_session.query.return_value.filter.return_value.delete.call_count, 2)
+        self.assertEqual([call[0][1] for call in mock_notify.call_args_list], [1, 2, 3])
+        sweeper.app.logger.info.assert_called()
+
+    @patch('llc1_document_api.outbox.sweeper.notify_generation_finished')
+    def test_sweep_nothing_expired(self, mock_notify):
+        sweeper = self.create_sweeper()
+        self.swept_ids(sweeper).return_value = []
+
+        self.assertEqual(sweeper.sweep(), 0)
+
+        mock_session = sweeper.session_factory.return_value
+        mock_session.query.assert_not_called()
+        mock_notify.assert_not_called()
+        mock_session.commit.assert_called_once()
+        sweeper.app.logger.info.assert_not_called()
+
+    def test_sweep_batch_failure(self):
+        sweeper = self.create_sweeper()
+        sweeper.session_factory.return_value.execute.side_effect = Exception("deadlock")
+
+        with self.assertRaises(Exception):
+            sweeper.sweep()
+
+        sweeper.session_factory.return_value.rollback.assert_called_once()
+        sweeper.session_factory.return_value.close.assert_called_once()
+
+    @patch('llc1_document_api.outbox.sweeper.generation_sweeper')
+    def test_command(self, mock_sweeper):
+        mock_sweeper.sweep.return_value = 4
+        result = main.app.test_cli_runner().invoke(args=['sweep-expired-generations'])
+        self.assertEqual(result.output, "Swept 4 expired PDF generations\n")
@@ -1,9 +1,18 @@
+import base64
+import json
+import time
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
 from flask import g
 from llc1_document_api import app, main
 from llc1_document_api.exceptions import ApplicationError
+from requests.adapters import HTTPAdapter
+
+
+def bearer_token(claims):
+    payload = base64.urlsafe_b64encode(json.dumps(claims).encode('utf-8')).decode('utf-8').rstrip('=')
+    return "Bearer header.{}.signature".format(payload)
 
 
 class TestApp(TestCase):
@@ -11,11 +20,13 @@ class TestApp(TestCase):
     TRACE_ID = 'some trace id'
     X_API_Version = '1.0.0'
 
+    def setUp(self):
+        app.jwt_cache.clear()
+
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.app.uuid')
-    @patch('llc1_document_api.app.RequestsSessionTimeout')
-    def test_before_request(self, requests_mock, uuid_mock, validate):
-        """Should set a uuid trace id, update the trace id on global, and assign the session to the global object."""
+    def test_before_request(self, uuid_mock, validate):
+        """Should set a uuid trace id, update the trace id on global, and assign a client of the shared session."""
 
         with main.app.app_context():
             with main.app.test_request_context(headers={
@@ -23,16 +34,13 @@ class TestApp(TestCase):
                 "Authorization": "Fake JWT"
             }):
 
-                session_mock = Mock()
-                requests_mock.return_value = session_mock
-
                 app.before_request()
 
                 self.assertEqual(g.trace_id, self.TRACE_ID)
-                self.assertEqual(g.requests, session_mock)
-
-                g.requests.headers.update.assert_any_call({'Authorization': "Fake JWT"})
-                g.requests.headers.update.assert_any_call({'X-Trace-ID': self.TRACE_ID})
+                self.assertIs(g.requests.session, app.web_session)
+                self.assertEqual(dict(g.requests.headers), {'X-Trace-ID': self.TRACE_ID, 'Authorization': "Fake JWT"})
+                # Headers are added to each call, the shared session is left as it was
+                self.assertNotIn('Authorization', app.web_session.headers)
 
     def test_after_request(self):
         """Should set the X-API-Version to the expected value."""
@@ -46,7 +54,7 @@ class TestApp(TestCase):
 
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.app.uuid')
-    @patch('llc1_document_api.app.RequestsSessionTimeout')
+    @patch('llc1_document_api.app.RequestClient')
     def test_before_request_no_auth(self, requests_mock, uuid_mock, validate):
         """Should set a uuid trace id, update the trace id on global, and assign the session to the global object."""
         with main.app.app_context():
@@ -59,3 +67,100 @@ class TestApp(TestCase):
 
                 with self.assertRaises(ApplicationError):
                     app.before_request()
+
+    def test_request_client_headers(self):
+        """The client's headers are sent with each call, along with the call's own."""
+        mock_session = MagicMock()
+        client = app.RequestClient(mock_session, {'X-Trace-ID': self.TRACE_ID})
+        client.headers.update({'Authorization': "Fake JWT"})
+
+        client.post("http://storage-api/files", data="abc", headers={'Content-Type': 'text/plain'})
+        client.get("http://storage-api/files/1")
+
+        post_call, get_call = mock_session.request.call_args_list
+        self.assertEqual(post_call.args, ('POST', "http://storage-api/files"))
+        self.assertEqual(dict(post_call.kwargs['headers']), {'X-Trace-ID': self.TRACE_ID, 'Authorization': "Fake JWT",
+                                                             'Content-Type': 'text/plain'})
+        self.assertEqual(post_call.kwargs['data'], "abc")
+        self.assertEqual(dict(get_call.kwargs['headers']), {'X-Trace-ID': self.TRACE_ID, 'Authorization': "Fake JWT"})
+        self.assertTrue(get_call.kwargs['allow_redirects'])
+        self.assertEqual(dict(client.headers), {'X-Trace-ID': self.TRACE_ID, 'Authorization': "Fake JWT"})
+
+    def test_pooled_session(self):
+        """Each dependency gets a pool of its own size, and cookies are never kept."""
+        session = app.pooled_session({"http://storage-api:8080": 25}, 5)
+
+        adapter = session.get_adapter("http://storage-api:8080/v1.0/storage")
+        self.assertIsInstance(adapter, HTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, 25)
+        self.assertEqual(session.get_adapter("http://elsewhere/")._pool_maxsize, 5)
+        self.assertTrue(session.cookies._policy.is_not_allowed("storage-api"))
+
+    @patch('llc1_document_api.app.validate')
+    def test_validate_jwt_cached(self, validate):
+        """A validated token is not validated again until it is evicted."""
+        token = bearer_token({"exp": time.time() + 3600})
+        with main.app.test_request_context():
+            g.requests = MagicMock()
+            self.assertEqual(app.validate_jwt(token), validate.return_value)
+            self.assertEqual(app.validate_jwt(token), validate.return_value)
+            validate.assert_called_once_with(main.app.config['AUTHENTICATION_API_URL'] + '/authentication/validate',
+                                             token, g.requests)
+
+    @patch('llc1_document_api.app.validate')
+    def test_validate_jwt_not_cached(self, validate):
+        """Tokens that have expired, or whose expiry can't be read, are validated every time."""
+        tokens = [bearer_token({"exp": time.time() - 10}), bearer_token({"sub": "someone"}), "Fake JWT"]
+        with main.app.test_request_context():
+            g.requests = MagicMock()
+            for token in tokens * 2:
+                app.validate_jwt(token)
+        self.assertEqual(validate.call_count, 6)
+
+    @patch('llc1_document_api.app.validate')
+    def test_validate_jwt_failure_not_cached(self, validate):
+        validate.side_effect = [app.ValidationFailure(), {"principle": "someone"}]
+        token = bearer_token({"exp": time.time() + 3600})
+        with main.app.test_request_context():
+            g.requests = MagicMock()
+            with self.assertRaises(app.ValidationFailure):
+                app.validate_jwt(token)
+            self.assertEqual(app.validate_jwt(token), {"principle": "someone"})
+
+    def test_seconds_until_expiry(self):
+        self.assertAlmostEqual(app.seconds_until_expiry(bearer_token({"exp": time.time() + 60})), 60, delta=1)
+        self.assertIsNone(app.seconds_until_expiry("Bearer not.a-token"))
+        self.assertIsNone(app.seconds_until_expiry(bearer_token({"exp": "tomorrow"})))
+
+    @patch('llc1_document_api.app.jwt_cache')
+    @patch('llc1_document_api.app.validate')
+    def test_validate_jwt_max_ttl(self, validate, mock_cache):
+        """Entries live until the token expires or JWT_CACHE_MAX_TTL, whichever is sooner."""
+        mock_cache.get.return_value = app.MISSING
+        with main.app.test_request_context():
+            g.requests = MagicMock()
+            app.validate_jwt(bearer_token({"exp": time.time() + 3600}))
+            app.validate_jwt(bearer_token({"exp": time.time() + 30}))
+        first, second = mock_cache.set.call_args_list
+        self.assertEqual(first.args[2], main.app.config['JWT_CACHE_MAX_TTL'])
+        self.assertAlmostEqual(second.args[2], 30, delta=1)
+
+    def test_dependency_for(self):
+        self.assertEqual(app.dependency_for(main.app.config['STORAGE_API'] + '/bucket/file'), 'storage-api')
+        self.assertEqual(app.dependency_for("http://elsewhere/"), 'other')
+
+    @patch('llc1_document_api.app.outbound_requests')
+    def test_request_client_timed(self, mock_outbound):
+        """Calls are timed by dependency, including those that fail."""
+        mock_session = MagicMock()
+        mock_session.request.return_value.status_code = 202
+        client = app.RequestClient(mock_session)
+
+        client.post(main.app.config['PDF_GENERATION_API'])
+        mock_session.request.side_effect = ConnectionError()
+        with self.assertRaises(ConnectionError):
+            client.get(main.app.config['STORAGE_API'])
+
+        first, second = mock_outbound.observe.call_args_list
+        self.assertEqual(first.args[1:], ('pdf-generation-api', 'POST', '202'))
+        self.assertEqual(second.args[1:], ('storage-api', 'GET', 'error'))
@@ -0,0 +1,97 @@
+from unittest import TestCase
+from unittest.mock import MagicMock, call, patch
+
+from llc1_document_api.background import BackgroundThreads
+
+
+def with_mock_app(threads, config):
+    """Gives background threads a mock app with config, and a mock session factory as if they had been started."""
+    threads.app = MagicMock()
+    threads.app.config = config
+    threads.session_factory = MagicMock()
+    return threads
+
+
+class StopRunning(BaseException):
+    """Raised to end the otherwise endless loop of run."""
+
+
+class QueueThreads(BackgroundThreads):
+    name = "queue-thread"
+    description = "queue threads"
+    job_description = "job"
+    threads_setting = 'QUEUE_THREADS'
+    poll_setting = 'QUEUE_POLL_INTERVAL'
+
+
+class TestBackground(TestCase):
+
+    def create_threads(self):
+        threads = with_mock_app(QueueThreads(), {"QUEUE_THREADS": 2, "QUEUE_POLL_INTERVAL": 5})
+        threads.claim = MagicMock()
+        threads.execute = MagicMock()
+        return threads
+
+    def test_init_app_registers_start(self):
+        threads = QueueThreads()
+        mock_app = MagicMock()
+        threads.init_app(mock_app)
+        mock_app.before_request.assert_called_with(threads.start)
+
+    def test_init_app_not_started_on_request(self):
+        threads = QueueThreads()
+        threads.start_on_request = False
+        mock_app = MagicMock()
+        threads.init_app(mock_app)
+        mock_app.before_request.assert_not_called()
+
+    @patch('llc1_document_api.background.db')
+    @patch('llc1_document_api.background.threading.Thread')
+    def test_start(self, mock_thread, mock_db):
+        threads = self.create_threads()
+        threads.start()
+        threads.start()
+        self.assertEqual(mock_thread.call_args_list, [
+            call(target=threads.run, name="queue-thread-0", daemon=True),
+            call(target=threads.run, name="queue-thread-1", daemon=True)])
+        self.assertEqual(mock_thread.return_value.start.call_count, 2)
+        self.assertIs(threads.engine, mock_db.engine)
+        threads.app.logger.info.assert_called_with("Started 2 queue threads")
+
+    @patch('llc1_document_api.background.db')
+    @patch('llc1_document_api.background.threading.Thread')
+    def test_start_disabled(self, mock_thread, mock_db):
+        threads = self.create_threads()
+        threads.app.config['QUEUE_THREADS'] = 0
+        threads.start()
+        mock_thread.assert_not_called()
+
+    def test_notify(self):
+        threads = self.create_threads()
+        threads.notify()
+        self.assertTrue(threads.wakeup.acquire(blocking=False))
+        threads.notify(2)
+        self.assertTrue(threads.wakeup.acquire(blocking=False))
+        self.assertTrue(threads.wakeup.acquire(blocking=False))
+        self.assertFalse(threads.wakeup.acquire(blocking=False))
+
+    def test_run(self):
+        """Jobs are executed until there are none left, then the thread waits, and a failed claim is logged."""
+        threads = self.create_threads()
+        threads.claim.side_effect = [{"id": 1}, {"id": 2}, None, Exception("Badness"), {"id": 3}]
+        threads.execute.side_effect = [None, None, StopRunning()]
+
+        with patch.object(threads, 'wait') as mock_wait:
+            with self.assertRaises(StopRunning):
+                threads.run()
+
+        self.assertEqual(threads.execute.call_args_list, [call({"id": 1}), call({"id": 2}), call({"id": 3})])
+        self.assertEqual(mock_wait.call_count, 2)
+        threads.app.logger.exception.assert_called_with("Failed to claim job")
+
+    def test_wait_woken(self):
+        threads = self.create_threads()
+        threads.app.config['QUEUE_POLL_INTERVAL'] = 60
+        threads.notify()
+        threads.wait()
+        self.assertFalse(threads.wakeup.acquire(blocking=False))
@@ -0,0 +1,87 @@
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api import main
+from llc1_document_api.metrics import (Collected, Counter, Histogram, Registry,
+                                       http_requests)
+
+
+class TestMetrics(TestCase):
+
+    def test_counter_per_thread(self):
+        """Values recorded by each thread are added up when collected."""
+        counter = Counter('test_total', "A test counter", ('status',))
+
+        def record():
+            for _ in range(1000):
+                counter.inc('success')
+            counter.inc('failed', amount=2)
+
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.values(), {('success',): 4000, ('failed',): 8})
+
+    def test_finished_thread_retired(self):
+        """The shard of a finished thread is merged into the retired totals, so shards don't grow with threads."""
+        histogram = Histogram('test_seconds', "A test histogram", buckets=(1,))
+        histogram.observe(0.5)
+        for _ in range(3):
+            thread = threading.Thread(target=histogram.observe, args=(2,))
+            thread.start()
+            thread.join()
+
+        self.assertEqual(len(histogram.shards), 1)
+        self.assertEqual(histogram.retired, {(): [0, 3, 6]})
+        self.assertEqual(histogram.values(), {(): [1, 3, 6.5]})
+
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', "A test histogram", ('endpoint',), buckets=(0.1, 1))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        histogram.observe(1, 'a')
+        histogram.observe(5, 'a')
+
+        self.assertEqual(list(histogram.samples()),
+                         [('_bucket', [('endpoint', 'a'), ('le', '0.1')], 1),
+                          ('_bucket', [('endpoint', 'a'), ('le', '1')], 3),
+                          ('_bucket', [('endpoint', 'a'), ('le', '+Inf')], 4),
+                          ('_sum', [('endpoint', 'a')], 6.55),
+                          ('_count', [('endpoint', 'a')], 4)])
+
+    def test_exposition(self):
+        registry = Registry()
+        counter = registry.register(Counter('test_total', "A test counter", ('status',)))
+        registry.register(Collected('test_gauge', "A test gauge", 'gauge', lambda: {(): 3}))
+        counter.inc('not "required"\n')
+
+        with patch('llc1_document_api.metrics.os.getpid', return_value=42):
+            exposition = registry.exposition()
+        self.assertEqual(exposition,
+                         '# HELP test_total A test counter\n'
+                         '# TYPE test_total counter\n'
+                         'test_total{pid="42",status="not \\"required\\"\\n"} 1\n'
+                         '# HELP test_gauge A test gauge\n'
+                         '# TYPE test_gauge gauge\n'
+                         'test_gauge{pid="42"} 3\n')
+
+    @patch('llc1_document_api.app.validate')
+    def test_requests_timed(self, validate):
+        """Each request is timed by its endpoint."""
+        before = http_requests.values().get(('general.check_status', 'GET', '200'), [0])
+        main.app.test_client().get('/health')
+        after = http_requests.values()[('general.check_status', 'GET', '200')]
+        self.assertEqual(sum(after[:-1]), sum(before[:-1]) + 1)
+
+    def test_pool_gauges(self):
+        with main.app.app_context():
+            with patch('llc1_document_api.metrics.db') as mock_db:
+                mock_db.engine.pool = MagicMock(spec=['size', 'checkedout', 'checkedin', 'overflow'])
+                mock_db.engine.pool.checkedout.return_value = 7
+                text = main.app.test_client().get('/metrics').get_data(as_text=True)
+        self.assertIn('llc1_db_pool_checked_out{{pid="{}"}} 7\n'.format(os.getpid()), text)
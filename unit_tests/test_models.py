@@ -2,7 +2,9 @@ import json
 from datetime import datetime
 from unittest import TestCase
 
-from llc1_document_api.models import SearchItem
+from llc1_document_api.models import SearchItem, SearchQuery
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import set_committed_value
 
 POLYGON_FC_GC = {
     "type": "FeatureCollection",
@@ -138,3 +140,62 @@ class TestModels(TestCase):
         search_item = SearchItem(datetime.now(), "")
         self.assertIsNone(search_item.search_geom)
         self.assertIsNone(search_item.search_extent)
+
+    def test_search_item_to_dict_shapely_extent(self):
+        search_item = SearchItem(datetime.now(), "", search_extent=POLYGON_FC_GC)
+        self.assertEqual(json.loads(json.dumps(search_item.to_dict()['search_extent'])), POLYGON_FC)
+
+    def test_search_item_to_dict_geojson_extent(self):
+        search_item = SearchItem(datetime.now(), "")
+        set_committed_value(search_item, 'search_extent_geojson', json.dumps(
+            {"type": "GeometryCollection", "geometries": [POLYGON_FC['features'][0]['geometry']]}))
+        self.assertEqual(search_item.to_dict()['search_extent'], POLYGON_FC)
+
+    def test_search_item_to_dict_geojson_null_extent(self):
+        search_item = SearchItem(datetime.now(), "", search_extent=POLYGON_FC_GC)
+        set_committed_value(search_item, 'search_extent_geojson', None)
+        self.assertIsNone(search_item.to_dict()['search_extent'])
+
+    def test_search_item_number_of_charges(self):
+        search_item = SearchItem(datetime.now(), "", charges=[{}, {}])
+        self.assertEqual(search_item.number_of_charges, 2)
+        search_item.charges = [{}]
+        self.assertEqual(search_item.number_of_charges, 1)
+        search_item.charges = None
+        self.assertIsNone(search_item.number_of_charges)
+
+    def test_search_item_large_columns_deferred(self):
+        columns = str(Query(SearchItem).statement)
+        self.assertNotIn("charges,", columns)
+        self.assertNotIn("search_geom", columns)
+        self.assertIn("number_of_charges", columns)
+
+    def test_search_query_to_dict_format(self):
+        search_query = SearchQuery(datetime(2019, 1, 1), None, "auser", None, None, "STARTED")
+        self.assertEqual(search_query.to_dict(), {"id": None, "request_timestamp": "2019-01-01T00:00:00",
+                                                  "userid": "auser", "status": "STARTED", "format": "json"})
+        search_query = SearchQuery(datetime(2019, 1, 1), None, "auser", None, None, "STARTED", format="csv",
+                                   compression="gzip")
+        self.assertEqual(search_query.to_dict()['format'], "csv")
+        self.assertEqual(search_query.to_dict()['compression'], "gzip")
+
+    def test_search_query_to_dict_progress(self):
+        search_query = SearchQuery(datetime(2019, 1, 1), None, "auser", None, None, "STARTED")
+        self.assertNotIn('progress', search_query.to_dict())
+        search_query.phase = "querying"
+        search_query.rows_scanned = 10
+        search_query.rows_written = 5
+        search_query.bytes_uploaded = 0
+        search_query.phase_timings = {"query": 1.5}
+        self.assertEqual(search_query.to_dict()['progress'], {"phase": "querying", "rows_scanned": 10,
+                                                              "rows_written": 5, "bytes_uploaded": 0,
+                                                              "phase_timings": {"query": 1.5}})
+
+    def test_search_query_ended_clears_authorization(self):
+        """The caller's credentials are kept while a query may run, and cleared whichever way it ends."""
+        for status in ("COMPLETED", "FAILED", "CANCELLED"):
+            search_query = SearchQuery(datetime(2019, 1, 1), None, "auser", None, None, "STARTED",
+                                       authorization_header="Fake JWT")
+            self.assertEqual(search_query.authorization_header, "Fake JWT")
+            search_query.status = status
+            self.assertIsNone(search_query.authorization_header)
@@ -0,0 +1,85 @@
+import threading
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from llc1_document_api.notifications import (GENERATION_CHANNEL,
+                                             GenerationListener,
+                                             notify_generation_finished)
+
+
+class TestNotifications(TestCase):
+
+    def create_listener(self):
+        listener = GenerationListener()
+        listener.app = MagicMock()
+        # Already started, so waiter doesn't start a real listening thread
+        listener.threads = [MagicMock()]
+        return listener
+
+    def test_notify_generation_finished(self):
+        mock_session = MagicMock()
+        notify_generation_finished(mock_session, 12)
+        statement = mock_session.execute.call_args.args[0]
+        self.assertIn("pg_notify", str(statement))
+        self.assertEqual(list(statement.compile().params.values()), [GENERATION_CHANNEL, "12"])
+
+    def test_waiter_woken(self):
+        listener = self.create_listener()
+        with listener.waiter(12) as finished:
+            listener.wake("13")
+            self.assertFalse(finished.is_set())
+            listener.wake("12")
+            self.assertTrue(finished.is_set())
+        self.assertEqual(listener.waiters, {})
+
+    def test_wake_all(self):
+        listener = self.create_listener()
+        with listener.waiter(12) as first, listener.waiter(13) as second:
+            listener.wake()
+            self.assertTrue(first.is_set())
+            self.assertTrue(second.is_set())
+
+    def test_waiter_woken_from_thread(self):
+        listener = self.create_listener()
+        with listener.waiter(12) as finished:
+            threading.Timer(0.01, listener.wake, args=("12",)).start()
+            self.assertTrue(finished.wait(5))
+
+    def test_init_app_not_started_on_request(self):
+        listener = GenerationListener()
+        mock_app = MagicMock()
+        listener.init_app(mock_app)
+        mock_app.before_request.assert_not_called()
+
+    @patch.object(GenerationListener, 'start')
+    def test_waiter_starts_listener(self, mock_start):
+        listener = GenerationListener()
+        with listener.waiter(12):
+            mock_start.assert_called_once()
+
+    @patch('llc1_document_api.notifications.select')
+    def test_listen(self, mock_select):
+        listener = self.create_listener()
+        listener.engine = MagicMock()
+        mock_connection = listener.engine.raw_connection.return_value
+        dbapi_connection = mock_connection.connection
+        notification = MagicMock(payload="12")
+        dbapi_connection.notifies = []
+
+        def poll():
+            dbapi_connection.notifies.append(notification)
+
+        dbapi_connection.poll.side_effect = poll
+        mock_select.select.side_effect = [([], [], []), ([dbapi_connection], [], []), Exception("Connection lost")]
+
+        with listener.waiter(12) as finished:
+            with self.assertRaises(Exception):
+                listener.listen()
+            self.assertTrue(finished.is_set())
+
+        mock_connection.detach.assert_called()
+        self.assertTrue(dbapi_connection.autocommit)
+        dbapi_connection.cursor.return_value.__enter__.return_value.execute.assert_called_with(
+            "LISTEN " + GENERATION_CHANNEL)
+        self.assertEqual(dbapi_connection.notifies, [])
+        mock_connection.close.assert_called()
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from llc1_document_api.utilities.cache import MISSING, TTLCache
+
+
+class TestCache(TestCase):
+
+    def test_get_missing(self):
+        cache = TTLCache(2, 60)
+        self.assertIs(cache.get("key"), MISSING)
+        self.assertIsNone(cache.get("key", None))
+
+    def test_set_get(self):
+        cache = TTLCache(2, 60)
+        cache.set("key", "value")
+        cache.set("none", None)
+        self.assertEqual(cache.get("key"), "value")
+        self.assertIsNone(cache.get("none"))
+
+    @patch('llc1_document_api.utilities.cache.time')
+    def test_expiry(self, mock_time):
+        cache = TTLCache(2, 60)
+        mock_time.monotonic.return_value = 100
+        cache.set("key", "value")
+        cache.set("short", "value", 10)
+        mock_time.monotonic.return_value = 110
+        self.assertEqual(cache.get("key"), "value")
+        self.assertIs(cache.get("short"), MISSING)
+        mock_time.monotonic.return_value = 160
+        self.assertIs(cache.get("key"), MISSING)
+        self.assertEqual(len(cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_delete_and_clear(self):
+        cache = TTLCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        self.assertIs(cache.get("a"), MISSING)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
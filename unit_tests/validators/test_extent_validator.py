@@ -1,7 +1,8 @@
 from unittest import TestCase
 
 import simplejson as json
-from llc1_document_api.validators.payload_validator import PayloadValidator
+from llc1_document_api.validators.payload_validator import (
+    PayloadValidator, inline_definitions)
 
 
 class TestExtentValidator(TestCase):
@@ -97,13 +98,41 @@ class TestExtentValidator(TestCase):
     ]
 
     def test_validate_with_valid_input(self):
-        """All valid inputs should return True."""
+        """All valid inputs should be returned parsed."""
         for input_ in self.VALID_INPUT:
             result = PayloadValidator.validate(json.dumps(input_))
-            self.assertTrue(result)
+            self.assertEqual(result, input_)
 
     def test_validate_with_invalid_input(self):
-        """All invalid inputs should return False."""
+        """All invalid inputs should return None."""
         for input_ in self.INVALID_INPUT:
             result = PayloadValidator.validate(json.dumps(input_))
-            self.assertFalse(result)
+            self.assertIsNone(result)
+        self.assertIsNone(PayloadValidator.validate('not json'))
+
+    def test_validate_callback(self):
+        """A valid callback is returned parsed, an invalid one as None."""
+        callback = {"status": "success", "result": {"document_url": "/abc", "external_url": "http://abc"}}
+        self.assertEqual(PayloadValidator.validate_callback(json.dumps(callback)), callback)
+        self.assertIsNone(PayloadValidator.validate_callback(json.dumps({"status": "success"})))
+        self.assertIsNone(PayloadValidator.validate_callback('not json'))
+
+    def test_validate_batch(self):
+        """Each payload is returned with its first error, or None if it is valid."""
+        results = PayloadValidator.validate_batch(json.dumps([self.VALID_POLYGON, self.MISSING_SOURCE]))
+        self.assertEqual(results[0], (self.VALID_POLYGON, None))
+        self.assertEqual(results[1][0], self.MISSING_SOURCE)
+        self.assertIn("'source' is a required property", results[1][1])
+
+    def test_validate_batch_not_array(self):
+        """A batch that isn't a JSON array is invalid."""
+        self.assertIsNone(PayloadValidator.validate_batch(json.dumps(self.VALID_POLYGON)))
+        self.assertIsNone(PayloadValidator.validate_batch('not json'))
+
+    def test_inline_definitions(self):
+        """References to definitions are replaced by the definitions, which are then dropped."""
+        schema = {"type": "array", "items": {"$ref": "#/definitions/pair"},
+                  "definitions": {"pair": {"type": "array", "items": {"$ref": "#/definitions/number"}},
+                                  "number": {"type": "number"}}}
+        self.assertEqual(inline_definitions(schema),
+                         {"type": "array", "items": {"type": "array", "items": {"type": "number"}}})
@@ -5,6 +5,11 @@ from flask import url_for
 from flask_testing import TestCase
 from llc1_document_api import main
 from llc1_document_api.models import SearchItem
+from llc1_document_api.views.v1_0.generate import POLL_COLUMNS, WITH_CHARGES
+
+EXTENTS = {"type": "FeatureCollection",
+           "features": [{"type": "Feature", "properties": {},
+                         "geometry": {"type": "Point", "coordinates": [290000, 91000]}}]}
 
 
 class TestGenerate(TestCase):
@@ -15,7 +20,7 @@ class TestGenerate(TestCase):
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.views.v1_0.generate.PayloadValidator')
     def test_generate_diff_format_no_charges(self, extent_validator_mock, validate):
-        extent_validator_mock.validate.return_value = True
+        extent_validator_mock.validate.side_effect = json.loads
 
         with main.app.app_context():
             response = self.client.post(url_for('generate.generate_llc1_async'),
@@ -33,7 +38,7 @@ class TestGenerate(TestCase):
     ):
         expected_response = {"search_reference": "000 000 010", "status": "created"}
 
-        extent_validator_mock.validate.return_value = True
+        extent_validator_mock.validate.side_effect = json.loads
         mock_db.session.add = mock_add_add_id
 
         with main.app.app_context():
@@ -55,7 +60,7 @@ class TestGenerate(TestCase):
     ):
         expected_response = {'error_code': 'LLC1-01', 'error_message': 'Error recording LLC1'}
 
-        extent_validator_mock.validate.return_value = True
+        extent_validator_mock.validate.side_effect = json.loads
         mock_db.session.add.side_effect = Exception("Nooooo")
 
         with main.app.app_context():
@@ -72,13 +77,14 @@ class TestGenerate(TestCase):
 
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.views.v1_0.generate.PayloadValidator')
+    @patch('llc1_document_api.views.v1_0.generate.pdf_dispatcher')
     @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
     def test_generate_async(
-        self, mock_pdf, extent_validator_mock, validate
+        self, mock_pdf, mock_dispatcher, extent_validator_mock, validate
     ):
         expected_response = {"search_reference": "000 000 010", "status": "generating"}
 
-        extent_validator_mock.validate.return_value = True
+        extent_validator_mock.validate.side_effect = json.loads
         mock_pdf.generate_pdf = mock_generate_pdf_add_id
 
         response = self.client.post(url_for('generate.generate_llc1_async'),
@@ -89,13 +95,84 @@ class TestGenerate(TestCase):
         response_json = json.loads(response.get_data(as_text=True))
         self.assert_status(response, 202)
         self.assertEqual(response_json, expected_response)
+        mock_dispatcher.notify.assert_called()
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.pdf_dispatcher')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    def test_generate_async_batch(self, mock_pdf, mock_dispatcher, validate):
+        def generate_pdfs(batch):
+            for index, (_, search_item) in enumerate(batch):
+                search_item.id = 10 + index
+                search_item.generation_status = search_item.generation_status or "generating"
+            return 1
+
+        mock_pdf.generate_pdfs.side_effect = generate_pdfs
+
+        response = self.client.post(url_for('generate.generate_llc1_async_batch'),
+                                    data=json.dumps([{"source": "LLC1 Unit Test", "extents": EXTENTS},
+                                                     {"extents": EXTENTS},
+                                                     {"source": "LLC1 Unit Test", "format": "JSON", "charges": [],
+                                                      "extents": EXTENTS},
+                                                     {"source": "LLC1 Unit Test", "format": "JSON",
+                                                      "extents": EXTENTS}]),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        self.assertEqual(response.json, [
+            {"search_reference": "000 000 010", "status": "generating"},
+            {"status": "invalid", "error": "'source' is a required property"},
+            {"search_reference": "000 000 011", "status": "created"},
+            {"status": "invalid", "error": "Alternative format requests must contain a list of charges"}])
+        batch = mock_pdf.generate_pdfs.call_args.args[0]
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(batch[1][1].charges, [])
+        mock_dispatcher.notify.assert_called_with(1)
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    def test_generate_async_batch_not_array(self, mock_pdf, validate):
+        response = self.client.post(url_for('generate.generate_llc1_async_batch'),
+                                    data=json.dumps({"source": "LLC1 Unit Test", "extents": EXTENTS}),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 400)
+        mock_pdf.generate_pdfs.assert_not_called()
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.config')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    def test_generate_async_batch_too_large(self, mock_pdf, mock_config, validate):
+        mock_config.LLC1_BATCH_MAX_SIZE = 1
+        response = self.client.post(url_for('generate.generate_llc1_async_batch'),
+                                    data=json.dumps([{"source": "LLC1 Unit Test", "extents": EXTENTS}] * 2),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 400)
+        mock_pdf.generate_pdfs.assert_not_called()
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.db')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    def test_generate_async_batch_exception(self, mock_pdf, mock_db, validate):
+        mock_pdf.generate_pdfs.side_effect = Exception("Nooooo")
+        response = self.client.post(url_for('generate.generate_llc1_async_batch'),
+                                    data=json.dumps([{"source": "LLC1 Unit Test", "extents": EXTENTS}]),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 500)
+        mock_db.session.rollback.assert_called()
 
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
     @patch('llc1_document_api.views.v1_0.generate.SearchItem')
     def test_poll_llc1_not_found(self, mock_search_item, mock_pdf, validate):
 
-        mock_search_item.query.get.return_value = None
+        mock_search_item.query.options.return_value.get.return_value = None
 
         response = self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010",
                                            return_supporting_docs=True),
@@ -112,7 +189,7 @@ class TestGenerate(TestCase):
     @patch('llc1_document_api.views.v1_0.generate.SearchItem')
     def test_poll_llc1_not_finished(self, mock_search_item, mock_pdf, validate):
 
-        mock_search_item.query.get.return_value = SearchItem(MagicMock(), "", "")
+        mock_search_item.query.options.return_value.get.return_value = SearchItem(MagicMock(), "", "")
 
         mock_pdf.check_for_result.return_value = None
 
@@ -130,7 +207,7 @@ class TestGenerate(TestCase):
     @patch('llc1_document_api.views.v1_0.generate.SearchItem')
     def test_poll_llc1_ok(self, mock_search_item, mock_pdf, validate):
 
-        mock_search_item.query.get.return_value = SearchItem(MagicMock(), "", "")
+        mock_search_item.query.options.return_value.get.return_value = SearchItem(MagicMock(), "", "")
 
         mock_pdf.check_for_result.return_value = {"a": "result"}
 
@@ -143,6 +220,67 @@ class TestGenerate(TestCase):
         self.assert_status(response, 201)
         self.assertEqual(response_json, {"a": "result"})
 
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.db')
+    @patch('llc1_document_api.views.v1_0.generate.generation_listener')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    @patch('llc1_document_api.views.v1_0.generate.SearchItem')
+    def test_poll_llc1_long_poll(self, mock_search_item, mock_pdf, mock_listener, mock_db, validate):
+        mock_search_item.query.options.return_value.get.return_value = SearchItem(MagicMock(), "", "")
+        mock_pdf.check_for_result.side_effect = [None, {"a": "result"}]
+        mock_finished = mock_listener.waiter.return_value.__enter__.return_value
+        mock_finished.wait.return_value = True
+
+        response = self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010", wait=10),
+                                   headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 201)
+        self.assertEqual(response.json, {"a": "result"})
+        mock_listener.waiter.assert_called_with(10)
+        mock_finished.wait.assert_called_with(10)
+        mock_db.session.close.assert_called()
+        self.assertEqual(mock_search_item.query.options.return_value.get.call_count, 2)
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.db')
+    @patch('llc1_document_api.views.v1_0.generate.generation_listener')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    @patch('llc1_document_api.views.v1_0.generate.SearchItem')
+    def test_poll_llc1_long_poll_deadline(self, mock_search_item, mock_pdf, mock_listener, mock_db, validate):
+        mock_search_item.query.options.return_value.get.return_value = SearchItem(MagicMock(), "", "")
+        mock_pdf.check_for_result.return_value = None
+        mock_finished = mock_listener.waiter.return_value.__enter__.return_value
+        mock_finished.wait.return_value = False
+
+        response = self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010", wait=3600),
+                                   headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        self.assertEqual(response.json, {"status": "generating"})
+        mock_finished.wait.assert_called_with(20)
+        self.assertEqual(mock_search_item.query.options.return_value.get.call_count, 1)
+
+    @patch('llc1_document_api.app.validate')
+    def test_poll_llc1_invalid_wait(self, validate):
+        response = self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010", wait="soon"),
+                                   headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 400)
+
+    @patch('llc1_document_api.app.validate')
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    @patch('llc1_document_api.views.v1_0.generate.SearchItem')
+    def test_poll_llc1_loads_charges_only_for_supporting_docs(self, mock_search_item, mock_pdf, validate):
+        mock_pdf.check_for_result.return_value = {"a": "result"}
+
+        self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010"),
+                        headers={'Authorization': 'Fake JWT'})
+        mock_search_item.query.options.assert_called_with(POLL_COLUMNS)
+
+        self.client.get(url_for('generate.poll_llc1', search_ref="000 000 010", return_supporting_docs=True),
+                        headers={'Authorization': 'Fake JWT'})
+        mock_search_item.query.options.assert_called_with(POLL_COLUMNS, WITH_CHARGES)
+
     @patch('llc1_document_api.app.validate')
     def test_callback_llc1_invalid(self, validate):
 
@@ -160,7 +298,7 @@ class TestGenerate(TestCase):
     def test_callback_llc1_not_found(self, mock_search_item, validate):
         with main.app.test_request_context():
 
-            mock_search_item.query.get.return_value = None
+            mock_search_item.query.options.return_value.get.return_value = None
 
             response = self.client.post(url_for('generate.callback_llc1', search_ref="000 000 010",),
                                         data=json.dumps({"status": "doesn't", "result": {"matter": "here"}}),
@@ -178,14 +316,15 @@ class TestGenerate(TestCase):
     def test_callback_llc1_ok(self, mock_search_item, mock_pdf, validate):
         with main.app.test_request_context():
 
-            mock_search_item.query.get.return_value = SearchItem(MagicMock(), "", "")
+            mock_search_item.query.options.return_value.get.return_value = SearchItem(MagicMock(), "", "")
 
             response = self.client.post(url_for('generate.callback_llc1', search_ref="000 000 010",),
                                         data=json.dumps({"status": "doesn't", "result": {"matter": "here"}}),
                                         content_type="application/json",
                                         headers={'Authorization': 'Fake JWT'})
 
-            mock_pdf.callback.assert_called()
+            mock_pdf.callback.assert_called_with(mock_search_item.query.options.return_value.get.return_value,
+                                                 {"status": "doesn't", "result": {"matter": "here"}})
             response_json = json.loads(response.get_data(as_text=True))
             self.assert_status(response, 202)
             self.assertEqual(response_json, {"status": "accepted"})
@@ -195,7 +334,8 @@ class TestGenerate(TestCase):
     def test_languages(self, mock_validate, mock_pdf):
         with main.app.test_request_context():
 
-            mock_pdf.get_languages.return_value = '{"en": "English"}'
+            mock_pdf.get_languages.return_value.text = '{"en": "English"}'
+            mock_pdf.get_languages.return_value.etag = 'abc123'
 
             response = self.client.get(url_for('generate.llc1_languages'),
                                        headers={'Authorization': 'Fake JWT'})
@@ -203,6 +343,22 @@ class TestGenerate(TestCase):
             response_json = json.loads(response.get_data(as_text=True))
             self.assert_status(response, 200)
             self.assertEqual(response_json, {"en": "English"})
+            self.assertEqual(response.headers['ETag'], '"abc123"')
+            self.assertIn('private', response.headers['Cache-Control'])
+
+    @patch('llc1_document_api.views.v1_0.generate.PdfGenerationService')
+    @patch('llc1_document_api.app.validate')
+    def test_languages_not_modified(self, mock_validate, mock_pdf):
+        with main.app.test_request_context():
+
+            mock_pdf.get_languages.return_value.text = '{"en": "English"}'
+            mock_pdf.get_languages.return_value.etag = 'abc123'
+
+            response = self.client.get(url_for('generate.llc1_languages'),
+                                       headers={'Authorization': 'Fake JWT', 'If-None-Match': '"abc123"'})
+
+            self.assert_status(response, 304)
+            self.assertEqual(response.get_data(as_text=True), '')
 
 
 def mock_add_add_id(search_item):
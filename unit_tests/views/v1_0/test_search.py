@@ -5,9 +5,7 @@ from unittest.mock import MagicMock, patch
 from flask import url_for
 from flask_testing import TestCase
 from llc1_document_api import main
-from llc1_document_api.exceptions import ApplicationError
-from llc1_document_api.views.v1_0.search import get_email, search_query
-from unit_tests.test_models import POLYGON_FC, POLYGON_FC_GC
+from unit_tests.test_models import POLYGON_FC_GC
 
 
 class TestSearch(TestCase):
@@ -15,26 +13,6 @@ class TestSearch(TestCase):
     def create_app(self):
         return main.app
 
-    def test_get_email_none(self):
-        result = get_email(None, {}, MagicMock(), MagicMock())
-        self.assertEqual(result, "N/A")
-
-    def test_get_email_cached(self):
-        result = get_email("custard", {"custard": {"email": "an@email.com"}}, MagicMock(), MagicMock())
-        self.assertEqual(result, "an@email.com")
-
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_get_email_not_cached(self, mock_sllc):
-        mock_sllc.get_user_information.return_value = {"email": "another@email.com"}
-        result = get_email("custard", {}, MagicMock(), MagicMock())
-        self.assertEqual(result, "another@email.com")
-
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_get_email_not_found(self, mock_sllc):
-        mock_sllc.get_user_information.return_value = None
-        result = get_email("custard", {}, MagicMock(), MagicMock())
-        self.assertEqual(result, None)
-
     @patch('llc1_document_api.app.validate')
     @patch('llc1_document_api.views.v1_0.search.SearchQuery')
     def test_get_paid_search_query_not_found(self, mock_search_query, extent_validator_mock):
@@ -84,12 +62,13 @@ class TestSearch(TestCase):
 
         self.assert_status(response, 400)
 
+    @patch('llc1_document_api.views.v1_0.search.reuse_existing_results', return_value=None)
     @patch('llc1_document_api.views.v1_0.search.db')
     @patch('llc1_document_api.views.v1_0.search.SearchQuery')
-    @patch('llc1_document_api.views.v1_0.search.Thread')
+    @patch('llc1_document_api.views.v1_0.search.export_workers')
     @patch('llc1_document_api.app.validate')
-    def test_post_paid_search_query_valid_json_gc(self, extent_validator_mock, mock_thread, mock_search_query,
-                                                  mock_db):
+    def test_post_paid_search_query_valid_json_gc(self, extent_validator_mock, mock_workers, mock_search_query,
+                                                  mock_db, mock_reuse):
         extent_validator_mock.validate.return_value = True
         mock_search_query_obj = MagicMock()
         mock_search_query.return_value = mock_search_query_obj
@@ -102,244 +81,200 @@ class TestSearch(TestCase):
                                     headers={'Authorization': 'Fake JWT'})
 
         self.assert_status(response, 202)
-        mock_thread.assert_called()
         mock_db.session.add.assert_called_with(mock_search_query_obj)
         mock_db.session.commit.assert_called()
-        mock_thread.return_value.start.assert_called()
+        mock_workers.notify.assert_called()
+        parameters = mock_search_query.call_args.kwargs['parameters']
+        self.assertEqual(parameters['start_timestamp'], "2019-01-01T00:00:00")
+        self.assertEqual(parameters['end_timestamp'], "2019-01-02T00:00:00")
+        self.assertEqual(parameters['extent'], POLYGON_FC_GC)
+        self.assertEqual(mock_search_query.call_args.kwargs['authorization_header'], 'Fake JWT')
+        self.assertEqual(len(mock_search_query.call_args.kwargs['fingerprint']), 64)
+        mock_reuse.assert_called_with(mock_db.session, mock_search_query_obj, datetime(2019, 1, 1),
+                                      datetime(2019, 1, 2))
+        self.assertEqual(mock_search_query.call_args.kwargs['format'], 'json')
+        self.assertIsNone(mock_search_query.call_args.kwargs['compression'])
         response_json = json.loads(response.get_data(as_text=True))
         self.assertEqual(response_json, {'some': 'json'})
 
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC_GC, "anid", mock_session, 1, "abucket",
-                     mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_fc(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC, "anid", mock_session, 1, "abucket",
-                     mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_geom(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC['features'][0]['geometry'], "anid", mock_session,
-                     1, "abucket", mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_fc_no_contact(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC, None, mock_session, 1, "abucket",
-                     mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_fc_no_extent(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), None, "anid", mock_session, 1, "abucket",
-                     mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_fc_no_extent_no_contact(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket",
-                     mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_fc_not_found(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = None
-        with self.assertRaises(ApplicationError):
-            search_query(123, datetime.now(), datetime.now(), None, None, mock_session, 1, "abucket",
-                         mock_logger, mock_requests)
-        mock_session.commit.assert_not_called()
-        mock_storage.save_files.assert_called()
-        self.assertNotEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_ok_f(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.return_value = {"source": "SEARCH", "contact_id": "anid"}
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC['features'][0], "anid", mock_session, 1,
-                     "abucket", mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_called()
-        self.assertEqual(mock_search_query.status, "COMPLETED")
-        mock_result.to_dict.assert_called()
-
-    @patch('llc1_document_api.views.v1_0.search.StorageAPIService')
-    @patch('llc1_document_api.views.v1_0.search.SearchLocalLandChargeService')
-    def test_search_query_exception(self, mock_search_llc, mock_storage):
-        mock_session = MagicMock()
-        mock_logger = MagicMock()
-        mock_requests = MagicMock()
-        mock_result = MagicMock()
-        mock_result.to_dict.side_effect = Exception("Badness")
-        mock_session.query.return_value.filter.return_value.filter.return_value.filter.return_value.filter.\
-            return_value.filter.return_value.order_by.return_value.all.return_value = [
-                mock_result
-            ]
-        mock_storage.save_files.return_value = {"file": [{
-            "reference": "filereference",
-            "external_reference": "externalfilereference"
-        }]}
-        mock_search_llc.get_user_information.return_value = {"email": "anemail@someplace.com"}
-        mock_search_query = MagicMock()
-        mock_session.query.return_value.filter.return_value.one_or_none.return_value = mock_search_query
-        search_query(123, datetime.now(), datetime.now(), POLYGON_FC['features'][0], "anid", mock_session, 1,
-                     "abucket", mock_logger, mock_requests)
-        mock_session.commit.assert_called()
-        mock_storage.save_files.assert_not_called()
-        self.assertEqual(mock_search_query.status, "FAILED")
-        mock_result.to_dict.assert_called()
+    @patch('llc1_document_api.views.v1_0.search.reuse_existing_results', return_value=None)
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.views.v1_0.search.export_workers')
+    @patch('llc1_document_api.app.validate')
+    def test_post_paid_search_query_format(self, extent_validator_mock, mock_workers, mock_search_query, mock_db,
+                                           mock_reuse):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.return_value.to_dict.return_value = {"some": "json"}
+        response = self.client.post(url_for('search.post_paid_search_query'),
+                                    data=json.dumps({"start_timestamp": "2019-01-01T00:00:00.000",
+                                                     "end_timestamp": "2019-01-02T00:00:00.000",
+                                                     "format": "csv", "compression": "gzip"}),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        self.assertEqual(mock_search_query.call_args.kwargs['format'], 'csv')
+        self.assertEqual(mock_search_query.call_args.kwargs['compression'], 'gzip')
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.app.validate')
+    def test_post_paid_search_query_invalid_format(self, extent_validator_mock, mock_db):
+        extent_validator_mock.validate.return_value = True
+        for body in ({"format": "xml"}, {"format": "csv", "compression": "zip"}):
+            body.update({"start_timestamp": "2019-01-01T00:00:00.000", "end_timestamp": "2019-01-02T00:00:00.000"})
+            response = self.client.post(url_for('search.post_paid_search_query'), data=json.dumps(body),
+                                        content_type="application/json", headers={'Authorization': 'Fake JWT'})
+            self.assert_status(response, 400)
+        mock_db.session.add.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.views.v1_0.search.export_workers')
+    @patch('llc1_document_api.app.validate')
+    def test_resume_paid_search_query(self, extent_validator_mock, mock_workers, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query_obj = MagicMock()
+        mock_search_query_obj.status = "FAILED"
+        mock_search_query_obj.attempts = 3
+        mock_search_query_obj.to_dict.return_value = {"some": "json"}
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value = \
+            mock_search_query_obj
+
+        response = self.client.post(url_for('search.resume_paid_search_query', query_id=1),
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        self.assertEqual(mock_search_query_obj.status, "STARTED")
+        self.assertEqual(mock_search_query_obj.attempts, 0)
+        self.assertEqual(mock_search_query_obj.phase, "queued")
+        self.assertIsNone(mock_search_query_obj.heartbeat_timestamp)
+        self.assertIsNone(mock_search_query_obj.completion_timestamp)
+        self.assertIsNone(mock_search_query_obj.backend_pids)
+        self.assertEqual(mock_search_query_obj.authorization_header, 'Fake JWT')
+        mock_db.session.commit.assert_called()
+        mock_workers.notify.assert_called()
+        self.assertEqual(response.json, {"some": "json"})
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.app.validate')
+    def test_resume_paid_search_query_not_found(self, extent_validator_mock, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value = None
+
+        response = self.client.post(url_for('search.resume_paid_search_query', query_id=1),
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 404)
+        mock_db.session.commit.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.app.validate')
+    def test_resume_paid_search_query_not_failed(self, extent_validator_mock, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value.status = \
+            "COMPLETED"
+
+        response = self.client.post(url_for('search.resume_paid_search_query', query_id=1),
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 409)
+        mock_db.session.commit.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.app.validate')
+    def test_cancel_paid_search_query(self, extent_validator_mock, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query_obj = MagicMock()
+        mock_search_query_obj.status = "STARTED"
+        mock_search_query_obj.id = 1
+        mock_search_query_obj.backend_pids = [1234, 5678]
+        mock_search_query_obj.to_dict.return_value = {"some": "json"}
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value = \
+            mock_search_query_obj
+
+        response = self.client.delete(url_for('search.cancel_paid_search_query', query_id=1),
+                                      headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 200)
+        self.assertEqual(mock_search_query_obj.status, "CANCELLED")
+        self.assertEqual(mock_search_query_obj.phase, "cancelled")
+        self.assertIsNotNone(mock_search_query_obj.completion_timestamp)
+        mock_db.session.execute.assert_called_once()
+        statement = mock_db.session.execute.call_args.args[0]
+        self.assertIn("pg_cancel_backend", str(statement))
+        self.assertIn("pg_stat_activity.application_name", str(statement))
+        self.assertIn("llc1-export-1", statement.compile().params.values())
+        mock_db.session.commit.assert_called()
+        self.assertEqual(response.json, {"some": "json"})
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.app.validate')
+    def test_cancel_paid_search_query_not_found(self, extent_validator_mock, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value = None
+
+        response = self.client.delete(url_for('search.cancel_paid_search_query', query_id=1),
+                                      headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 404)
+        mock_db.session.execute.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.app.validate')
+    def test_cancel_paid_search_query_not_running(self, extent_validator_mock, mock_search_query, mock_db):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.query.filter.return_value.with_for_update.return_value.one_or_none.return_value.status = \
+            "COMPLETED"
+
+        response = self.client.delete(url_for('search.cancel_paid_search_query', query_id=1),
+                                      headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 409)
+        mock_db.session.commit.assert_not_called()
+        mock_db.session.execute.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.reuse_existing_results')
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.views.v1_0.search.export_workers')
+    @patch('llc1_document_api.app.validate')
+    def test_post_paid_search_query_shares_running_query(self, extent_validator_mock, mock_workers,
+                                                         mock_search_query, mock_db, mock_reuse):
+        extent_validator_mock.validate.return_value = True
+        mock_reuse.return_value.to_dict.return_value = {"shared": "json"}
+        response = self.client.post(url_for('search.post_paid_search_query'),
+                                    data=json.dumps({"start_timestamp": "2019-01-01T00:00:00.000",
+                                                     "end_timestamp": "2019-01-02T00:00:00.000"}),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        self.assertEqual(response.json, {"shared": "json"})
+        mock_db.session.add.assert_not_called()
+        mock_workers.notify.assert_not_called()
+
+    @patch('llc1_document_api.views.v1_0.search.reuse_existing_results', return_value=None)
+    @patch('llc1_document_api.views.v1_0.search.db')
+    @patch('llc1_document_api.views.v1_0.search.SearchQuery')
+    @patch('llc1_document_api.views.v1_0.search.export_workers')
+    @patch('llc1_document_api.app.validate')
+    def test_post_paid_search_query_reuses_results(self, extent_validator_mock, mock_workers, mock_search_query,
+                                                   mock_db, mock_reuse):
+        extent_validator_mock.validate.return_value = True
+        mock_search_query.return_value.status = "COMPLETED"
+        mock_search_query.return_value.to_dict.return_value = {"some": "json"}
+        response = self.client.post(url_for('search.post_paid_search_query'),
+                                    data=json.dumps({"start_timestamp": "2019-01-01T00:00:00.000",
+                                                     "end_timestamp": "2019-01-02T00:00:00.000"}),
+                                    content_type="application/json",
+                                    headers={'Authorization': 'Fake JWT'})
+
+        self.assert_status(response, 202)
+        mock_db.session.add.assert_called_with(mock_search_query.return_value)
+        mock_workers.notify.assert_not_called()